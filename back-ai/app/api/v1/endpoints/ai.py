@@ -1,13 +1,23 @@
 # (НОВЫЙ ФАЙЛ)
 # Эндпоинты, которые будет вызывать ai_client
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
+from typing import Optional
 from uuid import UUID
+import asyncio
+import hashlib
+import os
+import uuid
 
 from app.services.rag_service import rag_service
+from app.services.llm_gateway import LLMOverloadedError
 from app.services import parser as doc_parser
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.responses import negotiated_response
 from app import schemas_ai # Используем локальные схемы _ai
 
 router = APIRouter()
+os.makedirs(settings.FILE_SPOOL_DIR, exist_ok=True)
 
 # Проверка, что rag_service инициализировался
 def get_rag_service():
@@ -18,43 +28,132 @@ def get_rag_service():
 @router.post("/process-file", status_code=status.HTTP_200_OK)
 async def process_file(
     req: schemas_ai.FileProcessingRequest,
+    request: Request,
     rag: rag_service = Depends(get_rag_service)
 ):
     """Эндпоинт для парсинга, чанкинга и эмбеддинга ФАЙЛА."""
     print(f"[AI Service] Task: process_file for {req.filename} (Source ID: {req.source_id})")
+
+    # 0. Этот файл (blob) уже обработан: копируем готовые эмбеддинги, без парсинга и эмбеддинга
+    if req.reuse_from:
+        try:
+            chunk_count = await rag.copy_embeddings(
+                from_collection_name=req.reuse_from.collection_name,
+                from_source_id=req.reuse_from.source_id,
+                chunk_count=req.reuse_from.chunk_count,
+                collection_name=str(req.workspace_id),
+                source_id=req.source_id,
+                source_name=req.filename
+            )
+            return negotiated_response(request, {"status": "COMPLETED", "source_id": req.source_id, "chunk_count": chunk_count})
+        except Exception as e:
+            print(f"[AI Service] Reuse of {req.reuse_from.source_id} failed, processing from scratch. Error: {e}")
+
+    if not req.file_path:
+        # Файл не на общем томе: back передаст его потоком в /process-file-stream
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="File content required")
+
     try:
-        # 1. Парсинг и Чанкинг
-        if req.filename.endswith('.pdf'):
-            docs = doc_parser.parse_pdf(req.file_path, req.filename)
-        elif req.filename.endswith('.docx'):
-            docs = doc_parser.parse_docx(req.file_path, req.filename)
-        elif req.filename.endswith('.txt'):
-            docs = doc_parser.parse_txt(req.file_path, req.filename)
-        else:
-            raise ValueError(f"Unsupported file type: {req.filename}")
-
-        if not docs:
-            raise ValueError("File parsing resulted in 0 documents.")
-
-        text_chunks = [doc.page_content for doc in docs]
-        metadata_list = [doc.metadata for doc in docs]
-
-        # 2. Эмбеддинг и сохранение в ChromaDB
-        await rag.process_and_embed_chunks(
-            collection_name=str(req.workspace_id),
-            source_id=req.source_id,
-            text_chunks=text_chunks,
-            metadata_list=metadata_list
-        )
-        return {"status": "COMPLETED", "source_id": req.source_id}
+        chunk_count = await _ingest_file(rag, req.workspace_id, req.source_id, req.file_path, req.filename)
+        return negotiated_response(request, {"status": "COMPLETED", "source_id": req.source_id, "chunk_count": chunk_count})
 
+    except doc_parser.DocumentParseError as e:
+        print(f"[AI Service] Bad document {req.filename}: {e}")
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
     except Exception as e:
         print(f"[AI Service] FAILED processing {req.filename}. Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/process-file-stream", status_code=status.HTTP_200_OK)
+async def process_file_stream(
+    workspace_id: UUID,
+    source_id: UUID,
+    filename: str,
+    request: Request,
+    content_sha256: Optional[str] = None,
+    rag: rag_service = Depends(get_rag_service)
+):
+    """
+    То же, что /process-file, но файл приходит в теле запроса (chunked), а не через общий том.
+    Тело пишется на локальный диск кусками по мере получения и удаляется после обработки
+    (в том числе при любой ошибке). Больше MAX_UPLOAD_SIZE_BYTES - 413.
+    """
+    print(f"[AI Service] Task: process_file_stream for {filename} (Source ID: {source_id})")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_UPLOAD_SIZE_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File is too large")
+    spool_path = os.path.join(settings.FILE_SPOOL_DIR, f"{uuid.uuid4()}{os.path.splitext(filename)[1]}")
+    try:
+        # 1. Принимаем файл
+        sha256 = await _spool_request_body(request, spool_path)
+        if content_sha256 and sha256 != content_sha256:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Checksum mismatch")
+
+        # 2. Парсинг, чанкинг, эмбеддинг
+        try:
+            chunk_count = await _ingest_file(rag, workspace_id, source_id, spool_path, filename)
+        except doc_parser.DocumentParseError as e:
+            print(f"[AI Service] Bad document {filename}: {e}")
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+        except Exception as e:
+            print(f"[AI Service] FAILED processing {filename}. Error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        return negotiated_response(request, {"status": "COMPLETED", "source_id": source_id, "chunk_count": chunk_count})
+    finally:
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
+
+async def _spool_request_body(request: Request, path: str) -> str:
+    """
+    Пишет тело запроса в файл по мере получения. Возвращает sha256 содержимого.
+    Chunked-тело без Content-Length ограничивается по мере записи (413 при превышении).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as out_file:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > settings.MAX_UPLOAD_SIZE_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File is too large")
+            digest.update(chunk)
+            await asyncio.to_thread(out_file.write, chunk)
+    return digest.hexdigest()
+
+async def _ingest_file(rag, workspace_id: UUID, source_id: UUID, file_path: str, filename: str) -> int:
+    """
+    Парсинг, чанкинг и эмбеддинг файла. Возвращает число чанков.
+    DocumentParseError - файл неподдерживаемого типа или не разбирается (ошибка входных данных).
+    """
+    # 1. Парсинг и Чанкинг
+    if filename.endswith('.pdf'):
+        docs = doc_parser.parse_pdf(file_path, filename)
+    elif filename.endswith('.docx'):
+        docs = doc_parser.parse_docx(file_path, filename)
+    elif filename.endswith('.txt'):
+        docs = doc_parser.parse_txt(file_path, filename)
+    else:
+        raise doc_parser.DocumentParseError(f"Unsupported file type: {filename}")
+
+    if not docs:
+        raise doc_parser.DocumentParseError("File parsing resulted in 0 documents.")
+
+    text_chunks = [doc.page_content for doc in docs]
+    metadata_list = [doc.metadata for doc in docs]
+
+    # 2. Эмбеддинг и сохранение в ChromaDB
+    return await rag.process_and_embed_chunks(
+        collection_name=str(workspace_id),
+        source_id=source_id,
+        text_chunks=text_chunks,
+        metadata_list=metadata_list
+    )
+
 @router.post("/process-qa", status_code=status.HTTP_200_OK)
 async def process_qa(
     req: schemas_ai.QASProcessingRequest,
+    request: Request,
     rag: rag_service = Depends(get_rag_service)
 ):
     """Эндпоинт для эмбеддинга Q&A."""
@@ -63,13 +162,13 @@ async def process_qa(
         source_name = f"Q&A: {req.qa_in.question[:50]}..."
         docs = doc_parser.chunk_qna(req.qa_in, source_name)
 
-        await rag.process_and_embed_chunks(
+        chunk_count = await rag.process_and_embed_chunks(
             collection_name=str(req.workspace_id),
             source_id=req.source_id,
             text_chunks=[doc.page_content for doc in docs],
             metadata_list=[doc.metadata for doc in docs]
         )
-        return {"status": "COMPLETED", "source_id": req.source_id}
+        return negotiated_response(request, {"status": "COMPLETED", "source_id": req.source_id, "chunk_count": chunk_count})
     except Exception as e:
         print(f"[AI Service] FAILED processing Q&A. Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -78,6 +177,7 @@ async def process_qa(
 @router.post("/process-article", status_code=status.HTTP_200_OK)
 async def process_article(
     req: schemas_ai.ArticleProcessingRequest,
+    request: Request,
     rag: rag_service = Depends(get_rag_service)
 ):
     """Эндпоинт для эмбеддинга Статьи."""
@@ -85,13 +185,13 @@ async def process_article(
     try:
         docs = doc_parser.chunk_article(req.article_in)
 
-        await rag.process_and_embed_chunks(
+        chunk_count = await rag.process_and_embed_chunks(
             collection_name=str(req.workspace_id),
             source_id=req.source_id,
             text_chunks=[doc.page_content for doc in docs],
             metadata_list=[doc.metadata for doc in docs]
         )
-        return {"status": "COMPLETED", "source_id": req.source_id}
+        return negotiated_response(request, {"status": "COMPLETED", "source_id": req.source_id, "chunk_count": chunk_count})
     except Exception as e:
         print(f"[AI Service] FAILED processing Article. Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -99,6 +199,7 @@ async def process_article(
 @router.post("/delete-embeddings", status_code=status.HTTP_200_OK)
 async def delete_embeddings(
     req: schemas_ai.EmbeddingDeleteRequest,
+    request: Request,
     rag: rag_service = Depends(get_rag_service)
 ):
     """Эндпоинт для удаления эмбеддингов."""
@@ -106,31 +207,74 @@ async def delete_embeddings(
     try:
         await rag.delete_embeddings(
             collection_name=req.collection_name,
-            source_id=req.source_id
+            source_id=req.source_id,
+            chunk_count=req.chunk_count
         )
-        return {"status": "DELETED", "source_id": req.source_id}
+        return negotiated_response(request, {"status": "DELETED", "source_id": req.source_id})
     except Exception as e:
         print(f"[AI Service] FAILED deleting embeddings. Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/tickets/assign", status_code=status.HTTP_200_OK)
+async def assign_ticket(
+    req: schemas_ai.TicketAssignRequest,
+    request: Request,
+    rag: rag_service = Depends(get_rag_service)
+):
+    """Подбирает открытый тикет для вопроса без ответа (или регистрирует новый)."""
+    try:
+        ticket_id, matched = await rag.assign_ticket(req.workspace_id, req.ticket_id, req.question)
+        return negotiated_response(request, {"ticket_id": ticket_id, "matched": matched})
+    except Exception as e:
+        print(f"[AI Service] FAILED assigning ticket. Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/tickets/remove", status_code=status.HTTP_200_OK)
+async def remove_tickets(
+    req: schemas_ai.TicketRemoveRequest,
+    request: Request,
+    rag: rag_service = Depends(get_rag_service)
+):
+    """Убирает решенные тикеты из индекса."""
+    try:
+        await rag.remove_tickets(req.workspace_id, req.ticket_ids)
+        return negotiated_response(request, {"status": "DELETED", "ticket_ids": req.ticket_ids})
+    except Exception as e:
+        print(f"[AI Service] FAILED removing tickets. Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post(
     "/query",
     response_model=schemas_ai.QueryResponse
 )
 async def query_ai_service(
     req: schemas_ai.QueryRequest,
+    request: Request,
     rag: rag_service = Depends(get_rag_service)
 ):
-    """Выполняет RAG-пайплайн."""
-    answer, sources, _ = await rag.answer_query( # _ для ticket_id
-        workspace_id=req.workspace_id,
-        question=req.question,
-        session_id=req.session_id
-    )
+    """Выполняет RAG-пайплайн. 503 с Retry-After - LLM перегружена."""
+    try:
+        answer, sources, _ = await rag.answer_query( # _ для ticket_id
+            workspace_id=req.workspace_id,
+            question=req.question,
+            session_id=req.session_id
+        )
+    except LLMOverloadedError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="LLM is overloaded",
+            headers={"Retry-After": str(settings.LLM_OVERLOAD_RETRY_AFTER_SECONDS)}
+        )
 
     # Логика создания тикета остается в 'back'
     # 'back-ai' просто возвращает ответ и источники (или пустые источники)
-    return schemas_ai.QueryResponse(
+    return negotiated_response(request, schemas_ai.QueryResponse(
         answer=answer,
         sources=sources
-    )
\ No newline at end of file
+    ))
+
+
+@router.get("/metrics", status_code=status.HTTP_200_OK)
+async def get_metrics():
+    """Текущие метрики AI-сервиса."""
+    return metrics.snapshot()
@@ -1,6 +1,7 @@
 # (НОВЫЙ ФАЙЛ)
 from pydantic_settings import BaseSettings
 from pydantic import AnyHttpUrl
+from typing import List
 
 class Settings(BaseSettings):
     """
@@ -17,6 +18,57 @@ class Settings(BaseSettings):
     EMBEDDING_MODEL_NAME: str = 'all-MiniLM-L6-v2'
     RELEVANCE_THRESHOLD: float = 0.5
 
+    # Контекст промпта
+    RETRIEVAL_TOP_K: int = 3
+    # Бюджет рассчитан на llama3 (~3 символа кириллицы на токен): RETRIEVAL_TOP_K чанков по 1000 символов
+    # с заголовками помещаются с запасом; промпт целиком - в LLM_NUM_CTX
+    CONTEXT_TOKEN_BUDGET: int = 2000
+    CONTEXT_MAX_OVERLAP_CHARS: int = 200  # = chunk_overlap сплиттера
+    CONTEXT_MIN_OVERLAP_CHARS: int = 20  # Более короткие совпадения краев чанков - случайные
+    # HF-токенизатор LLM (должен соответствовать модели Ollama; скачивается в образ при сборке).
+    # Если не загрузился - сервис не стартует: счет токенов чужим токенизатором ломает бюджет
+    LLM_TOKENIZER_NAME: str = "NousResearch/Meta-Llama-3-8B-Instruct"
+
+    # Q&A short-circuit: если лучший чанк - Q&A ближе этого порога,
+    # возвращаем сохраненный ответ без генерации LLM
+    QNA_SHORTCUT_ENABLED: bool = True
+    QNA_SHORTCUT_DISTANCE: float = 0.15
+
+    # Кластеризация вопросов без ответа: вопрос ближе порога к открытому тикету
+    # присоединяется к нему (cosine distance в коллекции tickets_{workspace_id})
+    TICKET_CLUSTER_DISTANCE: float = 0.2
+
+    # LLM-шлюз (Ollama)
+    LLM_ENABLED: bool = False  # False - заглушка вместо вызова LLM
+    OLLAMA_HOSTS: List[AnyHttpUrl] = []  # Реплики Ollama (JSON-список); пусто - только OLLAMA_HOST
+    OLLAMA_KEEP_ALIVE: str = "30m"  # Сколько Ollama держит модель в памяти после запроса
+    LLM_MAX_CONCURRENCY_PER_REPLICA: int = 2
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    LLM_OVERLOAD_RETRY_AFTER_SECONDS: int = 10  # Retry-After в ответе 503, если свободного слота нет
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 60.0
+
+    LLM_TEMPERATURE: float = 0.0
+    LLM_NUM_CTX: int = 4096  # Окно контекста Ollama (по умолчанию 2048 - промпт с контекстом обрезался бы)
+
+    # Кэш ответов LLM (только при LLM_TEMPERATURE = 0)
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_MAX_ENTRIES: int = 1000  # LRU в памяти
+    LLM_CACHE_DIR: str = "/app/llm_cache"  # Дисковый уровень; пусто - только память
+    LLM_CACHE_DISK_MAX_BYTES: int = 512 * 1024 * 1024  # Сверх предела удаляются давно не читанные файлы
+
+    # Удаление эмбеддингов по ID (без скана метаданных)
+    CHROMA_DELETE_BATCH_SIZE: int = 5000
+
+    # Сохранение чанков в ChromaDB пачками
+    UPSERT_BATCH_SIZE: int = 256
+    UPSERT_MAX_RETRIES: int = 3
+    UPSERT_RETRY_BACKOFF_SECONDS: float = 0.5
+
+    # Файлы, переданные потоком (/process-file-stream), временно пишутся на локальный диск:
+    # парсерам нужен путь к файлу
+    FILE_SPOOL_DIR: str = "/tmp/knowledgebot_spool"
+    MAX_UPLOAD_SIZE_BYTES: int = 256 * 1024 * 1024  # Как MAX_UPLOAD_SIZE_BYTES в 'back'; больше - 413
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
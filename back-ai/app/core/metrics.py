@@ -0,0 +1,38 @@
+# Простые in-process метрики AI-сервиса (счетчики и сводки значений).
+# Отдаются эндпоинтом /metrics.
+import threading
+from collections import defaultdict
+from typing import Dict, Any
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._summaries: Dict[str, Dict[str, float]] = {}
+
+    def inc(self, name: str, value: int = 1):
+        """Увеличивает счетчик."""
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float):
+        """Добавляет значение в сводку (count / sum / max / last)."""
+        with self._lock:
+            summary = self._summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": value, "last": value})
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+            summary["last"] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущие значения всех метрик."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "summaries": {name: dict(summary) for name, summary in self._summaries.items()}
+            }
+
+
+# --- Единый экземпляр Metrics ---
+metrics = Metrics()
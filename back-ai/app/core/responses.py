@@ -0,0 +1,24 @@
+# Классы ответов для трафика back <-> back-ai.
+# Формат выбирается по заголовку Accept: 'application/msgpack' -> MessagePack,
+# иначе JSON (сериализация через orjson).
+import msgpack
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, Response
+from typing import Any
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(jsonable_encoder(content), use_bin_type=True)
+
+
+def negotiated_response(request: Request, content: Any) -> Response:
+    """Ответ в формате, который запросил клиент (MessagePack или JSON)."""
+    if MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+        return MsgPackResponse(content)
+    return ORJSONResponse(jsonable_encoder(content))
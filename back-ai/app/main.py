@@ -1,15 +1,29 @@
 # (НОВЫЙ ФАЙЛ)
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.core.config import settings
 from app.api.v1.api import api_router
 
 # (Важно) Инициализируем rag_service при старте
 from app.services import rag_service
+from app.services.rag_service import OLLAMA_MODEL_NAME
+from app.services.llm_gateway import llm_gateway
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Загружаем LLM на репликах Ollama заранее, чтобы первый запрос не ждал загрузки модели
+    if settings.LLM_ENABLED:
+        await llm_gateway.warm_up(OLLAMA_MODEL_NAME)
+    yield
+    await llm_gateway.close()
+
 
 app = FastAPI(
     title=settings.APP_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
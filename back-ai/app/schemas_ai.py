@@ -15,11 +15,19 @@ class KnowledgeSourceCreateArticle(BaseModel):
 
 # --- Схемы для API 'back-ai' ---
 
+class ReuseSource(BaseModel):
+    """Уже обработанный источник с тем же содержимым файла (тот же blob)."""
+    collection_name: str
+    source_id: UUID
+    chunk_count: int
+
 class FileProcessingRequest(BaseModel):
     workspace_id: UUID
     source_id: UUID
-    file_path: str
+    file_path: Optional[str] = None  # None - файл не на общем томе (только reuse_from)
     filename: str
+    content_sha256: Optional[str] = None
+    reuse_from: Optional[ReuseSource] = None
 
 class QASProcessingRequest(BaseModel):
     workspace_id: UUID
@@ -34,6 +42,20 @@ class ArticleProcessingRequest(BaseModel):
 class EmbeddingDeleteRequest(BaseModel):
     collection_name: str
     source_id: UUID
+    # Кол-во чанков источника (ID = '{source_id}_{0..chunk_count-1}').
+    # Если не передано - удаляем по фильтру метаданных (старые источники).
+    chunk_count: Optional[int] = None
+
+# --- Схемы для тикетов (кластеризация вопросов без ответа) ---
+
+class TicketAssignRequest(BaseModel):
+    workspace_id: UUID
+    ticket_id: UUID  # ID нового тикета, если похожего открытого нет
+    question: str
+
+class TicketRemoveRequest(BaseModel):
+    workspace_id: UUID
+    ticket_ids: List[UUID]
 
 # --- Схемы для RAG-запросов ---
 
@@ -0,0 +1,120 @@
+# Упаковка найденных чанков в контекст промпта с учетом бюджета токенов.
+# - токены считаются токенизатором LLM (fast-токенизатор HF: нужны offsets для обрезки);
+# - у соседних чанков одного источника и страницы убирается повторяющийся overlap сплиттера;
+# - чанки добавляются в порядке релевантности, пока помещаются в бюджет.
+from typing import List, NamedTuple, Optional, Tuple
+
+from app import schemas_ai
+
+
+class RetrievedChunk(NamedTuple):
+    chunk_id: str
+    text: str
+    metadata: dict
+    distance: float
+
+
+def _chunk_position(chunk: RetrievedChunk) -> Tuple[Optional[str], Optional[int]]:
+    """(source_id, номер чанка) из ID вида '{source_id}_{i}'."""
+    source_id, _, index = chunk.chunk_id.rpartition("_")
+    if not source_id or not index.isdigit():
+        return None, None
+    return source_id, int(index)
+
+
+def _overlap_length(left: str, right: str, max_overlap: int, min_overlap: int) -> int:
+    """
+    Длина самого длинного суффикса `left`, совпадающего с префиксом `right`.
+    Совпадения короче min_overlap (пробел, точка, короткое слово) - случайные, не overlap сплиттера.
+    """
+    for size in range(min(max_overlap, len(left), len(right)), max(min_overlap, 1) - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class ContextPacker:
+
+    def __init__(self, tokenizer, token_budget: int, max_overlap_chars: int, min_overlap_chars: int):
+        self.tokenizer = tokenizer
+        self.token_budget = token_budget
+        self.max_overlap_chars = max_overlap_chars
+        self.min_overlap_chars = min_overlap_chars
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Первые max_tokens токенов - срезом исходной строки по offsets (decode искажал бы текст)."""
+        if max_tokens <= 0:
+            return ""
+        offsets = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        if len(offsets) <= max_tokens:
+            return text
+        return text[:offsets[max_tokens - 1][1]]
+
+    @staticmethod
+    def _format_block(chunk: RetrievedChunk, text: str) -> str:
+        source_name = chunk.metadata.get('source_name', 'Unknown')
+        page = chunk.metadata.get('page')
+        return f"Документ: '{source_name}', стр. {page if page else 'N/A'}:\n\"{text}\"\n\n"
+
+    def _strip_overlap(self, chunk: RetrievedChunk, packed: List[RetrievedChunk]) -> str:
+        """
+        Убирает из текста чанка overlap с уже добавленными соседними чанками того же источника.
+        Страницы PDF режутся на чанки по отдельности, поэтому чанки разных страниц overlap не имеют.
+        """
+        text = chunk.text
+        source_id, index = _chunk_position(chunk)
+        if source_id is None:
+            return text
+        for other in packed:
+            other_source_id, other_index = _chunk_position(other)
+            if other_source_id != source_id or other.metadata.get("page") != chunk.metadata.get("page"):
+                continue
+            if other_index == index - 1:
+                text = text[_overlap_length(other.text, text, self.max_overlap_chars, self.min_overlap_chars):]
+            elif other_index == index + 1:
+                size = _overlap_length(text, other.text, self.max_overlap_chars, self.min_overlap_chars)
+                text = text[:len(text) - size]
+        return text
+
+    def pack(
+            self, chunks: List[RetrievedChunk], token_budget: Optional[int] = None
+    ) -> Tuple[str, List[schemas_ai.QueryResponseSource]]:
+        """
+        Формирует контекст из чанков (в порядке релевантности) в пределах бюджета токенов.
+        Возвращает (context, sources). Самый релевантный чанк попадает в контекст всегда
+        (при необходимости обрезается).
+        """
+        budget = token_budget if token_budget is not None else self.token_budget
+        context = ""
+        used = 0
+        packed: List[RetrievedChunk] = []
+        sources: List[schemas_ai.QueryResponseSource] = []
+
+        for chunk in chunks:
+            text = self._strip_overlap(chunk, packed)
+            if not text.strip():
+                packed.append(chunk)  # Полностью покрыт соседями
+                continue
+
+            block = self._format_block(chunk, text)
+            block_tokens = self.count_tokens(block)
+            if used + block_tokens > budget:
+                if packed:
+                    continue  # Пробуем следующие (более короткие) чанки
+                overhead = self.count_tokens(self._format_block(chunk, ""))
+                block = self._format_block(chunk, self._truncate(text, max(budget - overhead, 0)))
+                block_tokens = self.count_tokens(block)
+
+            context += block
+            used += block_tokens
+            packed.append(chunk)
+            sources.append(schemas_ai.QueryResponseSource(
+                name=chunk.metadata.get('source_name', 'Unknown'),
+                page=chunk.metadata.get('page'),
+                text_chunk=chunk.text
+            ))
+
+        return context, sources
@@ -0,0 +1,184 @@
+# Кэш ответов LLM.
+# Ключ: (модель, параметры генерации, sha256 итогового промпта).
+# Два уровня: LRU в памяти и файлы на диске (переживают перезапуск сервиса).
+# Ответы со случайной выборкой (temperature > 0) не кэшируются.
+# Размер дискового уровня ограничен: сверх предела удаляются файлы, которые дольше всего не читали.
+# Каталог создается и сканируется лениво (при первом обращении) и в фоновом потоке, не на пути запроса.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+class LLMResponseCache:
+
+    def __init__(self, max_entries: int, disk_path: Optional[str], disk_max_bytes: int):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Оценка размера диска: между сканами растет на размер своих записей, скан ее уточняет
+        # (каталог общий для воркеров, записи других воркеров видны только после скана)
+        self._disk_bytes = 0
+        self._bytes_written = 0  # Всего записано этим процессом (для записей во время скана)
+        self._disk_ready = False
+        self._evict_lock = threading.Lock()
+
+    @staticmethod
+    def is_cacheable(options: Dict[str, Any]) -> bool:
+        """Кэшируем только детерминированную генерацию."""
+        return float(options.get("temperature", 0.0)) <= 0.0
+
+    @staticmethod
+    def make_key(model: str, options: Dict[str, Any], prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = json.dumps([model, options, prompt_hash], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_file(self, key: str) -> str:
+        return os.path.join(self.disk_path, key[:2], f"{key}.json")
+
+    def _prepare_disk(self):
+        """При первом обращении: создает каталог и запускает подсчет занятого места."""
+        with self._lock:
+            if self._disk_ready:
+                return
+            self._disk_ready = True
+        os.makedirs(self.disk_path, exist_ok=True)
+        self._start_eviction()
+
+    def _start_eviction(self):
+        """Скан и вытеснение - в фоновом потоке (не больше одного одновременно)."""
+        if not self._evict_lock.locked():
+            threading.Thread(target=self._evict, name="llm-cache-evict", daemon=True).start()
+
+    def _remember(self, key: str, answer: str):
+        with self._lock:
+            self._memory[key] = answer
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            answer = self._memory.get(key)
+            if answer is not None:
+                self._memory.move_to_end(key)
+        if answer is not None:
+            metrics.inc("llm_cache_hits_total")
+            return answer
+
+        if self.disk_path:
+            self._prepare_disk()
+            try:
+                path = self._disk_file(key)
+                with open(path, "r", encoding="utf-8") as f:
+                    answer = json.load(f)["answer"]
+                os.utime(path)  # mtime - время последнего чтения, по нему идет вытеснение
+                self._remember(key, answer)
+                metrics.inc("llm_cache_disk_hits_total")
+                return answer
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[LLM Cache] Failed to read cache entry {key}: {e}")
+
+        metrics.inc("llm_cache_misses_total")
+        return None
+
+    def put(self, key: str, answer: str):
+        self._remember(key, answer)
+        if not self.disk_path:
+            return
+        self._prepare_disk()
+        path = self._disk_file(key)
+        tmp_path = None
+        try:
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # Уникальное имя: параллельные записи одного ключа (потоки, воркеры) не мешают друг другу
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"answer": answer}, f, ensure_ascii=False)
+                size = f.tell()
+            os.replace(tmp_path, path)  # Атомарно: читатели не увидят недописанный файл
+            tmp_path = None
+        except Exception as e:
+            print(f"[LLM Cache] Failed to write cache entry {key}: {e}")
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+
+        with self._lock:
+            self._disk_bytes += size
+            self._bytes_written += size
+            over_limit = self._disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._start_eviction()
+
+    def _evict(self):
+        """
+        Сканирует каталог и удаляет давно не читанные файлы, пока размер не опустится
+        до 90% предела: следующий скан - только после записи еще ~10% предела.
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            return  # Уже вытесняет другой поток
+        try:
+            with self._lock:
+                written_before = self._bytes_written
+            files = []
+            total = 0
+            for root, _, names in os.walk(self.disk_path):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+
+            target = int(self.disk_max_bytes * 0.9)
+            removed = 0
+            if total > self.disk_max_bytes:
+                files.sort()
+                for _, size, path in files:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass  # Удалил другой воркер
+                    except OSError as e:
+                        print(f"[LLM Cache] Failed to evict {path}: {e}")
+                        continue
+                    total -= size
+                    removed += 1
+                metrics.inc("llm_cache_evictions_total", removed)
+                print(f"[LLM Cache] Evicted {removed} entries, disk usage ~{total} bytes")
+
+            with self._lock:
+                # Записанное во время скана могло в него не попасть
+                self._disk_bytes = total + (self._bytes_written - written_before)
+        except Exception as e:
+            print(f"[LLM Cache] Eviction failed: {e}")
+        finally:
+            self._evict_lock.release()
+
+
+# --- Единый экземпляр LLMResponseCache ---
+llm_cache = LLMResponseCache(
+    max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+    disk_path=settings.LLM_CACHE_DIR or None,
+    disk_max_bytes=settings.LLM_CACHE_DISK_MAX_BYTES
+)
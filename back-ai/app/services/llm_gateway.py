@@ -0,0 +1,104 @@
+# Шлюз к LLM (Ollama).
+# Держит пул keep-alive соединений к одной или нескольким репликам Ollama,
+# направляет запрос на реплику с наименьшим числом незавершенных запросов,
+# ограничивает число одновременных генераций на реплику и ставит остальные
+# запросы в очередь с дедлайном.
+import asyncio
+import random
+from typing import List, Optional, Dict, Any
+
+import httpx
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+class LLMOverloadedError(Exception):
+    """Запрос не дождался свободного слота генерации за отведенное время."""
+
+
+class OllamaReplica:
+    """Одна реплика Ollama: свой пул соединений и лимит одновременных генераций."""
+
+    def __init__(self, base_url: str, max_concurrency: int):
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=max_concurrency + 1,  # +1 для служебных запросов (warm-up)
+                max_keepalive_connections=max_concurrency + 1,
+                keepalive_expiry=None
+            )
+        )
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.outstanding = 0  # Выполняющиеся + ожидающие в очереди
+
+
+class LLMGateway:
+
+    def __init__(self, hosts: List[str], max_concurrency: int, queue_timeout: float, keep_alive: str):
+        self.replicas = [OllamaReplica(host.rstrip("/"), max_concurrency) for host in hosts]
+        self.queue_timeout = queue_timeout
+        self.keep_alive = keep_alive
+        print(f"[LLM Gateway] Initialized with replicas: {[r.base_url for r in self.replicas]}")
+
+    def _pick_replica(self) -> OllamaReplica:
+        """Реплика с наименьшим числом незавершенных запросов (при равенстве - случайная)."""
+        least = min(r.outstanding for r in self.replicas)
+        return random.choice([r for r in self.replicas if r.outstanding == least])
+
+    async def generate(self, model: str, prompt: str, options: Optional[Dict[str, Any]] = None) -> str:
+        """Генерирует ответ (без стриминга). Бросает LLMOverloadedError, если очередь не прошла за queue_timeout."""
+        replica = self._pick_replica()
+        replica.outstanding += 1
+        try:
+            try:
+                await asyncio.wait_for(replica.slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                metrics.inc("llm_queue_timeout_total")
+                raise LLMOverloadedError(f"No free generation slot on {replica.base_url} within {self.queue_timeout}s")
+
+            try:
+                payload = {
+                    "model": model,
+                    "prompt": prompt,
+                    "stream": False,
+                    "keep_alive": self.keep_alive  # Модель остается загруженной между запросами
+                }
+                if options:
+                    payload["options"] = options
+                response = await replica.client.post("/api/generate", json=payload)
+                response.raise_for_status()
+                metrics.inc("llm_generations_total")
+                return response.json().get("response", "Ошибка: получен пустой ответ от LLM.")
+            finally:
+                replica.slots.release()
+        finally:
+            replica.outstanding -= 1
+
+    async def warm_up(self, model: str):
+        """Загружает модель на всех репликах (пустой промпт + keep_alive)."""
+        for replica in self.replicas:
+            try:
+                response = await replica.client.post(
+                    "/api/generate",
+                    json={"model": model, "prompt": "", "keep_alive": self.keep_alive}
+                )
+                response.raise_for_status()
+                print(f"[LLM Gateway] Model '{model}' is loaded on {replica.base_url}")
+            except Exception as e:
+                print(f"[LLM Gateway] WARNING: Failed to warm up {replica.base_url}: {e}")
+
+    async def close(self):
+        for replica in self.replicas:
+            await replica.client.aclose()
+
+
+# --- Единый экземпляр LLMGateway ---
+llm_gateway = LLMGateway(
+    hosts=[str(host) for host in (settings.OLLAMA_HOSTS or [settings.OLLAMA_HOST])],
+    max_concurrency=settings.LLM_MAX_CONCURRENCY_PER_REPLICA,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+    keep_alive=settings.OLLAMA_KEEP_ALIVE
+)
@@ -10,6 +10,10 @@ import os
 
 from app.schemas_ai import KnowledgeSourceCreateQA, KnowledgeSourceCreateArticle
 
+class DocumentParseError(ValueError):
+    """Файл не удалось разобрать: ошибка входных данных, а не сервиса (422)."""
+
+
 # Настройка сплиттера
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=1000,
@@ -35,10 +39,7 @@ def _load_and_split(loader_class, file_path, source_name):
         return text_splitter.split_documents(docs)
     except Exception as e:
         print(f"Error parsing {file_path}: {e}")
-        return [Document(
-            page_content=f"Ошибка при парсинге файла {source_name}",
-            metadata={"source_name": source_name, "error": str(e)}
-        )]
+        raise DocumentParseError(f"Failed to parse {source_name}: {e}") from e
 
 
 def parse_pdf(file_path: str, filename: str) -> List[Document]:
@@ -62,7 +63,7 @@ def chunk_qna(qa_in: KnowledgeSourceCreateQA, source_name: str) -> List[Document
     content = f"Вопрос: {qa_in.question}\nОтвет: {qa_in.answer}"
     doc = Document(
         page_content=content,
-        metadata={"source_name": source_name, "source_type": "QNA"}
+        metadata={"source_name": source_name, "source_type": "QNA", "answer": qa_in.answer}
     )
     return [doc]
 
@@ -2,14 +2,23 @@
 # Это оригинальный, РАБОЧИЙ 'rag_service.py' из '404team_project/back'
 # Он перемещен сюда, в 'back-ai'
 import httpx  # (ВАЖНО) Раскомментируем httpx
+import hashlib
+import weakref
 import chromadb
 import asyncio
+import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer
+from transformers import AutoTokenizer
 from typing import List, Optional, Tuple, Dict, Any
 from uuid import UUID
 
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.text_utils import normalize_question
+from app.services.llm_gateway import llm_gateway, LLMOverloadedError
+from app.services.context_packer import ContextPacker, RetrievedChunk
+from app.services.llm_cache import llm_cache
 from app import schemas_ai  # Используем локальные схемы _ai
 
 # --- Конфигурация RAG ---
@@ -53,14 +62,37 @@ class RAGService:
             print(f"[RAG Service] CRITICAL: Failed to connect to ChromaDB: {e}")
             raise e
 
-        # 4. (Ollama) Инициализация HTTP-клиента
-        # (Используем ЗАГЛУШКУ из оригинального файла v1, чтобы он работал как раньше)
-        self.ollama_client = None
-        print(f"[RAG Service] STUB: Ollama client (httpx) is NOT initialized.")
-
-        # --- (ЗАКОММЕНТИРОВАННЫЙ РЕАЛЬНЫЙ КОД) ---
-        # self.ollama_client = httpx.AsyncClient(base_url=str(settings.OLLAMA_HOST), timeout=60.0)
-        # print(f"[RAG Service] Ollama client initialized for {settings.OLLAMA_HOST}")
+        # 3.1. Токенизатор LLM для бюджета контекста
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(settings.LLM_TOKENIZER_NAME)
+            if not tokenizer.is_fast:
+                raise ValueError("a fast tokenizer (with offsets mapping) is required")
+            print(f"[RAG Service] LLM tokenizer '{settings.LLM_TOKENIZER_NAME}' loaded.")
+        except Exception as e:
+            print(f"[RAG Service] CRITICAL: Failed to load LLM tokenizer '{settings.LLM_TOKENIZER_NAME}': {e}")
+            raise e
+        self.context_packer = ContextPacker(
+            tokenizer=tokenizer,
+            token_budget=settings.CONTEXT_TOKEN_BUDGET,
+            max_overlap_chars=settings.CONTEXT_MAX_OVERLAP_CHARS,
+            min_overlap_chars=settings.CONTEXT_MIN_OVERLAP_CHARS
+        )
+
+        # Выполняющиеся запросы: (workspace_id, нормализованный вопрос) -> задача пайплайна
+        self._inflight_queries: Dict[Tuple[str, str], asyncio.Future] = {}
+
+        # Назначение тикетов сериализуется по воркспейсу: два одинаковых вопроса подряд - один тикет.
+        # Слабые ссылки: блокировка живет, пока ее держат или ждут, и не копится на каждый воркспейс
+        self._ticket_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+        # 4. (Ollama) LLM-шлюз (пул соединений к репликам Ollama)
+        # По умолчанию (LLM_ENABLED=False) используем ЗАГЛУШКУ из v1, чтобы он работал как раньше
+        if settings.LLM_ENABLED:
+            self.ollama_client = llm_gateway
+            print(f"[RAG Service] LLM gateway enabled (model: {OLLAMA_MODEL_NAME})")
+        else:
+            self.ollama_client = None
+            print(f"[RAG Service] STUB: LLM gateway is disabled (LLM_ENABLED=False).")
 
     async def get_collection(self, collection_name: str) -> chromadb.Collection:
         """Получает или создает коллекцию в ChromaDB."""
@@ -81,51 +113,283 @@ class RAGService:
             text_chunks: List[str],
             metadata_list: List[dict]
     ):
-        """Генерирует эмбеддинги и сохраняет в ChromaDB."""
+        """
+        Генерирует эмбеддинги и сохраняет в ChromaDB.
+        Чанки обрабатываются пачками по UPSERT_BATCH_SIZE: эмбеддинг пачки -> upsert,
+        поэтому полная матрица эмбеддингов документа в памяти не держится.
+        Каждая пачка повторяется при ошибке. Прогресс хранится в самой ChromaDB (doc_hash в метаданных
+        чанков): повторная обработка того же документа (после сбоя или перезапуска) пропускает
+        уже сохраненные пачки. Чанки прежней, более длинной версии документа удаляются.
+        """
         print(f"[RAG Service] Processing {len(text_chunks)} chunks for source: {source_id}")
         try:
-            # 1. Генерируем эмбеддинги
-            embeddings = await asyncio.to_thread(
-                self.embedding_model.encode,
-                text_chunks,
-                show_progress_bar=False,
-                device=self.device
-            )
-
-            # 2. Дополняем метаданные
+            # 1. Дополняем метаданные
+            doc_hash = self._document_hash(text_chunks)
             full_metadatas = []
-            ids = []
-            for i, meta in enumerate(metadata_list):
+            for meta in metadata_list:
                 meta["source_id"] = str(source_id)
+                meta["doc_hash"] = doc_hash
                 full_metadatas.append(meta)
-                ids.append(f"{source_id}_{i}")
+            ids = self.chunk_ids(source_id, len(full_metadatas))
 
-            # 3. Сохраняем в ChromaDB
+            # 2. Сколько пачек этого документа сохранила прошлая попытка
             collection = await self.get_collection(collection_name)
-            collection.add(
-                embeddings=embeddings.tolist(),
-                documents=text_chunks,
-                metadatas=full_metadatas,
-                ids=ids
-            )
+            batch_size = settings.UPSERT_BATCH_SIZE
+            done = await self._committed_prefix(collection, ids, doc_hash, batch_size)
+            if done:
+                print(f"[RAG Service] Resuming source {source_id} from chunk {done}/{len(ids)}")
+
+            # 3. Эмбеддинг и сохранение пачками
+            for batch_start in range(done, len(ids), batch_size):
+                batch_end = min(batch_start + batch_size, len(ids))
+                embeddings = await asyncio.to_thread(
+                    self.embedding_model.encode,
+                    text_chunks[batch_start:batch_end],
+                    show_progress_bar=False,
+                    device=self.device
+                )
+                await self._upsert_with_retry(
+                    collection,
+                    embeddings=embeddings,
+                    documents=text_chunks[batch_start:batch_end],
+                    metadatas=full_metadatas[batch_start:batch_end],
+                    ids=ids[batch_start:batch_end]
+                )
+
+            # 4. Хвост прежней версии документа (в ней было больше чанков)
+            await self._delete_tail(collection, source_id, len(ids))
+
             print(f"[RAG Service] Successfully added {len(ids)} chunks to ChromaDB.")
+            return len(ids)
         except Exception as e:
             print(f"[RAG Service] Error processing chunks for source {source_id}: {e}")
             raise e
 
-    async def delete_embeddings(self, collection_name: str, source_id: UUID):
-        """Удаляет эмбеддинги из ChromaDB."""
+    async def copy_embeddings(
+            self,
+            from_collection_name: str,
+            from_source_id: UUID,
+            chunk_count: int,
+            collection_name: str,
+            source_id: UUID,
+            source_name: str
+    ) -> int:
+        """
+        Копирует чанки и эмбеддинги уже обработанного источника (тот же файл)
+        в новый источник, без парсинга и эмбеддинга. Возвращает кол-во чанков.
+        """
+        print(f"[RAG Service] Copying {chunk_count} chunks from source {from_source_id} to {source_id}")
+        from_collection = await self.get_collection(from_collection_name)
+        collection = await self.get_collection(collection_name)
+        batch_size = settings.UPSERT_BATCH_SIZE
+        for start in range(0, chunk_count, batch_size):
+            end = min(start + batch_size, chunk_count)
+            from_ids = self.chunk_ids(from_source_id, end, start=start)
+            found = from_collection.get(ids=from_ids, include=["embeddings", "documents", "metadatas"])
+            if len(found["ids"]) != len(from_ids):
+                raise ValueError(f"Source {from_source_id} has {len(found['ids'])} of {len(from_ids)} chunks")
+
+            # get() не гарантирует порядок - раскладываем по номеру чанка
+            position = {chunk_id: i for i, chunk_id in enumerate(found["ids"])}
+            order = [position[chunk_id] for chunk_id in from_ids]
+            metadatas = []
+            for i in order:
+                meta = dict(found["metadatas"][i] or {})
+                meta["source_id"] = str(source_id)
+                meta["source_name"] = source_name
+                metadatas.append(meta)
+
+            await self._upsert_with_retry(
+                collection,
+                embeddings=np.asarray([found["embeddings"][i] for i in order]),
+                documents=[found["documents"][i] for i in order],
+                metadatas=metadatas,
+                ids=self.chunk_ids(source_id, end, start=start)
+            )
+        metrics.inc("embeddings_reused_total", chunk_count)
+        return chunk_count
+
+    async def _upsert_with_retry(
+            self,
+            collection: chromadb.Collection,
+            embeddings: np.ndarray,
+            documents: List[str],
+            metadatas: List[dict],
+            ids: List[str]
+    ):
+        """Сохраняет одну пачку чанков (upsert идемпотентен, поэтому пачку можно повторять)."""
+        attempt = 0
+        while True:
+            try:
+                # HTTP-клиент Chroma все равно сериализует вектора в JSON,
+                # поэтому конвертируем только текущую пачку, а не всю матрицу.
+                collection.upsert(
+                    embeddings=embeddings.tolist(),
+                    documents=documents,
+                    metadatas=metadatas,
+                    ids=ids
+                )
+                return
+            except Exception as e:
+                attempt += 1
+                if attempt > settings.UPSERT_MAX_RETRIES:
+                    raise e
+                delay = settings.UPSERT_RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1))
+                print(f"[RAG Service] Upsert of {ids[0]}..{ids[-1]} failed ({e}). Retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _document_hash(text_chunks: List[str]) -> str:
+        """Хеш содержимого документа: прогресс прошлой попытки годится, только если текст не менялся."""
+        digest = hashlib.sha256()
+        for chunk in text_chunks:
+            digest.update(chunk.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    async def _committed_prefix(
+            self, collection: chromadb.Collection, ids: List[str], doc_hash: str, batch_size: int
+    ) -> int:
+        """
+        Кол-во чанков, уже сохраненных прошлой попыткой обработки того же содержимого.
+        Пачки пишутся по порядку, поэтому сохранена пачка - сохранены и все предыдущие:
+        бинарный поиск по последним чанкам пачек (по одному get на шаг).
+        """
+        batch_ends = [min(start + batch_size, len(ids)) for start in range(0, len(ids), batch_size)]
+        low, high = 0, len(batch_ends)  # Сохранены первые `low` пачек; пачки с `high` - нет
+        while low < high:
+            middle = (low + high) // 2
+            chunk_id = ids[batch_ends[middle] - 1]
+            found = await asyncio.to_thread(collection.get, ids=[chunk_id], include=["metadatas"])
+            metadatas = found.get("metadatas") or []
+            if metadatas and (metadatas[0] or {}).get("doc_hash") == doc_hash:
+                low = middle + 1
+            else:
+                high = middle
+        return batch_ends[low - 1] if low else 0
+
+    async def _delete_tail(self, collection: chromadb.Collection, source_id: UUID, chunk_count: int):
+        """Удаляет чанки с номерами >= chunk_count (ID идут подряд, поэтому до первого отсутствующего)."""
+        batch_size = settings.CHROMA_DELETE_BATCH_SIZE
+        start = chunk_count
+        while True:
+            batch_ids = self.chunk_ids(source_id, start + batch_size, start=start)
+            found = await asyncio.to_thread(collection.get, ids=batch_ids, include=[])
+            existing = found.get("ids") or []
+            if not existing:
+                return
+            await asyncio.to_thread(collection.delete, ids=existing)
+            print(f"[RAG Service] Deleted {len(existing)} stale chunks of source {source_id}")
+            if len(existing) < batch_size:
+                return
+            start += batch_size
+
+    @staticmethod
+    def chunk_ids(source_id: UUID, chunk_count: int, start: int = 0) -> List[str]:
+        """
+        ID чанков источника в ChromaDB.
+        ID детерминированы ('{source_id}_{i}'), поэтому диапазон чанков
+        полностью описывается их количеством.
+        """
+        return [f"{source_id}_{i}" for i in range(start, chunk_count)]
+
+    async def delete_embeddings(self, collection_name: str, source_id: UUID, chunk_count: Optional[int] = None):
+        """
+        Удаляет эмбеддинги из ChromaDB.
+        Если известно кол-во чанков - удаляем напрямую по ID (пачками),
+        без скана метаданных всей коллекции.
+        """
         print(f"[RAG Service] Deleting embeddings for source: {source_id}")
         try:
             collection = await self.get_collection(collection_name)
-            collection.delete(
-                where={"source_id": str(source_id)}
-            )
+            if chunk_count is None:
+                # Источники, проиндексированные до появления реестра ID
+                collection.delete(
+                    where={"source_id": str(source_id)}
+                )
+            else:
+                batch_size = settings.CHROMA_DELETE_BATCH_SIZE
+                for start in range(0, chunk_count, batch_size):
+                    end = min(start + batch_size, chunk_count)
+                    collection.delete(ids=self.chunk_ids(source_id, end, start=start))
             print(f"[RAG Service] Successfully deleted embeddings from ChromaDB.")
         except Exception as e:
             print(f"[RAG Service] Error deleting embeddings for source {source_id}: {e}")
             raise e
 
+    @staticmethod
+    def ticket_collection_name(workspace_id: UUID) -> str:
+        """Коллекция вопросов открытых тикетов воркспейса (отдельно от базы знаний)."""
+        return f"tickets_{workspace_id}"
+
+    async def assign_ticket(self, workspace_id: UUID, ticket_id: UUID, question: str) -> Tuple[UUID, bool]:
+        """
+        Ищет открытый тикет с близким вопросом (distance <= TICKET_CLUSTER_DISTANCE).
+        Возвращает (его id, True); если такого нет - индексирует вопрос под ticket_id
+        и возвращает (ticket_id, False).
+        """
+        lock = self._ticket_locks.get(str(workspace_id))
+        if lock is None:
+            lock = self._ticket_locks[str(workspace_id)] = asyncio.Lock()
+        async with lock:
+            question_embedding = await asyncio.to_thread(
+                self.embedding_model.encode,
+                [question],
+                device=self.device
+            )
+            collection = await self.get_collection(self.ticket_collection_name(workspace_id))
+            if collection.count() > 0:
+                search_results = collection.query(
+                    query_embeddings=question_embedding.tolist(),
+                    n_results=1
+                )
+                ids = search_results.get("ids", [[]])[0]
+                distances = search_results.get("distances", [[]])[0]
+                if ids and distances[0] <= settings.TICKET_CLUSTER_DISTANCE:
+                    print(f"[RAG Service] Question attached to ticket {ids[0]} (distance: {distances[0]:.3f})")
+                    return UUID(ids[0]), True
+
+            collection.upsert(
+                ids=[str(ticket_id)],
+                embeddings=question_embedding.tolist(),
+                documents=[question]
+            )
+            return ticket_id, False
+
+    async def remove_tickets(self, workspace_id: UUID, ticket_ids: List[UUID]):
+        """Убирает тикеты из индекса (тикет решен - новые вопросы к нему больше не присоединяются)."""
+        collection = await self.get_collection(self.ticket_collection_name(workspace_id))
+        collection.delete(ids=[str(ticket_id) for ticket_id in ticket_ids])
+
+    @staticmethod
+    def _qna_shortcut(
+            doc_chunks: List[str], metadatas: List[dict], distances: List[float]
+    ) -> Optional[Tuple[str, List[schemas_ai.QueryResponseSource]]]:
+        """
+        Если лучший чанк - Q&A и его distance <= QNA_SHORTCUT_DISTANCE,
+        возвращает (сохраненный ответ, [источник]). Иначе None.
+        """
+        if not settings.QNA_SHORTCUT_ENABLED or not doc_chunks or not distances:
+            return None
+        meta = metadatas[0] or {}
+        if meta.get("source_type") != "QNA" or distances[0] > settings.QNA_SHORTCUT_DISTANCE:
+            return None
+
+        chunk = doc_chunks[0]
+        answer = meta.get("answer")
+        if answer is None:
+            # Чанки, проиндексированные до появления 'answer' в метаданных
+            _, sep, answer = chunk.partition("Ответ: ")
+            if not sep:
+                return None
+
+        source = schemas_ai.QueryResponseSource(
+            name=meta.get("source_name", "Unknown"),
+            page=meta.get("page"),
+            text_chunk=chunk
+        )
+        return answer, [source]
+
     async def answer_query(
             self,
             workspace_id: UUID,
@@ -136,7 +400,34 @@ class RAGService:
         Полный RAG-пайплайн.
         (Возвращает (answer, sources, ticket_id) - ticket_id будет None,
         но мы сохраняем сигнатуру из v1)
+        Одновременные одинаковые вопросы (воркспейс + нормализованный вопрос)
+        ждут один общий запуск пайплайна (single-flight).
         """
+        key = (str(workspace_id), normalize_question(question))
+        task = self._inflight_queries.get(key)
+        if task is not None:
+            metrics.inc("query_coalesced_total")
+            print(f"[RAG Service] Joining in-flight query for workspace {workspace_id}")
+        else:
+            task = asyncio.ensure_future(self._run_query(workspace_id, question, session_id))
+            self._inflight_queries[key] = task
+
+            def _forget(done_task: asyncio.Future):
+                if self._inflight_queries.get(key) is done_task:
+                    del self._inflight_queries[key]
+
+            task.add_done_callback(_forget)
+
+        # shield: отмена одного клиента не должна отменять пайплайн для остальных
+        return await asyncio.shield(task)
+
+    async def _run_query(
+            self,
+            workspace_id: UUID,
+            question: str,
+            session_id: UUID
+    ) -> Tuple[str, List[schemas_ai.QueryResponseSource], Optional[UUID]]:
+        """Один запуск RAG-пайплайна."""
         collection_name = str(workspace_id)
         print(f"[RAG Service] Answering query for workspace {workspace_id}")
 
@@ -152,7 +443,7 @@ class RAGService:
             collection = await self.get_collection(collection_name)
             search_results = collection.query(
                 query_embeddings=query_embedding.tolist(),
-                n_results=3
+                n_results=settings.RETRIEVAL_TOP_K
             )
 
             # 3. Проверяем релевантность
@@ -167,28 +458,24 @@ class RAGService:
                     None  # ticket_id (логика v1)
                 )
 
-            # 4. Формируем контекст и промпт
-            context = ""
-            sources: List[schemas_ai.QueryResponseSource] = []
-
             doc_chunks = search_results.get("documents", [[]])[0]
             metadatas = search_results.get("metadatas", [[]])[0]
 
-            for i in range(len(doc_chunks)):
-                if distances[i] <= RELEVANCE_THRESHOLD:
-                    chunk = doc_chunks[i]
-                    meta = metadatas[i]
-                    source_name = meta.get('source_name', 'Unknown')
-                    page = meta.get('page')
-
-                    context += f"Документ: '{source_name}', стр. {page if page else 'N/A'}:\n"
-                    context += f"\"{chunk}\"\n\n"
-
-                    sources.append(schemas_ai.QueryResponseSource(
-                        name=source_name,
-                        page=page,
-                        text_chunk=chunk
-                    ))
+            # 3.1. Лучший чанк - Q&A с высокой уверенностью: отвечаем сохраненным ответом, без LLM
+            shortcut = self._qna_shortcut(doc_chunks, metadatas, distances)
+            if shortcut:
+                metrics.inc("query_qna_shortcut_total")
+                print(f"[RAG Service] Q&A short-circuit (distance: {distances[0]:.3f})")
+                return shortcut[0], shortcut[1], None
+
+            # 4. Формируем контекст (в пределах бюджета токенов) и промпт
+            chunk_ids = search_results.get("ids", [[]])[0]
+            relevant_chunks = [
+                RetrievedChunk(chunk_ids[i], doc_chunks[i], metadatas[i] or {}, distances[i])
+                for i in range(len(doc_chunks))
+                if distances[i] <= RELEVANCE_THRESHOLD
+            ]
+            context, sources = self.context_packer.pack(relevant_chunks)
 
             if not sources:
                 print("[RAG Service] Context filtered out by threshold.")
@@ -206,27 +493,39 @@ class RAGService:
 [Вопрос]
 {question}
 """
+            prompt_tokens = self.context_packer.count_tokens(prompt)
+            metrics.observe("prompt_tokens", prompt_tokens)
+            print(f"[RAG Service] Prompt: {prompt_tokens} tokens, {len(sources)} chunks")
 
-            # 6. (Ollama) Получаем ответ (ЗАГЛУШКА ИЗ v1)
+            # 6. (Ollama) Получаем ответ через LLM-шлюз (или ЗАГЛУШКА ИЗ v1)
             if not self.ollama_client:
-                print(f"[RAG Service] STUB: LLM call is commented out.")
+                print(f"[RAG Service] STUB: LLM gateway is disabled.")
                 stub_answer = f"Это заглушка. LLM не вызывалась.\n\nНайденный контекст:\n{context}"
                 answer = stub_answer
                 print(f"[RAG Service] Stub Answer generated.")
                 return answer, sources, None  # Успешный ответ
 
-            # --- (РЕАЛЬНЫЙ КОД v1, ЗАКОММЕНТИРОВАН) ---
-            # print(f"[RAG Service] Sending prompt to Ollama (model: {OLLAMA_MODEL_NAME})...")
-            # ollama_response = await self.ollama_client.post(
-            #     "/api/generate",
-            #     json={ "model": OLLAMA_MODEL_NAME, "prompt": prompt, "stream": False }
-            # )
-            # ollama_response.raise_for_status()
-            # answer = ollama_response.json().get("response", "Ошибка: получен пустой ответ от LLM.")
-            # print(f"[RAG Service] Answer generated: '{answer[:100]}...'")
-            # return answer, sources, None
-            # --- (КОНЕЦ РЕАЛЬНОГО КОДА) ---
-
+            # 6.1. Кэш ответов: тот же промпт с теми же параметрами -> тот же ответ
+            options = {"temperature": settings.LLM_TEMPERATURE, "num_ctx": settings.LLM_NUM_CTX}
+            cache_key = None
+            if settings.LLM_CACHE_ENABLED and llm_cache.is_cacheable(options):
+                cache_key = llm_cache.make_key(OLLAMA_MODEL_NAME, options, prompt)
+                cached_answer = await asyncio.to_thread(llm_cache.get, cache_key)
+                if cached_answer is not None:
+                    print(f"[RAG Service] Answer taken from LLM cache.")
+                    return cached_answer, sources, None
+
+            print(f"[RAG Service] Sending prompt to Ollama (model: {OLLAMA_MODEL_NAME})...")
+            answer = await self.ollama_client.generate(OLLAMA_MODEL_NAME, prompt, options=options)
+            print(f"[RAG Service] Answer generated: '{answer[:100]}...'")
+            if cache_key:
+                await asyncio.to_thread(llm_cache.put, cache_key, answer)
+            return answer, sources, None
+
+        except LLMOverloadedError as e:
+            # Не ответ "не найдено": эндпоинт вернет 503, и 'back' не заведет тикет
+            print(f"[RAG Service] LLM is overloaded: {e}")
+            raise
         except httpx.ConnectError as e:
             print(f"[RAG Service] CRITICAL: Cannot connect to Ollama: {e}")
             return (f"Ошибка: не могу подключиться к сервису LLM ({e}).", [], None)
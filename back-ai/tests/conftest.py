@@ -0,0 +1,6 @@
+# Обязательные настройки без значений по умолчанию: для тестов, которым не нужны сами сервисы
+import os
+
+os.environ.setdefault("OLLAMA_HOST", "http://localhost:11434")
+os.environ.setdefault("CHROMA_HOST", "localhost")
+os.environ.setdefault("CHROMA_PORT", "8000")
@@ -0,0 +1,96 @@
+# Упаковка чанков в контекст: overlap соседних чанков, обрезка по исходному тексту и бюджет по умолчанию.
+import re
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from app.services.context_packer import ContextPacker, RetrievedChunk  # noqa: E402
+
+PARAGRAPH = (
+    "Сотрудник может оформить ежегодный оплачиваемый отпуск через портал самообслуживания. "
+    "Заявление подается не позднее чем за две недели, руководитель согласует его в течение трех дней. "
+)
+
+
+class WhitespaceTokenizer:
+    """Токен - последовательность непробельных символов (интерфейс fast-токенизатора HF)."""
+    is_fast = True
+
+    def encode(self, text, add_special_tokens=False):
+        return [m.group() for m in re.finditer(r"\S+", text)]
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False):
+        return {"offset_mapping": [m.span() for m in re.finditer(r"\S+", text)]}
+
+
+def _packer(token_budget=10000):
+    return ContextPacker(WhitespaceTokenizer(), token_budget, max_overlap_chars=200, min_overlap_chars=20)
+
+
+def _chunk(source_id, index, text, page=None, distance=0.1):
+    metadata = {"source_name": "Регламент.pdf"}
+    if page is not None:
+        metadata["page"] = page
+    return RetrievedChunk(f"{source_id}_{index}", text, metadata, distance)
+
+
+def test_splitter_overlap_between_neighbours_is_stripped():
+    overlap = "руководитель согласует его в течение трех дней."
+    first = _chunk("s", 0, "Заявление подается заранее, " + overlap, page=1)
+    second = _chunk("s", 1, overlap + " Отпуск можно разделить на части.", page=1)
+
+    context, sources = _packer().pack([first, second])
+
+    assert context.count(overlap) == 1
+    assert "Отпуск можно разделить на части." in context
+    assert len(sources) == 2
+
+
+def test_short_coincidental_overlap_is_kept():
+    first = _chunk("s", 0, "Отпуск согласует руководитель и", page=1)
+    second = _chunk("s", 1, "и кадровая служба в течение трех дней.", page=1)
+
+    context, _ = _packer().pack([first, second])
+
+    assert "\"и кадровая служба в течение трех дней.\"" in context
+
+
+def test_overlap_is_not_stripped_across_pages():
+    shared = "руководитель согласует его в течение трех дней."
+    last_of_page = _chunk("s", 3, "Заявление подается заранее, " + shared, page=1)
+    first_of_next = _chunk("s", 4, shared + " Отпуск можно разделить на части.", page=2)
+
+    context, _ = _packer().pack([last_of_page, first_of_next])
+
+    assert context.count(shared) == 2
+
+
+def test_truncate_cuts_original_text():
+    text = "Йошкар-Ола, Ёлки и «кавычки»:   пробелы сохраняются."
+
+    assert _packer()._truncate(text, 3) == "Йошкар-Ола, Ёлки и"
+    assert _packer()._truncate(text, 100) == text
+    assert _packer()._truncate(text, 0) == ""
+
+
+def test_default_settings_pack_top3_chunks():
+    """Бюджет по умолчанию и токенизатор LLM: три чанка сплиттера (по 1000 символов) помещаются целиком."""
+    transformers = pytest.importorskip("transformers")
+    from app.core.config import settings
+
+    try:
+        tokenizer = transformers.AutoTokenizer.from_pretrained(settings.LLM_TOKENIZER_NAME)
+    except OSError as e:  # Нет сети и токенизатора в кэше
+        pytest.skip(f"LLM tokenizer is not available: {e}")
+
+    packer = ContextPacker(
+        tokenizer, settings.CONTEXT_TOKEN_BUDGET, settings.CONTEXT_MAX_OVERLAP_CHARS, settings.CONTEXT_MIN_OVERLAP_CHARS
+    )
+    text = (PARAGRAPH * 10)[:1000]
+    chunks = [_chunk(f"source-{i}", 0, text, page=i + 1) for i in range(settings.RETRIEVAL_TOP_K)]
+
+    context, sources = packer.pack(chunks)
+
+    assert len(sources) == settings.RETRIEVAL_TOP_K
+    assert context.count(text) == settings.RETRIEVAL_TOP_K
@@ -0,0 +1,199 @@
+"""Базовая схема: таблицы и колонки на момент перехода на Alembic
+
+До Alembic схема создавалась через Base.metadata.create_all() при старте,
+поэтому миграция идемпотентна: на пустой БД создает все таблицы, на существующей -
+только недостающие таблицы и колонки (IF NOT EXISTS).
+Схема здесь зафиксирована явно (не из моделей): новые колонки - только новыми миграциями.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Enum-типы Postgres (значения - имена членов enum в app/models.py, как их пишет SQLAlchemy)
+user_role = postgresql.ENUM("ADMIN", "EDITOR", "USER", name="userroleenum", create_type=False)
+source_type = postgresql.ENUM("FILE", "QNA", "ARTICLE", "CONNECTOR", name="knowledgesourcetypeenum", create_type=False)
+source_status = postgresql.ENUM("PROCESSING", "COMPLETED", "FAILED", name="knowledgesourcestatusenum", create_type=False)
+ticket_status = postgresql.ENUM("OPEN", "RESOLVED", name="ticketstatusenum", create_type=False)
+connector_type = postgresql.ENUM("CONFLUENCE", "GOOGLE_DRIVE", name="connectortypeenum", create_type=False)
+tool_method = postgresql.ENUM("POST", "GET", "PUT", name="toolapimethodenum", create_type=False)
+ENUMS = [user_role, source_type, source_status, ticket_status, connector_type, tool_method]
+
+# Колонки, появившиеся после первых развертываний через create_all()
+ADDED_COLUMNS = [
+    ("workspaces", "widget_settings", "JSON"),
+    ("knowledge_sources", "file_sha256", "VARCHAR(64)"),
+    ("knowledge_sources", "file_size", "BIGINT"),
+    ("knowledge_sources", "chunk_count", "INTEGER"),
+    ("chat_messages", "logged_at", "TIMESTAMP WITH TIME ZONE DEFAULT now()"),
+    ("tickets", "hit_count", "INTEGER NOT NULL DEFAULT 1"),
+]
+
+
+def _uuid():
+    return postgresql.UUID(as_uuid=True)
+
+
+def _created_at():
+    return sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now())
+
+
+def _tables():
+    """(имя, функция создания) в порядке зависимостей по внешним ключам."""
+    return [
+        ("organizations", lambda: op.create_table(
+            "organizations",
+            sa.Column("id", _uuid(), primary_key=True),
+            sa.Column("name", sa.String(255), nullable=False),
+            _created_at(),
+        )),
+        ("users", lambda: (
+            op.create_table(
+                "users",
+                sa.Column("id", _uuid(), primary_key=True),
+                sa.Column("full_name", sa.String(255), nullable=False),
+                sa.Column("email", sa.String(255), nullable=False),
+                sa.Column("hashed_password", sa.String(255), nullable=False),
+                sa.Column("organization_id", _uuid(), sa.ForeignKey("organizations.id"), nullable=False),
+                _created_at(),
+            ),
+            op.create_index("ix_users_email", "users", ["email"], unique=True),
+        )),
+        ("workspaces", lambda: op.create_table(
+            "workspaces",
+            sa.Column("id", _uuid(), primary_key=True),
+            sa.Column("name", sa.String(255), nullable=False),
+            sa.Column("description", sa.Text(), nullable=True),
+            sa.Column("organization_id", _uuid(), sa.ForeignKey("organizations.id"), nullable=False),
+            sa.Column("widget_settings", sa.JSON(), nullable=True),
+            _created_at(),
+        )),
+        ("workspace_memberships", lambda: op.create_table(
+            "workspace_memberships",
+            sa.Column("user_id", _uuid(), sa.ForeignKey("users.id"), primary_key=True),
+            sa.Column("workspace_id", _uuid(), sa.ForeignKey("workspaces.id"), primary_key=True),
+            sa.Column("role", user_role, nullable=False),
+            _created_at(),
+        )),
+        ("connectors", lambda: op.create_table(
+            "connectors",
+            sa.Column("id", _uuid(), primary_key=True),
+            sa.Column("workspace_id", _uuid(), sa.ForeignKey("workspaces.id"), nullable=False),
+            sa.Column("type", connector_type, nullable=False),
+            sa.Column("display_name", sa.String(255), nullable=False),
+            sa.Column("auth_details", sa.JSON(), nullable=False),
+            sa.Column("sync_schedule", sa.String(100), nullable=True),
+            sa.Column("status", sa.String(100), nullable=False),
+            sa.Column("last_sync", sa.DateTime(timezone=True), nullable=True),
+        )),
+        ("knowledge_sources", lambda: op.create_table(
+            "knowledge_sources",
+            sa.Column("id", _uuid(), primary_key=True),
+            sa.Column("workspace_id", _uuid(), sa.ForeignKey("workspaces.id"), nullable=False),
+            sa.Column("type", source_type, nullable=False),
+            sa.Column("name", sa.String(512), nullable=False),
+            sa.Column("status", source_status, nullable=False),
+            sa.Column("content", sa.JSON(), nullable=True),
+            sa.Column("file_path", sa.String(1024), nullable=True),
+            sa.Column("file_sha256", sa.String(64), nullable=True),
+            sa.Column("file_size", sa.BigInteger(), nullable=True),
+            sa.Column("connector_id", _uuid(), sa.ForeignKey("connectors.id"), nullable=True),
+            sa.Column("chunk_count", sa.Integer(), nullable=True),
+            _created_at(),
+        )),
+        ("chat_sessions", lambda: op.create_table(
+            "chat_sessions",
+            sa.Column("id", _uuid(), primary_key=True),
+            sa.Column("workspace_id", _uuid(), sa.ForeignKey("workspaces.id"), nullable=False),
+            _created_at(),
+        )),
+        ("tickets", lambda: op.create_table(
+            "tickets",
+            sa.Column("id", _uuid(), primary_key=True),
+            sa.Column("workspace_id", _uuid(), sa.ForeignKey("workspaces.id"), nullable=False),
+            sa.Column("question", sa.Text(), nullable=False),
+            sa.Column("status", ticket_status, nullable=False),
+            sa.Column("hit_count", sa.Integer(), nullable=False, server_default="1"),
+            sa.Column("answer", sa.Text(), nullable=True),
+            sa.Column("new_source_id", _uuid(), sa.ForeignKey("knowledge_sources.id"), nullable=True),
+            _created_at(),
+            sa.Column("resolved_at", sa.DateTime(timezone=True), nullable=True),
+        )),
+        ("chat_messages", lambda: op.create_table(
+            "chat_messages",
+            sa.Column("id", _uuid(), primary_key=True),
+            sa.Column("session_id", _uuid(), sa.ForeignKey("chat_sessions.id"), nullable=False),
+            sa.Column("question", sa.Text(), nullable=False),
+            sa.Column("answer", sa.Text(), nullable=False),
+            sa.Column("sources", sa.JSON(), nullable=True),
+            sa.Column("ticket_id", _uuid(), sa.ForeignKey("tickets.id"), nullable=True),
+            _created_at(),
+            sa.Column("logged_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )),
+        ("tools", lambda: op.create_table(
+            "tools",
+            sa.Column("id", _uuid(), primary_key=True),
+            sa.Column("workspace_id", _uuid(), sa.ForeignKey("workspaces.id"), nullable=False),
+            sa.Column("name", sa.String(255), nullable=False),
+            sa.Column("description", sa.Text(), nullable=False),
+            sa.Column("api_endpoint", sa.String(1024), nullable=False),
+            sa.Column("api_method", tool_method, nullable=False),
+            sa.Column("parameters_schema", sa.JSON(), nullable=False),
+        )),
+        ("rate_limit_buckets", lambda: op.create_table(
+            "rate_limit_buckets",
+            sa.Column("key", sa.String(255), primary_key=True),
+            sa.Column("tokens", sa.Float(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        )),
+        ("analytics_hourly", lambda: op.create_table(
+            "analytics_hourly",
+            sa.Column("workspace_id", _uuid(), sa.ForeignKey("workspaces.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("hour", sa.DateTime(timezone=True), primary_key=True),
+            sa.Column("total", sa.Integer(), nullable=False),
+            sa.Column("answered", sa.Integer(), nullable=False),
+            sa.Column("unanswered", sa.Integer(), nullable=False),
+        )),
+        ("analytics_watermarks", lambda: op.create_table(
+            "analytics_watermarks",
+            sa.Column("name", sa.String(100), primary_key=True),
+            sa.Column("processed_until", sa.DateTime(timezone=True), nullable=True),
+        )),
+        ("question_sketches", lambda: op.create_table(
+            "question_sketches",
+            sa.Column("workspace_id", _uuid(), sa.ForeignKey("workspaces.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("kind", sa.String(20), primary_key=True),
+            sa.Column("state", sa.JSON(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )),
+    ]
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    # 1. Enum-типы и недостающие таблицы (БД, созданные через create_all(), уже содержат часть из них)
+    for enum in ENUMS:
+        enum.create(bind, checkfirst=True)
+    existing = set(sa.inspect(bind).get_table_names())
+    for name, create in _tables():
+        if name not in existing:
+            create()
+
+    # 2. Недостающие колонки в таблицах, созданных раньше
+    for table, column, ddl in ADDED_COLUMNS:
+        op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl}")
+
+
+def downgrade() -> None:
+    # Базовую схему не откатываем: это удалило бы все данные
+    pass
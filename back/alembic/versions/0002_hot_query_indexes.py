@@ -0,0 +1,49 @@
+"""Составные и частичные индексы для частых запросов
+
+- knowledge_sources (workspace_id, created_at, id): список источников воркспейса;
+- tickets (workspace_id, status, created_at, id) и частичный по открытым тикетам: список тикетов;
+- chat_messages (session_id, created_at, id): история сессии; chat_messages (logged_at): агрегация аналитики;
+- chat_sessions (id, workspace_id): проверка принадлежности сессии воркспейсу без чтения таблицы.
+
+Индексы строятся CONCURRENTLY (без блокировки записи), поэтому вне транзакции миграции.
+Регрессию планов (Seq Scan на этих запросах) ловит tests/test_query_plans.py.
+
+Revision ID: 0002_hot_query_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_hot_query_indexes"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+
+# (имя, таблица, колонки, условие частичного индекса)
+INDEXES = [
+    ("ix_knowledge_sources_workspace_created", "knowledge_sources", ["workspace_id", "created_at", "id"], None),
+    ("ix_tickets_workspace_status_created", "tickets", ["workspace_id", "status", "created_at", "id"], None),
+    ("ix_tickets_open_workspace_created", "tickets", ["workspace_id", "created_at", "id"], "status = 'OPEN'"),
+    ("ix_chat_messages_session_created", "chat_messages", ["session_id", "created_at", "id"], None),
+    ("ix_chat_messages_logged_at", "chat_messages", ["logged_at"], None),
+    ("ix_chat_sessions_id_workspace", "chat_sessions", ["id", "workspace_id"], None),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name, table, columns,
+                postgresql_where=sa.text(where) if where else None,
+                postgresql_concurrently=True, if_not_exists=True
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
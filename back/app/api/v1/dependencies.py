@@ -2,6 +2,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
 from pydantic import ValidationError
 from uuid import UUID
 from jose import jwt
@@ -9,6 +10,7 @@ from jose import jwt
 from app.core.database import get_db_session
 from app.core import security
 from app.core.config import settings
+from app.services.auth_cache import auth_cache
 from app import models, schemas
 
 # Схема OAuth2, указывает FastAPI, откуда брать токен
@@ -50,13 +52,19 @@ async def get_current_user(
     except ValueError:
         raise credentials_exception
 
-    # Находим пользователя в БД
+    # Находим пользователя (кэш, затем БД)
+    user = auth_cache.get_user(user_id)
+    if user is not None:
+        return user
+
     result = await db.execute(select(models.User).where(models.User.id == user_id))
     user = result.scalar_one_or_none()
 
     if user is None:
         raise credentials_exception
 
+    db.expunge(user)  # Объект кэша не должен зависеть от сессии запроса
+    auth_cache.put_user(user)
     return user
 
 
@@ -69,8 +77,14 @@ async def get_workspace_member(
     Проверяет, что текущий пользователь имеет доступ (любую роль)
     к указанному workspace_id.
     """
+    membership = auth_cache.get_membership(workspace_id, current_user.id)
+    if membership is not None:
+        return membership
+
+    # .workspace загружаем сразу: у отсоединенного объекта lazy-load невозможен
     result = await db.execute(
         select(models.WorkspaceMembership)
+        .options(selectinload(models.WorkspaceMembership.workspace))
         .where(
             models.WorkspaceMembership.workspace_id == workspace_id,
             models.WorkspaceMembership.user_id == current_user.id
@@ -83,6 +97,9 @@ async def get_workspace_member(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="User does not have access to this workspace"
         )
+    db.expunge(membership.workspace)
+    db.expunge(membership)
+    auth_cache.put_membership(membership)
     return membership
 
 
@@ -1,12 +1,12 @@
 # 'analytics' эндпоинт
 # Заменяет `rag_service` на `ai_client` в `resolve_ticket`
 
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import func, case
 from sqlalchemy.sql.expression import text
-from typing import List
+from typing import List, Optional
 from uuid import UUID
 from datetime import datetime, timedelta, timezone
 
@@ -15,6 +15,11 @@ from app.api.v1.dependencies import get_workspace_member, get_workspace_editor
 from app import schemas, models
 # (ИЗМЕНЕНО) Импортируем ai_client
 from app.services.ai_client import ai_client
+from app.services.faq_index import faq_index
+from app.services.analytics_rollup import get_period_totals
+from app.services.pagination import keyset_page, estimate_count, set_page_headers
+from app.services.question_stats import question_stats, KIND_ALL, KIND_UNANSWERED
+from app.core.config import settings
 
 router = APIRouter()
 
@@ -31,36 +36,39 @@ async def get_analytics(
 ):
     """
     Получение агрегированных данных для дашборда аналитики.
+    Счетчики читаются из почасовых rollup (отставание - до пары минут), а не из chat_messages.
     """
+    now = datetime.now(timezone.utc)
     if period == "24h":
-        start_date = datetime.now() - timedelta(hours=24)
+        start_date = now - timedelta(hours=24)
     elif period == "30d":
-        start_date = datetime.now() - timedelta(days=30)
+        start_date = now - timedelta(days=30)
     else:
-        start_date = datetime.now() - timedelta(days=7)
+        start_date = now - timedelta(days=7)
 
-    print(f"Getting analytics for workspace {workspace_id} since {start_date}")
+    total_queries, answered_queries, unanswered_queries = await get_period_totals(db, workspace_id, start_date)
 
-    total_queries = 150
-    unanswered_queries = 30
-    top_questions = [
-        schemas.AnalyticsTopQuestion(question="Сколько дней отпуск?", count=25),
-        schemas.AnalyticsTopQuestion(question="Как оформить больничный?", count=15)
-    ]
-    top_unanswered_questions = [
-        schemas.AnalyticsTopUnansweredQuestion(
-            question="Есть ли ДМС?",
-            count=10,
-            ticket_id=UUID(int=1)
-        )
-    ]
+    # Частые вопросы - из дневных sketch'ей (приблизительные счетчики, сверху).
+    # Окно - с полуночи (UTC) дня start_date, поэтому до суток шире окна счетчиков выше
+    top_questions = await question_stats.top(db, workspace_id, KIND_ALL, start_date, settings.ANALYTICS_TOP_N)
+    top_unanswered = await question_stats.top(
+        db, workspace_id, KIND_UNANSWERED, start_date, settings.ANALYTICS_TOP_N
+    )
 
     return schemas.AnalyticsResponse(
         total_queries=total_queries,
-        answered_queries=total_queries - unanswered_queries,
+        answered_queries=answered_queries,
         unanswered_queries=unanswered_queries,
-        top_questions=top_questions,
-        top_unanswered_questions=top_unanswered_questions
+        top_questions=[
+            schemas.AnalyticsTopQuestion(question=question, count=count)
+            for question, count, _ in top_questions
+        ],
+        top_unanswered_questions=[
+            schemas.AnalyticsTopUnansweredQuestion(
+                question=question, count=count, ticket_id=UUID(ticket_id) if ticket_id else None
+            )
+            for question, count, ticket_id in top_unanswered
+        ]
     )
 
 
@@ -70,47 +78,36 @@ async def get_analytics(
 )
 async def get_tickets(
         workspace_id: UUID,
+        response: Response,
         status: schemas.TicketStatusEnum = schemas.TicketStatusEnum.OPEN,
+        cursor: Optional[str] = None,
+        limit: int = Query(settings.PAGE_LIMIT_DEFAULT, ge=1, le=settings.PAGE_LIMIT_MAX),
         db: AsyncSession = Depends(get_db_session),
         membership: models.WorkspaceMembership = Depends(get_workspace_member)
 ):
     """
-    (Оставлена заглушка из v1)
-    Получение списка "тикетов".
+    Получение списка "тикетов" (новые сначала), постранично.
+    Следующая страница - с курсором из заголовка X-Next-Cursor,
+    X-Total-Count-Estimate - оценка общего числа тикетов.
     """
-    query = (
-        select(models.Ticket)
-        .where(
-            models.Ticket.workspace_id == workspace_id,
-            models.Ticket.status == status
-        )
-        .order_by(models.Ticket.created_at.desc())
+    query = select(models.Ticket).where(
+        models.Ticket.workspace_id == workspace_id,
+        models.Ticket.status == status
     )
-    result = await db.execute(query)
-    tickets = result.scalars().all()
+    tickets, next_cursor = await keyset_page(db, query, models.Ticket, cursor, limit)
+    set_page_headers(response, next_cursor, await estimate_count(db, query))
 
-    response = []
-    for t in tickets:
-        response.append(schemas.TicketPublic(
+    return [
+        schemas.TicketPublic(
             id=t.id,
             question=t.question,
             status=t.status,
+            hit_count=t.hit_count,
             created_at=t.created_at,
             session_id=UUID(int=1) # (STUB)
-        ))
-
-    if not response and status == schemas.TicketStatusEnum.OPEN:
-        return [
-            schemas.TicketPublic(
-                id=UUID(int=1),
-                question="Есть ли ДМС? (Stub)",
-                status=schemas.TicketStatusEnum.OPEN,
-                created_at=datetime.now(),
-                session_id=UUID(int=2)
-            )
-        ]
-
-    return response
+        )
+        for t in tickets
+    ]
 
 
 @router.post(
@@ -180,9 +177,15 @@ async def resolve_ticket(
         )
         # ai_client сам обновит статус на COMPLETED/FAILED
 
+    if new_source_id:
+        await faq_index.publish_upsert(db, workspace_id, new_source_id, db_ticket.question, resolve_in.answer)
+
     await db.commit()
     await db.refresh(db_ticket)
 
+    # 4. Тикет решен: убираем его из индекса похожих вопросов (фоном)
+    background_tasks.add_task(ai_client.remove_tickets, workspace_id=workspace_id, ticket_ids=[ticket_id])
+
     return schemas.TicketResolvedResponse(
         id=db_ticket.id,
         question=db_ticket.question,
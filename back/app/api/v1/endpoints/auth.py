@@ -34,7 +34,7 @@ async def register_user(
     await db.flush()  # Получаем org_id
 
     # 3. Хешировать пароль
-    hashed_password = security.get_password_hash(user_in.password)
+    hashed_password = await security.aget_password_hash(user_in.password)
 
     # 4. Создать Пользователя
     db_user = models.User(
@@ -83,7 +83,7 @@ async def login_user(
             await db.flush()  # Получаем org_id
 
             # 2. Хешировать пароль
-            hashed_password = security.get_password_hash(form_data.password)
+            hashed_password = await security.aget_password_hash(form_data.password)
 
             # 3. Создать Пользователя
             db_user = models.User(
@@ -109,12 +109,19 @@ async def login_user(
 
 
     # 2. Сравнить хеш пароля
-    if not security.verify_password(form_data.password, user.hashed_password):
+    verified, new_hash = await security.averify_and_update_password(form_data.password, user.hashed_password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Неверный пароль"
         )
 
+    # 2.1. Хеш сделан с устаревшей стоимостью - сохраняем новый
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        print(f"[Auth] Rehashed password for user {user.id}")
+
     # 3. Создать access и refresh токены
     access_token = security.create_access_token(data={"sub": str(user.id)})
     refresh_token = security.create_refresh_token(data={"sub": str(user.id)})
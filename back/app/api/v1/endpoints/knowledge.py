@@ -1,55 +1,106 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from typing import List, Optional
 from uuid import UUID
-import os
-import aiofiles
 
+from app.core.config import settings
 from app.core.database import get_db_session, AsyncSessionFactory
 from app.api.v1.dependencies import get_workspace_editor
 from app.services.ai_client import ai_client
+from app.services.faq_index import faq_index
+from app.services.file_storage import (
+    StoredFile, UploadTooLargeError, UploadFormError, stream_multipart_upload_to_temp, lock_blob, commit_blob, release_blob
+)
+from app.services import upload_sessions
+from app.services.pagination import keyset_page, estimate_count, set_page_headers
+from app.services.upload_sessions import UploadSessionError, UploadBusyError, UploadNotFoundError
 from app import schemas, models
 
 router = APIRouter()
 
-FILE_STORAGE_PATH = "/app/storage"
-os.makedirs(FILE_STORAGE_PATH, exist_ok=True)
-
 
 @router.post(
     "/{workspace_id}/knowledge/upload",
     response_model=schemas.KnowledgeSourcePublic,
-    status_code=status.HTTP_202_ACCEPTED
+    status_code=status.HTTP_202_ACCEPTED,
+    # Тело разбирается вручную (потоково), поэтому схему формы описываем явно
+    openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}
+    }}}}}
 )
 async def upload_knowledge_file(
         workspace_id: UUID,
+        request: Request,
         background_tasks: BackgroundTasks,
-        file: UploadFile = File(...),
         db: AsyncSession = Depends(get_db_session),
         membership: models.WorkspaceMembership = Depends(get_workspace_editor)
 ):
     """
-    Загрузка файла. Запускает обработку в фоновом режиме через ai_client.
+    Загрузка файла (multipart/form-data, поле 'file'). Запускает обработку в фоновом режиме через ai_client.
     """
-    # 1. Сохраняем файл
-    safe_filename = f"{workspace_id}_{UUID(bytes=os.urandom(16))}_{file.filename}"
-    file_path = os.path.join(FILE_STORAGE_PATH, safe_filename)
+    # 1. Сохраняем файл во временный файл прямо из тела запроса (с подсчетом sha256 и размера)
+    try:
+        filename, tmp_file = await stream_multipart_upload_to_temp(request)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except UploadFormError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
+
+    # 2-3. Источник в БД + обработка в back-ai
+    return await ingest_stored_file(db, background_tasks, workspace_id, filename, tmp_file)
 
+
+async def ingest_stored_file(
+        db: AsyncSession,
+        background_tasks: BackgroundTasks,
+        workspace_id: UUID,
+        filename: str,
+        tmp_file: StoredFile
+) -> models.KnowledgeSource:
+    """
+    Переносит сохраненный временный файл в хранилище blob'ов, создает KnowledgeSource
+    и запускает обработку файла в back-ai (фоном).
+    """
+    # 2. Переносим в хранилище (одинаковое содержимое хранится один раз)
+    #    и создаем запись в БД со статусом 'PROCESSING' - под одной блокировкой blob'а
+    await lock_blob(db, tmp_file.sha256)
     try:
-        async with aiofiles.open(file_path, 'wb') as out_file:
-            content = await file.read()
-            await out_file.write(content)
+        stored, existed = await commit_blob(tmp_file)
     except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
 
-    # 2. Создаем запись в БД со статусом 'PROCESSING'
+    reuse_from = None
+    if existed:
+        # Этот файл уже обрабатывался: back-ai скопирует готовые эмбеддинги вместо парсинга
+        result = await db.execute(
+            select(models.KnowledgeSource)
+            .where(
+                models.KnowledgeSource.file_sha256 == stored.sha256,
+                models.KnowledgeSource.status == models.KnowledgeSourceStatusEnum.COMPLETED,
+                models.KnowledgeSource.chunk_count.isnot(None)
+            )
+            .limit(1)
+        )
+        known_source = result.scalar_one_or_none()
+        if known_source:
+            reuse_from = {
+                "collection_name": str(known_source.workspace_id),
+                "source_id": str(known_source.id),
+                "chunk_count": known_source.chunk_count
+            }
+
     db_source = models.KnowledgeSource(
         workspace_id=workspace_id,
         type=models.KnowledgeSourceTypeEnum.FILE,
-        name=file.filename,
+        name=filename,
         status=models.KnowledgeSourceStatusEnum.PROCESSING,
-        file_path=file_path
+        file_path=stored.path,
+        file_sha256=stored.sha256,
+        file_size=stored.size
     )
     db.add(db_source)
     await db.commit()
@@ -60,13 +111,128 @@ async def upload_knowledge_file(
         ai_client.process_file,
         workspace_id=workspace_id,
         source_id=db_source.id,
-        file_path=file_path,
-        filename=file.filename
+        file_path=stored.path,
+        filename=filename,
+        content_sha256=stored.sha256,
+        reuse_from=reuse_from
     )
 
     return db_source
 
 
+# --- Возобновляемая загрузка больших файлов ---
+# 1. POST   /uploads                - создать сессию (имя и размер файла)
+# 2. PUT    /uploads/{id}?offset=N  - отправить часть (тело запроса - байты файла с позиции N)
+#    GET    /uploads/{id}           - узнать, сколько уже получено (после обрыва)
+# 3. POST   /uploads/{id}/complete  - проверить sha256 и запустить обычную обработку файла
+
+def _upload_session_or_404(workspace_id: UUID, upload_id: UUID) -> upload_sessions.UploadSession:
+    session = upload_sessions.get_session(workspace_id, upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+
+@router.post(
+    "/{workspace_id}/knowledge/uploads",
+    response_model=schemas.UploadSessionPublic,
+    status_code=status.HTTP_201_CREATED
+)
+async def create_upload_session(
+        workspace_id: UUID,
+        upload_in: schemas.UploadSessionCreate,
+        membership: models.WorkspaceMembership = Depends(get_workspace_editor)
+):
+    """Создание сессии возобновляемой загрузки."""
+    try:
+        session = await upload_sessions.create_session(workspace_id, upload_in.filename, upload_in.size)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    return session._asdict()
+
+
+@router.get(
+    "/{workspace_id}/knowledge/uploads/{upload_id}",
+    response_model=schemas.UploadSessionPublic
+)
+async def get_upload_session(
+        workspace_id: UUID,
+        upload_id: UUID,
+        membership: models.WorkspaceMembership = Depends(get_workspace_editor)
+):
+    """Состояние загрузки: offset - с какого байта продолжать."""
+    return _upload_session_or_404(workspace_id, upload_id)._asdict()
+
+
+@router.put(
+    "/{workspace_id}/knowledge/uploads/{upload_id}",
+    response_model=schemas.UploadSessionPublic
+)
+async def upload_part(
+        workspace_id: UUID,
+        upload_id: UUID,
+        offset: int,
+        request: Request,
+        membership: models.WorkspaceMembership = Depends(get_workspace_editor)
+):
+    """
+    Прием части файла. Байты пишутся на диск по мере получения,
+    поэтому при обрыве соединения полученное не теряется.
+    """
+    session = _upload_session_or_404(workspace_id, upload_id)
+    try:
+        session = await upload_sessions.append_part(session, offset, request.stream())
+    except UploadNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except UploadBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except UploadSessionError as e:
+        # Клиент узнает актуальное смещение через GET и продолжит с него
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return session._asdict()
+
+
+@router.post(
+    "/{workspace_id}/knowledge/uploads/{upload_id}/complete",
+    response_model=schemas.KnowledgeSourcePublic,
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def complete_upload_session(
+        workspace_id: UUID,
+        upload_id: UUID,
+        complete_in: schemas.UploadSessionComplete,
+        background_tasks: BackgroundTasks,
+        db: AsyncSession = Depends(get_db_session),
+        membership: models.WorkspaceMembership = Depends(get_workspace_editor)
+):
+    """Завершение загрузки: проверка контрольной суммы и запуск обработки файла."""
+    session = _upload_session_or_404(workspace_id, upload_id)
+    try:
+        tmp_file = await upload_sessions.finalize_session(session, complete_in.sha256)
+    except UploadNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except UploadBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except UploadSessionError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return await ingest_stored_file(db, background_tasks, workspace_id, session.filename, tmp_file)
+
+
+@router.delete(
+    "/{workspace_id}/knowledge/uploads/{upload_id}",
+    status_code=status.HTTP_204_NO_CONTENT
+)
+async def abort_upload_session(
+        workspace_id: UUID,
+        upload_id: UUID,
+        membership: models.WorkspaceMembership = Depends(get_workspace_editor)
+):
+    """Отмена загрузки и удаление полученных данных."""
+    upload_sessions.abort_session(_upload_session_or_404(workspace_id, upload_id))
+    return None
+
+
 @router.post(
     "/{workspace_id}/knowledge/qa",
     response_model=schemas.KnowledgeSourcePublic,
@@ -91,6 +257,8 @@ async def add_knowledge_qa(
         content={"question": qa_in.question, "answer": qa_in.answer}
     )
     db.add(db_source)
+    await db.flush()
+    await faq_index.publish_upsert(db, workspace_id, db_source.id, qa_in.question, qa_in.answer)
     await db.commit()
     await db.refresh(db_source)
 
@@ -149,17 +317,26 @@ async def add_knowledge_article(
 )
 async def get_knowledge_sources(
         workspace_id: UUID,
+        response: Response,
+        type: Optional[models.KnowledgeSourceTypeEnum] = None,
+        status: Optional[models.KnowledgeSourceStatusEnum] = None,
+        cursor: Optional[str] = None,
+        limit: int = Query(settings.PAGE_LIMIT_DEFAULT, ge=1, le=settings.PAGE_LIMIT_MAX),
         db: AsyncSession = Depends(get_db_session),
         membership: models.WorkspaceMembership = Depends(get_workspace_editor)
 ):
-    """Получение списка всех источников знаний."""
-    query = (
-        select(models.KnowledgeSource)
-        .where(models.KnowledgeSource.workspace_id == workspace_id)
-        .order_by(models.KnowledgeSource.created_at.desc())
-    )
-    result = await db.execute(query)
-    sources = result.scalars().all()
+    """
+    Получение списка источников знаний (новые сначала), постранично, с фильтрами по типу и статусу.
+    Следующая страница - с курсором из заголовка X-Next-Cursor.
+    """
+    query = select(models.KnowledgeSource).where(models.KnowledgeSource.workspace_id == workspace_id)
+    if type is not None:
+        query = query.where(models.KnowledgeSource.type == type)
+    if status is not None:
+        query = query.where(models.KnowledgeSource.status == status)
+
+    sources, next_cursor = await keyset_page(db, query, models.KnowledgeSource, cursor, limit)
+    set_page_headers(response, next_cursor, await estimate_count(db, query))
     return sources
 
 
@@ -224,7 +401,8 @@ async def update_knowledge_source(
     background_tasks.add_task(
         ai_client.delete_embeddings,
         collection_name=str(workspace_id),
-        source_id=source_id
+        source_id=source_id,
+        chunk_count=db_source.chunk_count
     )
 
     # 2. Обновляем контент в БД и ставим статус PROCESSING
@@ -232,6 +410,7 @@ async def update_knowledge_source(
         db_source.content = {"question": update_data.question, "answer": update_data.answer}
         db_source.name = update_data.question[:255]
         db_source.status = models.KnowledgeSourceStatusEnum.PROCESSING
+        db_source.chunk_count = None  # Будет записано после пере-индексации
 
         # 3. Запускаем фоновую задачу re-process через ai_client
         background_tasks.add_task(
@@ -241,6 +420,9 @@ async def update_knowledge_source(
             qa_in=update_data
         )
 
+    if db_source.type == models.KnowledgeSourceTypeEnum.QNA:
+        await faq_index.publish_upsert(db, workspace_id, db_source.id, update_data.question, update_data.answer)
+
     await db.commit()
     await db.refresh(db_source)
 
@@ -277,21 +459,18 @@ async def delete_knowledge_source(
     background_tasks.add_task(
         ai_client.delete_embeddings,
         collection_name=str(workspace_id),
-        source_id=source_id
+        source_id=source_id,
+        chunk_count=db_source.chunk_count
     )
 
-    # 2. (Фоном) Удаляем файл (логика остается здесь)
+    # 2. (Фоном) Освобождаем файл: blob удаляется, только если это была последняя ссылка
     if db_source.type == models.KnowledgeSourceTypeEnum.FILE and db_source.file_path:
-        def delete_file(path: str):
-            try:
-                os.remove(path)
-                print(f"[Task] Deleted file: {path}")
-            except OSError as e:
-                print(f"[Task] Error deleting file {path}: {e}")
-        background_tasks.add_task(delete_file, path=db_source.file_path)
+        background_tasks.add_task(release_blob, path=db_source.file_path, sha256=db_source.file_sha256)
 
     # 3. Удаляем из БД
     await db.delete(db_source)
+    if db_source.type == models.KnowledgeSourceTypeEnum.QNA:
+        await faq_index.publish_remove(db, workspace_id, source_id)
     await db.commit()
 
     return None
\ No newline at end of file
@@ -1,9 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Response
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Response, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
 from app.core.database import get_db_session
-from app.api.v1.endpoints.query import public_query  # Импортируем логику public_query
+from app.api.v1.endpoints.query import check_public_access, answer_public_query, client_ip  # Логика public_query
 from app import schemas
 
 router = APIRouter()
@@ -33,6 +33,7 @@ async def get_widget_js():
     tags=["5. RAG Query (Public Widget)"]
 )
 async def public_query_audio(
+        request: Request,
         file: UploadFile = File(...),
         workspace_id: UUID = Form(...),
         session_id: UUID = Form(...),
@@ -41,6 +42,8 @@ async def public_query_audio(
     """
     (STUB) Публичный эндпоинт для отправки голосового запроса (Speech-to-Text).
     """
+    # 0. Те же проверки и лимиты, что и у /public/query - до распознавания речи
+    await check_public_access(workspace_id, session_id, client_ip(request))
 
     # 1. Сохраняем аудиофайл
     print(f"Received audio file {file.filename} for workspace {workspace_id}")
@@ -57,7 +60,7 @@ async def public_query_audio(
     )
 
     # 4. Вызываем ту же логику, что и в /public/query
-    query_response = await public_query(query_in=query_in, db=db)
+    query_response = await answer_public_query(query_in=query_in, db=db)
 
     # 5. Возвращаем расширенный ответ
     return schemas.AudioQueryResponse(
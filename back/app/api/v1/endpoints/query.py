@@ -1,63 +1,121 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, Response
+from sqlalchemy import update, delete
 from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
+from typing import List, Optional, Tuple
+import uuid
+import ipaddress
+
+from app.core.config import settings
 
 from app.core.database import get_db_session
 from app.api.v1.dependencies import get_workspace_member
 from app.services.ai_client import ai_client
+from app.services.chat_log import chat_log
+from app.services.question_stats import question_stats
+from app.services.faq_index import faq_index
+from app.services.pagination import keyset_page, set_page_headers
+from app.services.rate_limiter import rate_limiter
+from app.services.workspace_registry import workspace_registry
 from app import schemas, models
 
 router = APIRouter()
 
 
-async def get_or_create_session(db: AsyncSession, workspace_id: UUID, session_id: UUID) -> models.ChatSession:
-    """Находит или создает сессию чата в БД."""
-    result = await db.execute(
-        select(models.ChatSession)
-        .where(
-            models.ChatSession.id == session_id,
-            models.ChatSession.workspace_id == workspace_id
-        )
-    )
-    session = result.scalar_one_or_none()
-
-    if not session:
-        session = models.ChatSession(id=session_id, workspace_id=workspace_id)
-        db.add(session)
-        await db.commit()
-        await db.refresh(session)
-    return session
-
-
 async def create_ticket_and_message(
         db: AsyncSession,
-        session: models.ChatSession,
+        workspace_id: UUID,
+        session_id: UUID,
         question: str,
         answer: str
 ) -> models.Ticket:
-    """Создает Тикет и Сообщение в БД, когда ответ не найден."""
-    # 1. Создаем Тикет
+    """
+    Регистрирует вопрос без ответа: присоединяет его к открытому тикету с похожим вопросом
+    (hit_count + 1) или создает новый Тикет (сразу, с коммитом).
+    Сообщение, связанное с тикетом, пишется через журнал чата.
+    """
+    # 1. Тикет (новый или существующий с похожим вопросом)
+    db_ticket = await create_or_attach_ticket(db, workspace_id, question)
+
+    # 2. Сообщение, связанное с тикетом
+    chat_log.record(workspace_id, session_id, question, answer, sources=[], ticket_id=db_ticket.id)
+    question_stats.record(workspace_id, question, ticket_id=db_ticket.id)
+    return db_ticket
+
+
+async def create_or_attach_ticket(db: AsyncSession, workspace_id: UUID, question: str) -> models.Ticket:
+    """
+    Создает тикет и регистрирует его вопрос в индексе тикетов back-ai.
+    Тикет коммитится ДО индексации: параллельный похожий вопрос, нашедший его в индексе,
+    всегда найдет и строку в БД. Если в индексе уже есть похожий открытый тикет -
+    новый удаляется, а у найденного увеличивается hit_count.
+    """
     db_ticket = models.Ticket(
-        workspace_id=session.workspace_id,
+        id=uuid.uuid4(),
+        workspace_id=workspace_id,
         question=question,
         status=models.TicketStatusEnum.OPEN
     )
     db.add(db_ticket)
-    await db.flush()
+    await db.commit()
+
+    for _ in range(2):
+        try:
+            ticket_id = await ai_client.assign_ticket(workspace_id, db_ticket.id, question)
+        except HTTPException as e:
+            print(f"[Query] Ticket clustering unavailable, keeping a new ticket: {e.detail}")
+            return db_ticket
+        if ticket_id == db_ticket.id:
+            return db_ticket
+
+        result = await db.execute(
+            update(models.Ticket)
+            .where(
+                models.Ticket.id == ticket_id,
+                models.Ticket.workspace_id == workspace_id,
+                models.Ticket.status == models.TicketStatusEnum.OPEN
+            )
+            .values(hit_count=models.Ticket.hit_count + 1)
+            .returning(models.Ticket)
+        )
+        similar_ticket = result.scalar_one_or_none()
+        if similar_ticket is not None:
+            await db.execute(delete(models.Ticket).where(models.Ticket.id == db_ticket.id))
+            await db.commit()
+            return similar_ticket
+        await db.rollback()
+
+        # Найденный тикет уже решен, а индекс еще не обновлен - убираем его из индекса и ищем снова.
+        # Отсутствующую строку из индекса не убираем: ее мог только что создать параллельный запрос
+        similar_status = await db.scalar(
+            select(models.Ticket.status).where(
+                models.Ticket.id == ticket_id, models.Ticket.workspace_id == workspace_id
+            )
+        )
+        if similar_status != models.TicketStatusEnum.RESOLVED:
+            break
+        await ai_client.remove_tickets(workspace_id, [ticket_id])
+    return db_ticket
 
-    # 2. Создаем Сообщение, связанное с тикетом
-    db_message = models.ChatMessage(
-        session_id=session.id,
+
+async def answer_question(
+        workspace_id: UUID, question: str, session_id: UUID
+) -> Tuple[str, List[schemas.QueryResponseSource]]:
+    """
+    Отвечает на вопрос: сначала по точному совпадению с Q&A (без 'back-ai'),
+    иначе через RAG-пайплайн ai_client.
+    """
+    faq_entry = await faq_index.lookup(workspace_id, question)
+    if faq_entry:
+        print(f"[Query] Exact Q&A match (Source ID: {faq_entry.source_id})")
+        return faq_entry.answer, [faq_entry.as_source()]
+
+    return await ai_client.answer_query(
+        workspace_id=workspace_id,
         question=question,
-        answer=answer,
-        sources=[],
-        ticket_id=db_ticket.id
+        session_id=session_id
     )
-    db.add(db_message)
-    await db.commit()
-    await db.refresh(db_ticket)
-    return db_ticket
 
 
 @router.post(
@@ -74,12 +132,9 @@ async def query_workspace(
     """
     Отправка вопроса боту от имени администратора/редактора.
     """
-    # 1. Найти или создать сессию чата
-    session = await get_or_create_session(db, workspace_id, query_in.session_id)
-
-    # 2. Вызов RAG-пайплайна через ai_client
+    # 1. Вызов RAG-пайплайна через ai_client (или ответ из индекса Q&A)
     try:
-        answer, sources = await ai_client.answer_query(
+        answer, sources = await answer_question(
             workspace_id=workspace_id,
             question=query_in.question,
             session_id=query_in.session_id
@@ -89,26 +144,23 @@ async def query_workspace(
 
     ticket_id = None
 
-    # 3. Логика "Не найдено" / "Создание тикета"
+    # 2. Логика "Не найдено" / "Создание тикета"
     if not sources:
         db_ticket = await create_ticket_and_message(
             db=db,
-            session=session,
+            workspace_id=workspace_id,
+            session_id=query_in.session_id,
             question=query_in.question,
             answer=answer
         )
         ticket_id = db_ticket.id
     else:
-        # 4. Логируем успешный ответ
-        db_message = models.ChatMessage(
-            session_id=session.id,
-            question=query_in.question,
-            answer=answer,
-            sources=[s.model_dump() for s in sources],
-            ticket_id=None
+        # 3. Логируем успешный ответ (сессия и сообщение пишутся в БД фоном)
+        chat_log.record(
+            workspace_id, query_in.session_id, query_in.question, answer,
+            sources=[s.model_dump() for s in sources]
         )
-        db.add(db_message)
-        await db.commit()
+        question_stats.record(workspace_id, query_in.question)
 
     return schemas.QueryResponse(
         answer=answer,
@@ -117,6 +169,37 @@ async def query_workspace(
     )
 
 
+@router.get(
+    "/workspaces/{workspace_id}/sessions/{session_id}/messages",
+    response_model=List[schemas.ChatMessagePublic],
+    tags=["4. RAG Query"]
+)
+async def get_session_messages(
+        workspace_id: UUID,
+        session_id: UUID,
+        response: Response,
+        cursor: Optional[str] = None,
+        limit: int = Query(settings.PAGE_LIMIT_DEFAULT, ge=1, le=settings.PAGE_LIMIT_MAX),
+        db: AsyncSession = Depends(get_db_session),
+        membership: models.WorkspaceMembership = Depends(get_workspace_member)
+):
+    """
+    История сессии чата (старые сообщения сначала), постранично.
+    Следующая страница - с курсором из заголовка X-Next-Cursor.
+    """
+    query = (
+        select(models.ChatMessage)
+        .join(models.ChatSession, models.ChatSession.id == models.ChatMessage.session_id)
+        .where(
+            models.ChatMessage.session_id == session_id,
+            models.ChatSession.workspace_id == workspace_id
+        )
+    )
+    messages, next_cursor = await keyset_page(db, query, models.ChatMessage, cursor, limit, descending=False)
+    set_page_headers(response, next_cursor, None)
+    return messages
+
+
 @router.post(
     "/public/query",
     response_model=schemas.QueryResponse,
@@ -124,22 +207,67 @@ async def query_workspace(
 )
 async def public_query(
         query_in: schemas.PublicQueryRequest,
+        request: Request,
         db: AsyncSession = Depends(get_db_session)
 ):
     """
     Публичный эндпоинт для отправки запросов из виджета.
     """
-    # 1. Проверить, что workspace_id существует
-    result = await db.execute(select(models.Workspace.id).where(models.Workspace.id == query_in.workspace_id))
-    if not result.scalar_one_or_none():
+    await check_public_access(query_in.workspace_id, query_in.session_id, client_ip(request))
+    return await answer_public_query(query_in, db)
+
+
+_TRUSTED_PROXIES = [ipaddress.ip_network(network) for network in settings.TRUSTED_PROXIES]
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """
+    IP клиента. Если запрос пришел от доверенного прокси (TRUSTED_PROXIES, например nginx фронтенда) -
+    последний адрес X-Forwarded-For, не принадлежащий доверенному прокси (левее него клиент может подделать).
+    """
+    peer = request.client.host if request.client else None
+    if not peer or not _is_trusted_proxy(peer):
+        return peer
+    forwarded = [address.strip() for address in request.headers.get("x-forwarded-for", "").split(",")]
+    for address in reversed(forwarded):
+        if address and not _is_trusted_proxy(address):
+            return address
+    return peer
+
+
+async def check_public_access(
+        workspace_id: UUID, session_id: UUID, ip: Optional[str]
+) -> schemas.WidgetSettings:
+    """
+    Проверки публичного запроса до его обработки: воркспейс существует,
+    виджет включен (реестр в памяти, без БД) и не превышены лимиты частоты (иначе 429).
+    """
+    widget_settings = await workspace_registry.resolve(workspace_id)
+    if widget_settings is None:
         raise HTTPException(status_code=404, detail="Workspace not found")
+    if not widget_settings.enabled:
+        raise HTTPException(status_code=403, detail="Widget is disabled for this workspace")
 
-    # 2. Найти или создать сессию
-    session = await get_or_create_session(db, query_in.workspace_id, query_in.session_id)
+    await rate_limiter.check(workspace_id, session_id, ip, widget_settings)
+    return widget_settings
 
-    # 3. Вызов RAG-пайплайна через ai_client
+
+async def answer_public_query(
+        query_in: schemas.PublicQueryRequest,
+        db: AsyncSession
+) -> schemas.QueryResponse:
+    """Ответ на публичный запрос (после check_public_access)."""
+    # 1. Вызов RAG-пайплайна через ai_client (или ответ из индекса Q&A)
     try:
-        answer, sources = await ai_client.answer_query(
+        answer, sources = await answer_question(
             workspace_id=query_in.workspace_id,
             question=query_in.question,
             session_id=query_in.session_id
@@ -149,26 +277,23 @@ async def public_query(
 
     ticket_id = None
 
-    # 4. Логика "Не найдено" / "Создание тикета"
+    # 2. Логика "Не найдено" / "Создание тикета"
     if not sources:
         db_ticket = await create_ticket_and_message(
             db=db,
-            session=session,
+            workspace_id=query_in.workspace_id,
+            session_id=query_in.session_id,
             question=query_in.question,
             answer=answer
         )
         ticket_id = db_ticket.id
     else:
-        # 5. Логируем успешный ответ
-        db_message = models.ChatMessage(
-            session_id=session.id,
-            question=query_in.question,
-            answer=answer,
-            sources=[s.model_dump() for s in sources],
-            ticket_id=None
+        # 3. Логируем успешный ответ (сессия и сообщение пишутся в БД фоном)
+        chat_log.record(
+            query_in.workspace_id, query_in.session_id, query_in.question, answer,
+            sources=[s.model_dump() for s in sources]
         )
-        db.add(db_message)
-        await db.commit()
+        question_stats.record(query_in.workspace_id, query_in.question)
 
     return schemas.QueryResponse(
         answer=answer,
@@ -7,6 +7,9 @@ from uuid import UUID
 
 from app.core.database import get_db_session
 from app.api.v1.dependencies import get_current_user, get_workspace_member, get_workspace_admin
+from app.services.auth_cache import auth_cache
+from app.services.faq_index import faq_index
+from app.services.workspace_registry import workspace_registry
 from app import schemas, models
 
 router = APIRouter()
@@ -29,7 +32,8 @@ async def create_workspace(
     db_workspace = models.Workspace(
         name=workspace_in.name,
         description=workspace_in.description,
-        organization_id=current_user.organization_id
+        organization_id=current_user.organization_id,
+        widget_settings=workspace_in.widget_settings.model_dump() if workspace_in.widget_settings else None
     )
     db.add(db_workspace)
     await db.flush()  # Получаем ID воркспейса
@@ -41,6 +45,7 @@ async def create_workspace(
         role=models.UserRoleEnum.ADMIN
     )
     db.add(db_membership)
+    await workspace_registry.publish_upsert(db, db_workspace)
 
     await db.commit()
     await db.refresh(db_workspace)
@@ -116,6 +121,8 @@ async def update_workspace(
         setattr(db_workspace, key, value)
 
     db.add(db_workspace)
+    if "widget_settings" in update_data:
+        await workspace_registry.publish_upsert(db, db_workspace)
     await db.commit()
     await db.refresh(db_workspace)
     return db_workspace
@@ -145,6 +152,9 @@ async def delete_workspace(
     print(f"TODO: Delete files and ChromaDB collection for workspace {workspace_id}")
 
     await db.delete(db_workspace)
+    await auth_cache.invalidate_workspace(db, workspace_id)
+    await workspace_registry.publish_delete(db, workspace_id)
+    await faq_index.publish_drop_workspace(db, workspace_id)
     await db.commit()
 
     return None  # 204 No Content
@@ -239,6 +249,7 @@ async def add_workspace_user(
         role=invite_in.role
     )
     db.add(db_membership)
+    await auth_cache.invalidate_membership(db, workspace_id, user_to_add.id)
     await db.commit()
 
     return schemas.WorkspaceUser(
@@ -287,6 +298,7 @@ async def update_workspace_user_role(
     # 2. Обновить роль
     membership_to_update.role = role_in.role
     db.add(membership_to_update)
+    await auth_cache.invalidate_membership(db, workspace_id, user_id)
     await db.commit()
 
     return schemas.WorkspaceUser(
@@ -332,6 +344,7 @@ async def remove_workspace_user(
 
     # 2. Удалить
     await db.delete(membership_to_delete)
+    await auth_cache.invalidate_membership(db, workspace_id, user_id)
     await db.commit()
 
     return None  # 204 No Content
\ No newline at end of file
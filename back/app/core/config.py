@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import AnyHttpUrl
-from typing import List
+from typing import List, Optional, Dict
 
 class Settings(BaseSettings):
     """
@@ -17,6 +17,10 @@ class Settings(BaseSettings):
     REFRESH_TOKEN_EXPIRE_DAYS: int = 30
     JWT_ALGORITHM: str = "HS256"
 
+    # Хеширование паролей (bcrypt) - в отдельном пуле потоков, не в event loop
+    BCRYPT_ROUNDS: int = 12  # Хеши с меньшей стоимостью перехешируются при входе
+    PASSWORD_HASH_WORKERS: int = 4
+
     # Настройки базы данных
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
@@ -30,6 +34,89 @@ class Settings(BaseSettings):
     AI_SERVICE_URL: AnyHttpUrl
     API_V1_STR_AI: str
 
+    # Транспорт back -> back-ai
+    AI_WIRE_FORMAT: str = "msgpack"  # Формат ответов back-ai: "msgpack" или "json"
+    # HTTP/2 требует сервера с поддержкой h2 (uvicorn умеет только HTTP/1.1 - нужен hypercorn или h2-прокси)
+    AI_HTTP2: bool = False
+    AI_MAX_CONNECTIONS: int = 100
+    AI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    AI_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+
+    # Таймауты вызовов back-ai по типу операции (сек.)
+    AI_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    AI_TIMEOUT_DEFAULT_SECONDS: float = 30.0
+    AI_TIMEOUT_QUERY_SECONDS: float = 60.0
+    AI_TIMEOUT_PROCESSING_SECONDS: float = 300.0
+
+    # Circuit breaker: после N ошибок подряд запросы сразу получают 503 на AI_CIRCUIT_RESET_SECONDS
+    AI_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    AI_CIRCUIT_RESET_SECONDS: float = 30.0
+
+    # Несколько экземпляров back-ai (JSON-объект {"url": вес}); пусто - только AI_SERVICE_URL.
+    # Запросы воркспейса направляются на экземпляр по консистентному хешу workspace_id.
+    AI_SERVICE_REPLICAS: Dict[str, float] = {}
+    AI_HASH_RING_VNODES: int = 100  # Виртуальных узлов на единицу веса
+    AI_HEALTH_CHECK_INTERVAL_SECONDS: float = 10.0
+    AI_HEALTH_CHECK_TIMEOUT_SECONDS: float = 2.0
+    AI_HEALTH_CHECK_SLOW_SECONDS: float = 0.5  # Медленный экземпляр получает половину веса
+
+    # Hedged-запросы /query на следующий экземпляр и бюджет повторов
+    # (AI_SERVICE_HEDGE_URL - второй экземпляр, если AI_SERVICE_REPLICAS не задан)
+    AI_SERVICE_HEDGE_URL: Optional[AnyHttpUrl] = None
+    AI_HEDGE_DELAY_SECONDS: float = 1.0
+    AI_QUERY_MAX_RETRIES: int = 1
+    AI_RETRY_BUDGET_RATIO: float = 0.1  # Повторов/hedge на один запрос (в среднем)
+    AI_RETRY_BUDGET_MAX: float = 10.0
+
+    # Хранилище загруженных файлов
+    FILE_STORAGE_PATH: str = "/app/storage"
+    MAX_UPLOAD_SIZE_BYTES: int = 256 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE_BYTES: int = 1024 * 1024
+    # Передача файла в back-ai: "shared_volume" - путь в общем томе file_storage,
+    # "stream" - содержимое в теле запроса (back-ai может работать на другом узле)
+    AI_FILE_TRANSFER_MODE: str = "shared_volume"
+    UPLOAD_SESSION_TTL_HOURS: float = 24.0  # Незавершенные возобновляемые загрузки удаляются после
+
+    # Кэш пользователей и членств для авторизации (инвалидация между воркерами - LISTEN/NOTIFY)
+    AUTH_CACHE_TTL_SECONDS: float = 60.0
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+    NOTIFY_RECONNECT_SECONDS: float = 5.0
+
+    # Журнал чата: сессии и сообщения пишутся пачками в фоне
+    CHAT_LOG_FLUSH_INTERVAL_MS: int = 200
+    CHAT_LOG_MAX_BATCH: int = 500  # Запись раньше интервала, если накопилось столько сообщений
+    CHAT_LOG_MAX_BUFFER: int = 10000  # Предел буфера, пока БД недоступна
+
+    # Реестр воркспейсов для публичного виджета
+    WORKSPACE_REGISTRY_MISS_TTL_SECONDS: float = 30.0  # Сколько помнить, что воркспейса нет
+
+    # Ограничение частоты публичных запросов (token bucket, запросов в минуту;
+    # воркспейс может переопределить лимиты в widget_settings)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"  # "memory" - в каждом воркере свои бакеты, "postgres" - общие
+    RATE_LIMIT_WORKSPACE_PER_MINUTE: int = 600
+    RATE_LIMIT_SESSION_PER_MINUTE: int = 20
+    RATE_LIMIT_IP_PER_MINUTE: int = 60
+    RATE_LIMIT_MAX_BUCKETS: int = 100000  # Бакетов в памяти; сверх предела удаляются давно не использованные (LRU)
+    RATE_LIMIT_PRUNE_INTERVAL_SECONDS: float = 300.0  # Очистка простаивающих бакетов в Postgres
+    # Прокси, которым доверяем X-Forwarded-For (nginx фронтенда в сети docker).
+    # IP клиента для лимита берется из X-Forwarded-For, только если запрос пришел с этих адресов
+    TRUSTED_PROXIES: List[str] = ["127.0.0.1/32", "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]
+
+    # Аналитика: инкрементальная агрегация chat_messages в почасовые rollup
+    ANALYTICS_ROLLUP_INTERVAL_SECONDS: float = 60.0
+    ANALYTICS_ROLLUP_LAG_SECONDS: float = 60.0  # Сообщения моложе этого ждут следующего прохода
+
+    # Частые вопросы (Space-Saving sketch на воркспейс и день)
+    QUESTION_SKETCH_CAPACITY: int = 200  # Счетчиков в sketch
+    QUESTION_SKETCH_FLUSH_SECONDS: float = 30.0
+    QUESTION_SKETCH_RETENTION_DAYS: int = 31
+    ANALYTICS_TOP_N: int = 10
+
+    # Списки (тикеты, источники, история чата): keyset-пагинация
+    PAGE_LIMIT_DEFAULT: int = 50
+    PAGE_LIMIT_MAX: int = 200
+
     # --- УДАЛЕНО ---
     # OLLAMA_HOST: AnyHttpUrl
     # CHROMA_HOST: str
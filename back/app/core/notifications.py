@@ -0,0 +1,111 @@
+# Рассылка событий между воркерами 'back' через Postgres LISTEN/NOTIFY.
+# Используется для инвалидации in-process кэшей: воркер, изменивший данные,
+# публикует событие в той же транзакции (доставляется только после COMMIT),
+# остальные воркеры получают его через выделенное asyncpg-соединение.
+import asyncio
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+
+CHANNEL = "knowledgebot_events"
+
+EventHandler = Callable[[Any], None]
+ResetHandler = Callable[[], None]
+
+
+class NotificationHub:
+    """
+    Подписки по темам (topic -> обработчики).
+    Обработчики синхронные и должны быть быстрыми (вызываются из callback asyncpg).
+    on_reset вызывается после переподключения: пока соединения не было,
+    события могли потеряться, поэтому кэш надо сбросить целиком.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._handlers: Dict[str, List[EventHandler]] = {}
+        self._reset_handlers: List[ResetHandler] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, topic: str, handler: EventHandler, on_reset: Optional[ResetHandler] = None):
+        self._handlers.setdefault(topic, []).append(handler)
+        if on_reset:
+            self._reset_handlers.append(on_reset)
+
+    async def publish(self, db: AsyncSession, topic: str, data: Any, dispatch_locally: bool = True):
+        """
+        Публикует событие в транзакции db. Событие уходит другим воркерам после db.commit()
+        (и не уходит при rollback). Локальные обработчики вызываются сразу
+        (dispatch_locally=False - только после коммита, как у остальных воркеров).
+        """
+        payload = json.dumps({"topic": topic, "data": data}, default=str)
+        await db.execute(select(func.pg_notify(CHANNEL, payload)))
+        if dispatch_locally:
+            self._dispatch(topic, data)
+
+    def _dispatch(self, topic: str, data: Any):
+        for handler in self._handlers.get(topic, []):
+            try:
+                handler(data)
+            except Exception as e:
+                print(f"[Notifications] Handler for '{topic}' failed: {e}")
+
+    def _on_notification(self, connection, pid, channel, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        self._dispatch(event.get("topic"), event.get("data"))
+
+    def _reset_all(self):
+        for on_reset in self._reset_handlers:
+            on_reset()
+
+    async def _listen_loop(self):
+        connected_before = False
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                await connection.add_listener(CHANNEL, self._on_notification)
+                if connected_before:
+                    self._reset_all()
+                connected_before = True
+                print(f"[Notifications] Listening on '{CHANNEL}'")
+                try:
+                    while not connection.is_closed():
+                        await asyncio.sleep(settings.NOTIFY_RECONNECT_SECONDS)
+                        await connection.execute("SELECT 1")  # Обнаруживаем обрыв соединения
+                finally:
+                    if not connection.is_closed():
+                        await connection.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Notifications] Listener connection lost: {e}")
+                # Пока нет соединения, события теряются - сбрасываем кэши и не держим устаревшее
+                self._reset_all()
+            await asyncio.sleep(settings.NOTIFY_RECONNECT_SECONDS)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# --- Единый экземпляр NotificationHub ---
+# asyncpg принимает обычный postgresql:// DSN, без драйвера SQLAlchemy
+notifications = NotificationHub(dsn=settings.DATABASE_URL.replace("+asyncpg", ""))
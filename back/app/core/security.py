@@ -1,13 +1,25 @@
 from jose import jwt
 from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 from uuid import UUID
+import asyncio
 
 from app.core.config import settings
 
 # Контекст для хеширования паролей
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min_rounds: хеши с меньшей стоимостью считаются устаревшими (см. averify_and_update_password)
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS
+)
+
+# bcrypt занимает сотни мс CPU (и отпускает GIL): выполняем его в ограниченном пуле,
+# чтобы вход/регистрация не блокировали event loop, а шторм логинов - не занимал все потоки
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
 
 ALGORITHM = settings.JWT_ALGORITHM
 
@@ -22,6 +34,22 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def aget_password_hash(password: str) -> str:
+    """get_password_hash в пуле потоков хеширования."""
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, get_password_hash, password)
+
+
+async def averify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Проверяет пароль в пуле потоков хеширования.
+    Возвращает (верен ли пароль, новый хеш или None). Новый хеш есть, если старый
+    сделан с устаревшими параметрами (например, BCRYPT_ROUNDS увеличили) - его нужно сохранить.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _hash_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Создает JWT Access Token."""
     to_encode = data.copy()
@@ -0,0 +1,15 @@
+# Вспомогательные функции для работы с текстом вопросов
+import re
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"\s+", re.UNICODE)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Нормализует вопрос для точного сравнения:
+    нижний регистр, 'ё' -> 'е', без пунктуации и лишних пробелов.
+    """
+    text = question.lower().replace("ё", "е")
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
@@ -10,6 +10,14 @@ import asyncio
 from app.api.v1.api import api_router
 from app.core.config import settings
 from app.core.database import engine, Base
+from app.core.notifications import notifications
+from app.services.ai_client import ai_client
+from app.services.chat_log import chat_log
+from app.services.analytics_rollup import analytics_rollup
+from app.services.question_stats import question_stats
+from app.services.rate_limiter import rate_limiter
+from app.services.pagination import NEXT_CURSOR_HEADER, TOTAL_COUNT_ESTIMATE_HEADER
+from app.services.workspace_registry import workspace_registry
 
 
 def run_migrations():
@@ -49,8 +57,21 @@ async def lifespan(app: FastAPI):
     run_migrations() 
     if not os.path.exists(os.path.join(os.path.dirname(__file__), "..", "alembic.ini")):
         await init_db()
+    ai_client.start_health_checks()
+    notifications.start()
+    await workspace_registry.load()
+    chat_log.start()
+    analytics_rollup.start()
+    question_stats.start()
+    rate_limiter.start()
     yield
     # Код для выполнения при завершении
+    await rate_limiter.stop()
+    await question_stats.stop()
+    await analytics_rollup.stop()
+    await chat_log.stop()
+    await notifications.stop()
+    await ai_client.stop_health_checks()
     print("Application shutdown.")
 
 
@@ -68,6 +89,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TOTAL_COUNT_ESTIMATE_HEADER],  # Пагинация списков
 )
 
 # Подключение роутера API v1
@@ -1,6 +1,6 @@
 import uuid
 from sqlalchemy import (
-    Column, String, DateTime, ForeignKey, Enum, JSON, Text, Boolean, Integer
+    Column, String, DateTime, ForeignKey, Enum, JSON, Text, Boolean, Integer, BigInteger, Float, Date, Index
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -96,6 +96,9 @@ class Workspace(Base):
 
     organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False)
 
+    # Настройки публичного виджета (см. schemas.WidgetSettings)
+    widget_settings = Column(JSON, nullable=True)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Связи
@@ -144,17 +147,28 @@ class KnowledgeSource(Base):
 
     # Путь к файлу в томе (volume) file_storage
     file_path = Column(String(1024), nullable=True)
+    file_sha256 = Column(String(64), nullable=True)
+    file_size = Column(BigInteger, nullable=True)
 
     # Связь с коннектором (если источник пришел оттуда)
     connector_id = Column(UUID(as_uuid=True), ForeignKey("connectors.id"), nullable=True)
 
+    # Кол-во чанков в ChromaDB (ID чанков: '{id}_0' ... '{id}_{chunk_count-1}').
+    # Заполняется после индексации, используется для удаления по ID.
+    chunk_count = Column(Integer, nullable=True)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Связи
     workspace = relationship("Workspace", back_populates="knowledge_sources")
     connector = relationship("Connector", back_populates="knowledge_sources")
     # Примечание: Векторы (чанки) хранятся в ChromaDB.
-    # Связь здесь логическая, по `knowledge_source_id` в метаданных Chroma.
+    # Связь здесь логическая, по ID чанков ('{id}_{i}') и `source_id` в метаданных Chroma.
+
+    __table_args__ = (
+        # Список источников воркспейса (keyset-пагинация по created_at, id)
+        Index("ix_knowledge_sources_workspace_created", "workspace_id", "created_at", "id"),
+    )
 
 
 class ChatSession(Base):
@@ -171,6 +185,11 @@ class ChatSession(Base):
     workspace = relationship("Workspace", back_populates="chat_sessions")
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Проверка "сессия принадлежит воркспейсу" и join сообщений с воркспейсом - только по индексу
+        Index("ix_chat_sessions_id_workspace", "id", "workspace_id"),
+    )
+
 
 class ChatMessage(Base):
     """
@@ -189,11 +208,20 @@ class ChatMessage(Base):
     ticket_id = Column(UUID(as_uuid=True), ForeignKey("tickets.id"), nullable=True)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Время записи в БД (журнал чата пишется пачками, позже created_at) - водяной знак аналитики
+    logged_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Связи
     session = relationship("ChatSession", back_populates="messages")
     ticket = relationship("Ticket", back_populates="chat_message")
 
+    __table_args__ = (
+        # История сессии (keyset-пагинация по created_at, id)
+        Index("ix_chat_messages_session_created", "session_id", "created_at", "id"),
+        # Окно агрегации аналитики по водяному знаку
+        Index("ix_chat_messages_logged_at", "logged_at"),
+    )
+
 
 class Ticket(Base):
     """
@@ -208,6 +236,9 @@ class Ticket(Base):
     question = Column(Text, nullable=False)
     status = Column(Enum(TicketStatusEnum), nullable=False, default=TicketStatusEnum.OPEN)
 
+    # Сколько вопросов без ответа присоединено к тикету (похожие вопросы - один тикет)
+    hit_count = Column(Integer, nullable=False, default=1, server_default="1")
+
     # Ответ от Редактора
     answer = Column(Text, nullable=True)
 
@@ -221,6 +252,16 @@ class Ticket(Base):
     workspace = relationship("Workspace", back_populates="tickets")
     chat_message = relationship("ChatMessage", back_populates="ticket", uselist=False)
 
+    __table_args__ = (
+        # Список тикетов воркспейса по статусу (keyset-пагинация по created_at, id)
+        Index("ix_tickets_workspace_status_created", "workspace_id", "status", "created_at", "id"),
+        # Открытые тикеты - основной экран редактора; частичный индекс не растет с решенными
+        Index(
+            "ix_tickets_open_workspace_created", "workspace_id", "created_at", "id",
+            postgresql_where=(status == TicketStatusEnum.OPEN)
+        ),
+    )
+
 
 class Connector(Base):
     """
@@ -262,4 +303,56 @@ class Tool(Base):
     parameters_schema = Column(JSON, nullable=False)  # JSON Schema
 
     # Связи
-    workspace = relationship("Workspace", back_populates="tools")
\ No newline at end of file
+    workspace = relationship("Workspace", back_populates="tools")
+
+class RateLimitBucket(Base):
+    """
+    Token bucket ограничителя частоты запросов (режим RATE_LIMIT_BACKEND="postgres").
+    tokens - остаток на момент updated_at; пополнение считается при обращении.
+    """
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String(255), primary_key=True)  # e.g., "ws:<uuid>", "session:<uuid>", "ip:<addr>"
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class AnalyticsHourly(Base):
+    """
+    Почасовые счетчики запросов воркспейса (rollup из chat_messages).
+    Дашборд аналитики суммирует эти строки вместо скана сообщений.
+    """
+    __tablename__ = "analytics_hourly"
+
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id", ondelete="CASCADE"), primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)  # Начало часа (по времени вопроса)
+
+    total = Column(Integer, nullable=False, default=0)
+    answered = Column(Integer, nullable=False, default=0)
+    unanswered = Column(Integer, nullable=False, default=0)
+
+
+class AnalyticsWatermark(Base):
+    """
+    Докуда обработан источник инкрементальной агрегации (например, 'chat_messages' по logged_at).
+    Строка блокируется (FOR UPDATE) на время прохода, поэтому воркеры не считают одно и то же дважды.
+    """
+    __tablename__ = "analytics_watermarks"
+
+    name = Column(String(100), primary_key=True)
+    processed_until = Column(DateTime(timezone=True), nullable=True)
+
+
+class QuestionSketch(Base):
+    """
+    Space-Saving sketch частых вопросов воркспейса за один день (см. services/question_stats.py).
+    kind: 'all' - все вопросы, 'unanswered' - вопросы без ответа.
+    """
+    __tablename__ = "question_sketches"
+
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    kind = Column(String(20), primary_key=True)
+
+    state = Column(JSON, nullable=False)  # {нормализованный вопрос: [count, error, формулировка, ticket_id]}
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
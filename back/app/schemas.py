@@ -74,14 +74,25 @@ class RefreshTokenResponse(BaseModel):
 
 # --- 2. Workspace API ---
 
+class WidgetSettings(BaseModel):
+    enabled: bool = True  # False - публичный виджет воркспейса отключен
+    greeting: Optional[str] = Field(None, example="Здравствуйте! Чем могу помочь?")
+    # Лимиты запросов в минуту (None - значения по умолчанию из настроек сервера)
+    rate_limit_per_minute: Optional[int] = Field(None, gt=0)  # На весь воркспейс
+    session_rate_limit_per_minute: Optional[int] = Field(None, gt=0)  # На одну сессию чата
+    ip_rate_limit_per_minute: Optional[int] = Field(None, gt=0)  # На один IP
+
+
 class WorkspaceCreate(BaseModel):
     name: str = Field(..., example="Бот по технике безопасности")
     description: Optional[str] = Field(None, example="Отвечает на вопросы по внутренним регламентам безопасности")
+    widget_settings: Optional[WidgetSettings] = None
 
 
 class WorkspaceUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
+    widget_settings: Optional[WidgetSettings] = None
 
 
 class WorkspacePublic(BaseModel):
@@ -89,6 +100,7 @@ class WorkspacePublic(BaseModel):
     name: str
     description: Optional[str]
     organization_id: UUID
+    widget_settings: Optional[WidgetSettings] = None
     created_at: datetime
 
     class Config:
@@ -125,6 +137,23 @@ class KnowledgeSourceCreateArticle(BaseModel):
     content: str = Field(..., example="Сотрудники могут работать из дома до 2 дней в неделю...")
 
 
+# POST /knowledge/uploads (возобновляемая загрузка)
+class UploadSessionCreate(BaseModel):
+    filename: str = Field(..., example="scan.pdf")
+    size: int = Field(..., gt=0, example=104857600)
+
+
+class UploadSessionPublic(BaseModel):
+    upload_id: UUID
+    filename: str
+    size: int
+    offset: int  # Сколько байт уже получено: следующую часть отправлять с этого смещения
+
+
+class UploadSessionComplete(BaseModel):
+    sha256: str = Field(..., min_length=64, max_length=64)
+
+
 # GET /knowledge (список)
 class KnowledgeSourcePublic(BaseModel):
     id: UUID
@@ -182,6 +211,18 @@ class QueryResponse(BaseModel):
     ticket_id: Optional[UUID] = None
 
 
+class ChatMessagePublic(BaseModel):
+    id: UUID
+    question: str
+    answer: str
+    sources: Optional[List[QueryResponseSource]] = None
+    ticket_id: Optional[UUID] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 # --- 5. Public Widget API ---
 
 class PublicQueryRequest(BaseModel):
@@ -215,6 +256,7 @@ class TicketPublic(BaseModel):
     id: UUID
     question: str
     status: TicketStatusEnum
+    hit_count: int = 1  # Сколько похожих вопросов собрал тикет
     created_at: datetime
     session_id: UUID
 
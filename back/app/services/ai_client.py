@@ -1,55 +1,335 @@
 # (НОВЫЙ ФАЙЛ)
 # Этот клиент будет общаться с 'back-ai' сервисом
+import aiofiles
 import httpx
+import msgpack
+import orjson
 from fastapi import HTTPException, status
 from uuid import UUID
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Dict
 import asyncio
+import time
 
 from app.core.config import settings
 from app.core.database import AsyncSessionFactory
+from app.services.resilience import CircuitBreaker, CircuitOpenError, RetryBudget, is_unhealthy_response
+from app.services.hash_ring import ConsistentHashRing
 from app import schemas, models  # Используем основные схемы Pydantic из 'back'
 
 
-class AIClient:
+# Формат ответов back-ai: MessagePack компактнее JSON (особенно для кириллицы в text_chunk)
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+WIRE_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept": MSGPACK_MEDIA_TYPE if settings.AI_WIRE_FORMAT == "msgpack" else "application/json"
+}
+STREAM_HEADERS = {**WIRE_HEADERS, "Content-Type": "application/octet-stream"}
+
+
+def _decode_response(response: httpx.Response) -> dict:
+    """Декодирует ответ back-ai по его Content-Type."""
+    if response.headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE):
+        return msgpack.unpackb(response.content, raw=False)
+    return orjson.loads(response.content)
+
+
+async def _iter_file(path: str):
+    """Читает файл кусками: httpx отправляет их как chunked-тело, файл целиком в память не грузится."""
+    async with aiofiles.open(path, 'rb') as f:
+        while True:
+            chunk = await f.read(settings.UPLOAD_CHUNK_SIZE_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+class AIReplica:
+    """Один экземпляр 'back-ai': свой HTTP-клиент и circuit breaker."""
+
     def __init__(self, base_url: str):
-        self.base_url = base_url
-        self.client = httpx.AsyncClient(base_url=str(base_url), timeout=300.0)
-        print(f"[AI Client] Initialized for {self.base_url}")
+        self.base_url = str(base_url)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(settings.AI_TIMEOUT_DEFAULT_SECONDS, connect=settings.AI_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=settings.AI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.AI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.AI_KEEPALIVE_EXPIRY_SECONDS
+            ),
+            http2=settings.AI_HTTP2
+        )
+        self.breaker = CircuitBreaker(
+            name=self.base_url,
+            failure_threshold=settings.AI_CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=settings.AI_CIRCUIT_RESET_SECONDS
+        )
+
+
+class AIClient:
+    def __init__(self, replica_weights: Dict[str, float]):
+        """replica_weights - экземпляры back-ai и их веса на кольце консистентного хеширования."""
+        self.base_url = next(iter(replica_weights))
+        self.replicas: Dict[str, AIReplica] = {url: AIReplica(url) for url in replica_weights}
+        self.weights = dict(replica_weights)
+        # Запросы одного воркспейса идут на один экземпляр (его кэши остаются "теплыми");
+        # следующий узел на кольце - для hedged-запросов и failover
+        self.ring = ConsistentHashRing(vnodes_per_weight=settings.AI_HASH_RING_VNODES)
+        self.ring.rebuild(self.weights)
+        self.retry_budget = RetryBudget(
+            ratio=settings.AI_RETRY_BUDGET_RATIO,
+            max_balance=settings.AI_RETRY_BUDGET_MAX
+        )
+        self._health_task: Optional[asyncio.Task] = None
+        print(f"[AI Client] Initialized for {list(self.replicas)}")
 
-    async def _post(self, endpoint: str, json_data: dict) -> dict:
-        """Вспомогательный метод для POST-запросов."""
+    def _ordered_replicas(self, routing_key: Optional[str] = None) -> List[AIReplica]:
+        """
+        Экземпляры в порядке предпочтения: по кольцу от routing_key (workspace_id),
+        затем исключенные из кольца (нездоровые); с открытым circuit breaker - в конце.
+        """
+        urls = self.ring.nodes_for(routing_key) if routing_key else list(self.ring.weights)
+        urls += [url for url in self.replicas if url not in urls]
+        replicas = [self.replicas[url] for url in urls]
+        return sorted(replicas, key=lambda r: r.breaker.state == CircuitBreaker.OPEN)
+
+    # --- Health checks ---
+
+    async def _check_replica(self, replica: AIReplica) -> float:
+        """Эффективный вес экземпляра: 0 - недоступен, половина веса - отвечает медленно."""
+        weight = self.weights[replica.base_url]
+        started = time.monotonic()
         try:
-            response = await self.client.post(endpoint, json=json_data)
+            response = await replica.client.get("/", timeout=settings.AI_HEALTH_CHECK_TIMEOUT_SECONDS)
             response.raise_for_status()
-            return response.json()
-        except httpx.ConnectError as e:
+        except Exception as e:
+            print(f"[AI Client] Health check failed for {replica.base_url}: {e!r}")
+            return 0.0
+        if time.monotonic() - started > settings.AI_HEALTH_CHECK_SLOW_SECONDS:
+            return weight / 2
+        return weight
+
+    async def check_health(self):
+        """Проверяет все экземпляры и перестраивает кольцо, если эффективные веса изменились."""
+        replicas = list(self.replicas.values())
+        weights = await asyncio.gather(*(self._check_replica(r) for r in replicas))
+        effective = {r.base_url: w for r, w in zip(replicas, weights)}
+        if not any(effective.values()):
+            effective = dict(self.weights)  # Все недоступны - оставляем исходное распределение
+        if effective != self.ring.weights:
+            print(f"[AI Client] Rebalancing ring: {effective}")
+            self.ring.rebuild(effective)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(settings.AI_HEALTH_CHECK_INTERVAL_SECONDS)
+            try:
+                await self.check_health()
+            except Exception as e:
+                print(f"[AI Client] Health check loop error: {e}")
+
+    def start_health_checks(self):
+        """Запускает периодические health checks (нужно, только если экземпляров больше одного)."""
+        if len(self.replicas) > 1 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop_health_checks(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+
+    @staticmethod
+    async def _send(replica: AIReplica, endpoint: str, json_data: dict, timeout: float) -> dict:
+        """Один POST-запрос к экземпляру с учетом его circuit breaker."""
+        return await AIClient._send_raw(
+            replica, endpoint, timeout, content=orjson.dumps(json_data), headers=WIRE_HEADERS
+        )
+
+    @staticmethod
+    async def _send_raw(replica: AIReplica, endpoint: str, timeout: float, **request_kwargs) -> dict:
+        """POST с произвольным телом (request_kwargs передаются в httpx) с учетом circuit breaker."""
+        if not replica.breaker.allow_request():
+            raise CircuitOpenError(replica.base_url)
+        # Исход записывается при любом выходе, иначе пробный запрос HALF_OPEN "зависнет" навсегда
+        healthy: Optional[bool] = None
+        try:
+            response = await replica.client.post(endpoint, timeout=timeout, **request_kwargs)
+            healthy = not is_unhealthy_response(response.status_code, "retry-after" in response.headers)
+        except httpx.TransportError:
+            healthy = False
+            raise
+        finally:
+            if healthy is True:
+                replica.breaker.record_success()
+            elif healthy is False:
+                replica.breaker.record_failure()
+            else:
+                # Отмена (проигравший hedged-запрос) или ошибка не со стороны сервиса
+                # (например, чтение файла для потока) - не считается ошибкой
+                replica.breaker.record_cancelled()
+
+        response.raise_for_status()
+        return _decode_response(response)
+
+    async def _send_hedged(
+            self, primary: AIReplica, secondary: AIReplica, endpoint: str, json_data: dict, timeout: float
+    ) -> dict:
+        """
+        Запрос к основному экземпляру; если он не ответил за AI_HEDGE_DELAY_SECONDS,
+        дублируем запрос на второй и берем первый успешный ответ.
+        """
+        primary_task = asyncio.ensure_future(self._send(primary, endpoint, json_data, timeout))
+        done, _ = await asyncio.wait({primary_task}, timeout=settings.AI_HEDGE_DELAY_SECONDS)
+        if done or not self.retry_budget.try_spend():
+            return await primary_task
+
+        print(f"[AI Client] Hedging {endpoint} to {secondary.base_url}")
+        hedge_task = asyncio.ensure_future(self._send(secondary, endpoint, json_data, timeout))
+        pending = {primary_task, hedge_task}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    def _is_retryable(e: Exception) -> bool:
+        if isinstance(e, httpx.HTTPStatusError):
+            return is_unhealthy_response(e.response.status_code, "retry-after" in e.response.headers)
+        return isinstance(e, (httpx.TransportError, CircuitOpenError))
+
+    def _to_http_exception(self, e: Exception) -> HTTPException:
+        """Преобразует ошибку вызова 'back-ai' в HTTPException для эндпоинтов 'back'."""
+        if isinstance(e, CircuitOpenError):
+            print(f"[AI Client] Circuit is open for {e}. Failing fast.")
+            return HTTPException(status_code=503, detail="AI service is unavailable (Circuit Open)")
+        if isinstance(e, httpx.TimeoutException):
+            print(f"[AI Client] Timeout calling AI service: {e!r}")
+            return HTTPException(status_code=504, detail="AI service timeout")
+        if isinstance(e, httpx.ConnectError):
             print(f"[AI Client] CRITICAL: Cannot connect to AI service at {self.base_url}: {e}")
-            raise HTTPException(status_code=503, detail="AI service is unavailable (Connection Error)")
-        except httpx.HTTPStatusError as e:
+            return HTTPException(status_code=503, detail="AI service is unavailable (Connection Error)")
+        if isinstance(e, httpx.HTTPStatusError) and "retry-after" in e.response.headers:
+            # back-ai перегружен (нет свободного слота LLM): клиенту - повторить позже, тикет не заводится
+            print(f"[AI Client] AI service is overloaded: {e.response.status_code}")
+            return HTTPException(
+                status_code=503,
+                detail="AI service is overloaded, please retry later",
+                headers={"Retry-After": e.response.headers["retry-after"]}
+            )
+        if isinstance(e, httpx.HTTPStatusError):
             print(f"[AI Client] Error from AI service: {e.response.status_code} - {e.response.text}")
-            raise HTTPException(status_code=e.response.status_code,
-                                detail=f"AI Service Error: {e.response.json().get('detail', 'Unknown')}")
+            try:
+                detail = e.response.json().get('detail', 'Unknown')
+            except ValueError:
+                detail = 'Unknown'
+            return HTTPException(status_code=e.response.status_code, detail=f"AI Service Error: {detail}")
+        print(f"[AI Client] Unknown error: {e}")
+        return HTTPException(status_code=500, detail=f"Unknown AI client error: {e}")
+
+    async def _post(
+            self,
+            endpoint: str,
+            json_data: dict,
+            timeout: Optional[float] = None,
+            hedge: bool = False,
+            max_retries: int = 0,
+            routing_key: Optional[str] = None
+    ) -> dict:
+        """
+        Вспомогательный метод для POST-запросов.
+        timeout - таймаут операции; hedge - дублировать медленный запрос на второй экземпляр;
+        max_retries - повторы при сетевых ошибках / 502-504 (в пределах бюджета повторов);
+        routing_key - ключ выбора экземпляра на кольце (workspace_id).
+        """
+        timeout = timeout or settings.AI_TIMEOUT_DEFAULT_SECONDS
+        self.retry_budget.record_request()
+        replicas = self._ordered_replicas(routing_key)
+        attempt = 0
+        while True:
+            primary = replicas[attempt % len(replicas)]
+            try:
+                if hedge and len(replicas) > 1:
+                    secondary = replicas[(attempt + 1) % len(replicas)]
+                    return await self._send_hedged(primary, secondary, endpoint, json_data, timeout)
+                return await self._send(primary, endpoint, json_data, timeout)
+            except Exception as e:
+                if not self._is_retryable(e) or attempt >= max_retries or not self.retry_budget.try_spend():
+                    raise self._to_http_exception(e)
+                attempt += 1
+                print(f"[AI Client] Retrying {endpoint} (attempt {attempt}) after error: {e!r}")
+
+    async def _post_file(
+            self, endpoint: str, params: dict, file_path: str, timeout: float, routing_key: Optional[str] = None
+    ) -> dict:
+        """
+        POST с содержимым файла в теле (потоково). Без повторов и hedge:
+        поток нельзя переотправить, а обработку файла и так не повторяем.
+        """
+        self.retry_budget.record_request()
+        replica = self._ordered_replicas(routing_key)[0]
+        try:
+            return await self._send_raw(
+                replica, endpoint, timeout, content=_iter_file(file_path), params=params, headers=STREAM_HEADERS
+            )
         except Exception as e:
-            print(f"[AI Client] Unknown error: {e}")
-            raise HTTPException(status_code=500, detail=f"Unknown AI client error: {e}")
+            raise self._to_http_exception(e)
 
     # --- Методы для BackgroundTasks ---
 
     async def process_file(
-            self, workspace_id: UUID, source_id: UUID, file_path: str, filename: str
+            self,
+            workspace_id: UUID,
+            source_id: UUID,
+            file_path: str,
+            filename: str,
+            content_sha256: Optional[str] = None,
+            reuse_from: Optional[dict] = None
     ):
-        """Вызывает /process-file в back-ai."""
+        """
+        Вызывает /process-file в back-ai (или /process-file-stream при AI_FILE_TRANSFER_MODE="stream").
+        reuse_from - уже обработанный источник с тем же содержимым
+        ({collection_name, source_id, chunk_count}): back-ai скопирует его эмбеддинги.
+        """
         print(f"[AI Client Task] Processing file {filename} (Source ID: {source_id})")
+        stream = settings.AI_FILE_TRANSFER_MODE == "stream"
         payload = {
             "workspace_id": str(workspace_id),
             "source_id": str(source_id),
-            "file_path": file_path,
-            "filename": filename
+            "file_path": None if stream else file_path,
+            "filename": filename,
+            "content_sha256": content_sha256,
+            "reuse_from": reuse_from
         }
         try:
-            await self._post(f"{settings.API_V1_STR_AI}/process-file", json_data=payload)
-            await self._update_source_status(source_id, models.KnowledgeSourceStatusEnum.COMPLETED)
+            result = None
+            if not stream or reuse_from:
+                try:
+                    result = await self._post(
+                        f"{settings.API_V1_STR_AI}/process-file", json_data=payload,
+                        timeout=settings.AI_TIMEOUT_PROCESSING_SECONDS, routing_key=str(workspace_id)
+                    )
+                except HTTPException as e:
+                    # 409 - эмбеддинги не скопировались, back-ai нужно само содержимое файла
+                    if not stream or e.status_code != status.HTTP_409_CONFLICT:
+                        raise
+            if result is None:
+                params = {"workspace_id": str(workspace_id), "source_id": str(source_id), "filename": filename}
+                if content_sha256:
+                    params["content_sha256"] = content_sha256
+                result = await self._post_file(
+                    f"{settings.API_V1_STR_AI}/process-file-stream", params=params, file_path=file_path,
+                    timeout=settings.AI_TIMEOUT_PROCESSING_SECONDS, routing_key=str(workspace_id)
+                )
+            await self._update_source_status(
+                source_id, models.KnowledgeSourceStatusEnum.COMPLETED, chunk_count=result.get("chunk_count")
+            )
         except Exception as e:
             print(f"[AI Client Task] FAILED processing file {source_id}: {e}")
             await self._update_source_status(source_id, models.KnowledgeSourceStatusEnum.FAILED)
@@ -65,8 +345,13 @@ class AIClient:
             "qa_in": qa_in.model_dump()
         }
         try:
-            await self._post(f"{settings.API_V1_STR_AI}/process-qa", json_data=payload)
-            await self._update_source_status(source_id, models.KnowledgeSourceStatusEnum.COMPLETED)
+            result = await self._post(
+                f"{settings.API_V1_STR_AI}/process-qa", json_data=payload,
+                timeout=settings.AI_TIMEOUT_PROCESSING_SECONDS, routing_key=str(workspace_id)
+            )
+            await self._update_source_status(
+                source_id, models.KnowledgeSourceStatusEnum.COMPLETED, chunk_count=result.get("chunk_count")
+            )
         except Exception as e:
             print(f"[AI Client Task] FAILED processing Q&A {source_id}: {e}")
             await self._update_source_status(source_id, models.KnowledgeSourceStatusEnum.FAILED)
@@ -82,32 +367,56 @@ class AIClient:
             "article_in": article_in.model_dump()
         }
         try:
-            await self._post(f"{settings.API_V1_STR_AI}/process-article", json_data=payload)
-            await self._update_source_status(source_id, models.KnowledgeSourceStatusEnum.COMPLETED)
+            result = await self._post(
+                f"{settings.API_V1_STR_AI}/process-article", json_data=payload,
+                timeout=settings.AI_TIMEOUT_PROCESSING_SECONDS, routing_key=str(workspace_id)
+            )
+            await self._update_source_status(
+                source_id, models.KnowledgeSourceStatusEnum.COMPLETED, chunk_count=result.get("chunk_count")
+            )
         except Exception as e:
             print(f"[AI Client Task] FAILED processing Article {source_id}: {e}")
             await self._update_source_status(source_id, models.KnowledgeSourceStatusEnum.FAILED)
 
-    async def delete_embeddings(self, collection_name: str, source_id: UUID):
+    async def delete_embeddings(self, collection_name: str, source_id: UUID, chunk_count: Optional[int] = None):
         """Вызывает /delete-embeddings в back-ai."""
         print(f"[AI Client Task] Deleting embeddings (Source ID: {source_id})")
         payload = {
             "collection_name": collection_name,
-            "source_id": str(source_id)
+            "source_id": str(source_id),
+            "chunk_count": chunk_count
         }
         try:
-            await self._post(f"{settings.API_V1_STR_AI}/delete-embeddings", json_data=payload)
+            await self._post(
+                f"{settings.API_V1_STR_AI}/delete-embeddings", json_data=payload,
+                timeout=settings.AI_TIMEOUT_PROCESSING_SECONDS, routing_key=collection_name
+            )
         except Exception as e:
             print(f"[AI Client Task] FAILED deleting embeddings {source_id}: {e}")
 
-    async def _update_source_status(self, source_id: UUID, status: models.KnowledgeSourceStatusEnum):
-        """Вспомогательная функция для обновления статуса в БД (в 'back')."""
+    async def remove_tickets(self, workspace_id: UUID, ticket_ids: List[UUID]):
+        """(Фоном) Вызывает /tickets/remove в back-ai: решенные тикеты больше не собирают вопросы."""
+        payload = {"workspace_id": str(workspace_id), "ticket_ids": [str(ticket_id) for ticket_id in ticket_ids]}
+        try:
+            await self._post(
+                f"{settings.API_V1_STR_AI}/tickets/remove", json_data=payload, routing_key=str(workspace_id)
+            )
+        except Exception as e:
+            print(f"[AI Client Task] FAILED removing tickets {ticket_ids}: {e}")
+
+    async def _update_source_status(
+            self, source_id: UUID, status: models.KnowledgeSourceStatusEnum, chunk_count: Optional[int] = None
+    ):
+        """Вспомогательная функция для обновления статуса (и кол-ва чанков) в БД (в 'back')."""
+        values = {"status": status}
+        if chunk_count is not None:
+            values["chunk_count"] = chunk_count
         async with AsyncSessionFactory() as db:
             try:
                 await db.execute(
                     models.KnowledgeSource.__table__.update()
                     .where(models.KnowledgeSource.id == source_id)
-                    .values(status=status)
+                    .values(**values)
                 )
                 await db.commit()
                 print(f"[AI Client Task] Updated source {source_id} status to {status}")
@@ -116,6 +425,18 @@ class AIClient:
 
     # --- Методы для Эндпоинтов ---
 
+    async def assign_ticket(self, workspace_id: UUID, ticket_id: UUID, question: str) -> UUID:
+        """
+        Вызывает /tickets/assign в back-ai: ID открытого тикета с похожим вопросом
+        или ticket_id (тогда вопрос проиндексирован как новый тикет).
+        """
+        result = await self._post(
+            f"{settings.API_V1_STR_AI}/tickets/assign",
+            json_data={"workspace_id": str(workspace_id), "ticket_id": str(ticket_id), "question": question},
+            routing_key=str(workspace_id)
+        )
+        return UUID(str(result["ticket_id"]))
+
     async def answer_query(
             self, workspace_id: UUID, question: str, session_id: UUID
     ) -> Tuple[str, List[schemas.QueryResponseSource]]:
@@ -126,7 +447,14 @@ class AIClient:
             "question": question,
             "session_id": str(session_id)
         }
-        response_json = await self._post(f"{settings.API_V1_STR_AI}/query", json_data=payload)
+        response_json = await self._post(
+            f"{settings.API_V1_STR_AI}/query",
+            json_data=payload,
+            timeout=settings.AI_TIMEOUT_QUERY_SECONDS,
+            hedge=True,
+            max_retries=settings.AI_QUERY_MAX_RETRIES,
+            routing_key=str(workspace_id)
+        )
 
         answer = response_json.get("answer", "Ошибка: AI-сервис вернул пустой ответ.")
         sources_data = response_json.get("sources", [])
@@ -136,4 +464,14 @@ class AIClient:
 
 
 # --- Единый экземпляр AIClient ---
-ai_client = AIClient(base_url=settings.AI_SERVICE_URL)
\ No newline at end of file
+def _replica_weights() -> Dict[str, float]:
+    """Экземпляры back-ai из настроек: AI_SERVICE_REPLICAS или AI_SERVICE_URL (+ AI_SERVICE_HEDGE_URL)."""
+    if settings.AI_SERVICE_REPLICAS:
+        return {url.rstrip("/"): weight for url, weight in settings.AI_SERVICE_REPLICAS.items()}
+    weights = {str(settings.AI_SERVICE_URL).rstrip("/"): 1.0}
+    if settings.AI_SERVICE_HEDGE_URL:
+        weights[str(settings.AI_SERVICE_HEDGE_URL).rstrip("/")] = 1.0
+    return weights
+
+
+ai_client = AIClient(replica_weights=_replica_weights())
\ No newline at end of file
@@ -0,0 +1,100 @@
+# In-process кэш пользователей и членств в воркспейсах для dependencies авторизации.
+# Без него каждый запрос делает два SELECT (users, workspace_memberships) до начала работы.
+# Изменения членств инвалидируются явно (и в других воркерах - через notifications),
+# TTL ограничивает срок жизни записи на случай пропущенного события.
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.notifications import notifications
+from app import models
+
+TOPIC = "auth_cache"
+
+
+class _TTLCache:
+    """LRU с ограничением числа записей и временем жизни записи."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() > expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def pop_where(self, predicate):
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+
+class AuthCache:
+    """
+    users: user_id -> User; memberships: (workspace_id, user_id) -> WorkspaceMembership (с .workspace).
+    Хранятся отсоединенные от сессии объекты, их нельзя изменять или добавлять в сессию.
+    Кэшируются только найденные записи: отказ в доступе всегда перепроверяется в БД.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.users = _TTLCache(ttl_seconds, max_entries)
+        self.memberships = _TTLCache(ttl_seconds, max_entries)
+        notifications.subscribe(TOPIC, self._apply_event, on_reset=self.clear)
+
+    def get_user(self, user_id: UUID) -> Optional[models.User]:
+        return self.users.get(user_id)
+
+    def put_user(self, user: models.User):
+        self.users.put(user.id, user)
+
+    def get_membership(self, workspace_id: UUID, user_id: UUID) -> Optional[models.WorkspaceMembership]:
+        return self.memberships.get((workspace_id, user_id))
+
+    def put_membership(self, membership: models.WorkspaceMembership):
+        self.memberships.put((membership.workspace_id, membership.user_id), membership)
+
+    async def invalidate_membership(self, db: AsyncSession, workspace_id: UUID, user_id: UUID):
+        """Вызывать до db.commit(): событие уходит другим воркерам вместе с транзакцией."""
+        await notifications.publish(db, TOPIC, {"workspace_id": str(workspace_id), "user_id": str(user_id)})
+
+    async def invalidate_workspace(self, db: AsyncSession, workspace_id: UUID):
+        """Сбрасывает все членства воркспейса. Вызывать до db.commit()."""
+        await notifications.publish(db, TOPIC, {"workspace_id": str(workspace_id)})
+
+    def _apply_event(self, data: dict):
+        workspace_id = UUID(data["workspace_id"])
+        if data.get("user_id"):
+            self.memberships.pop((workspace_id, UUID(data["user_id"])))
+        else:
+            self.memberships.pop_where(lambda key: key[0] == workspace_id)
+
+    def clear(self):
+        self.users.clear()
+        self.memberships.clear()
+
+
+# --- Единый экземпляр AuthCache ---
+auth_cache = AuthCache(ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS, max_entries=settings.AUTH_CACHE_MAX_ENTRIES)
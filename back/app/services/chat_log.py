@@ -0,0 +1,177 @@
+# Журнал чата с отложенной записью (write-behind).
+# Запрос пользователя только кладет сессию и сообщение в буфер, фоновая задача
+# раз в CHAT_LOG_FLUSH_INTERVAL_MS пишет буфер пачкой: один multi-row
+# INSERT ... ON CONFLICT DO NOTHING для сессий и один для сообщений.
+# Тикеты сюда не относятся: они создаются синхронно (см. query.py).
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionFactory
+from app import models
+
+
+class ChatLogWriter:
+    """
+    Буфер записей журнала чата. record() не обращается к БД.
+    При ошибке записи пачка возвращается в буфер (не больше max_buffer сообщений,
+    самые старые отбрасываются). Строка, которую БД не принимает, отбрасывается одна:
+    пачка с ошибкой делится пополам, пока ошибка не сведется к отдельным строкам.
+    При остановке буфер дописывается.
+    """
+
+    def __init__(self, flush_interval_ms: int, max_batch: int, max_buffer: int):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_buffer = max_buffer
+        self._sessions: Dict[UUID, UUID] = {}  # session_id -> workspace_id
+        self._messages: List[dict] = []
+        self._workspace_by_message: Dict[UUID, UUID] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+            self,
+            workspace_id: UUID,
+            session_id: UUID,
+            question: str,
+            answer: str,
+            sources: list,
+            ticket_id: Optional[UUID] = None
+    ):
+        """Ставит сообщение (и его сессию) в очередь на запись."""
+        self._sessions.setdefault(session_id, workspace_id)
+        message_id = uuid.uuid4()
+        self._messages.append({
+            "id": message_id,
+            "session_id": session_id,
+            # NUL Postgres не принимает в text - такая строка сорвала бы запись всей пачки
+            "question": question.replace("\x00", ""),
+            "answer": answer.replace("\x00", ""),
+            "sources": sources,
+            "ticket_id": ticket_id,
+            "created_at": datetime.now(timezone.utc)  # Время вопроса, а не записи пачки
+        })
+        self._workspace_by_message[message_id] = workspace_id
+        if len(self._messages) >= self.max_batch:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Записывает накопленный буфер в БД."""
+        async with self._flush_lock:
+            if not self._messages and not self._sessions:
+                return
+            sessions, self._sessions = self._sessions, {}
+            messages, self._messages = self._messages, []
+            workspace_by_message, self._workspace_by_message = self._workspace_by_message, {}
+
+            started = time.monotonic()
+            try:
+                async with AsyncSessionFactory() as db:
+                    # БД недоступна - ошибка здесь, до записи (буфер целиком вернется в очередь)
+                    await db.connection()
+                    # 1. Сессии (существующие пропускаются)
+                    session_rows = [{"id": sid, "workspace_id": wid} for sid, wid in sessions.items()]
+                    for i in range(0, len(session_rows), self.max_batch):
+                        await self._insert_rows(db, models.ChatSession, session_rows[i:i + self.max_batch])
+                    # 2. Сообщение пишем только в сессию своего воркспейса
+                    #    (session_id приходит от клиента и может принадлежать чужому воркспейсу)
+                    owners = {}
+                    session_ids = list(sessions)
+                    for i in range(0, len(session_ids), self.max_batch):
+                        result = await db.execute(
+                            select(models.ChatSession.id, models.ChatSession.workspace_id)
+                            .where(models.ChatSession.id.in_(session_ids[i:i + self.max_batch]))
+                        )
+                        owners.update(result.all())
+                    rows = [m for m in messages if owners.get(m["session_id"]) == workspace_by_message[m["id"]]]
+                    if len(rows) != len(messages):
+                        print(f"[Chat Log] Skipped {len(messages) - len(rows)} message(s) for foreign sessions")
+                    # 3. Сообщения (пачками по max_batch: после сбоя БД буфер может быть большим,
+                    #    а у одного запроса ограничено число параметров)
+                    dropped = 0
+                    for i in range(0, len(rows), self.max_batch):
+                        dropped += await self._insert_rows(db, models.ChatMessage, rows[i:i + self.max_batch])
+                    await db.commit()
+                print(f"[Chat Log] Flushed {len(rows) - dropped} message(s) in {(time.monotonic() - started) * 1000:.0f}ms")
+            except asyncio.CancelledError:
+                self._requeue(sessions, messages, workspace_by_message)  # Допишется в stop()
+                raise
+            except Exception as e:
+                print(f"[Chat Log] Flush failed, will retry: {e}")
+                self._requeue(sessions, messages, workspace_by_message)
+
+    async def _insert_rows(self, db, model, rows: List[dict]) -> int:
+        """
+        Пишет rows (в savepoint). Если БД отвергла пачку - делит ее пополам и пишет части отдельно,
+        строку, которая не записывается и одна, отбрасывает. Возвращает число отброшенных строк.
+        Ошибки соединения пробрасываются: тогда весь буфер вернется в очередь.
+        """
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(model).values(rows).on_conflict_do_nothing(index_elements=["id"]))
+            return 0
+        except DBAPIError as e:
+            if e.connection_invalidated:
+                raise
+            if len(rows) == 1:
+                print(f"[Chat Log] Dropping {model.__tablename__} row {rows[0]['id']} rejected by the database: {e.orig}")
+                return 1
+        middle = len(rows) // 2
+        return await self._insert_rows(db, model, rows[:middle]) + await self._insert_rows(db, model, rows[middle:])
+
+    def _requeue(self, sessions: Dict[UUID, UUID], messages: List[dict], workspace_by_message: Dict[UUID, UUID]):
+        for session_id, workspace_id in sessions.items():
+            self._sessions.setdefault(session_id, workspace_id)
+        self._messages = messages + self._messages
+        self._workspace_by_message.update(workspace_by_message)
+        overflow = len(self._messages) - self.max_buffer
+        if overflow > 0:
+            print(f"[Chat Log] Buffer is full, dropping {overflow} oldest message(s)")
+            for message in self._messages[:overflow]:
+                self._workspace_by_message.pop(message["id"], None)
+            self._messages = self._messages[overflow:]
+        # Сессии нужны только еще не записанным сообщениям
+        pending = {message["session_id"] for message in self._messages}
+        self._sessions = {sid: wid for sid, wid in self._sessions.items() if sid in pending}
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает фоновую запись и дописывает остаток буфера."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# --- Единый экземпляр ChatLogWriter ---
+chat_log = ChatLogWriter(
+    flush_interval_ms=settings.CHAT_LOG_FLUSH_INTERVAL_MS,
+    max_batch=settings.CHAT_LOG_MAX_BATCH,
+    max_buffer=settings.CHAT_LOG_MAX_BUFFER
+)
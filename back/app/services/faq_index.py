@@ -0,0 +1,182 @@
+# Индекс Q&A-источников для быстрого ответа на точные совпадения вопроса.
+# Вопрос из виджета часто дословно совпадает с вопросом из Q&A,
+# в этом случае отвечаем сразу, без эмбеддинга и вызова 'back-ai'.
+import asyncio
+import hashlib
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.database import AsyncSessionFactory
+from app.core.notifications import notifications
+from app.core.text_utils import normalize_question
+from app import schemas, models
+
+TOPIC = "faq_index"
+
+
+class FAQEntry(NamedTuple):
+    source_id: UUID
+    question: str
+    answer: str
+
+    def as_source(self) -> schemas.QueryResponseSource:
+        """Источник в том же формате, что и Q&A-чанк из 'back-ai'."""
+        return schemas.QueryResponseSource(
+            name=f"Q&A: {self.question[:50]}...",
+            page=None,
+            text_chunk=f"Вопрос: {self.question}\nОтвет: {self.answer}"
+        )
+
+
+class FAQIndex:
+    """
+    In-memory индекс: workspace_id -> {sha256(нормализованный вопрос) -> FAQEntry}.
+    Воркспейс загружается из БД при первом обращении, дальше изменения приходят событиями:
+    publish_* вызывается в транзакции изменения, и после коммита каждый воркер
+    перечитывает измененный источник (через notifications). После переподключения
+    notifications индекс сбрасывается и загружается заново при следующем обращении.
+    """
+
+    def __init__(self):
+        self._entries: Dict[UUID, Dict[str, FAQEntry]] = {}
+        self._keys_by_source: Dict[UUID, Tuple[UUID, str]] = {}
+        self._loaded: Set[UUID] = set()
+        # Счетчики событий: загрузка, во время которой пришло событие, повторяется
+        self._generation = 0
+        self._versions: Dict[UUID, int] = {}
+        self._locks: Dict[UUID, asyncio.Lock] = {}
+        notifications.subscribe(TOPIC, self._apply_event, on_reset=self._reset)
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+    async def lookup(self, workspace_id: UUID, question: str) -> Optional[FAQEntry]:
+        """Ищет Q&A с точно таким же (после нормализации) вопросом."""
+        if workspace_id not in self._loaded:
+            await self._load_workspace(workspace_id)
+        return self._entries.get(workspace_id, {}).get(self._key(question))
+
+    # --- События (вызывать до db.commit(): уходят другим воркерам вместе с транзакцией) ---
+    # В событии только id: ответ Q&A может не поместиться в payload NOTIFY (8000 байт).
+
+    async def publish_upsert(self, db: AsyncSession, workspace_id: UUID, source_id: UUID, question: str, answer: str):
+        """Q&A-источник добавлен или изменен. В этом воркере применяется сразу."""
+        await self._publish(db, "upsert", workspace_id, source_id)
+        if workspace_id in self._loaded:
+            self._upsert(workspace_id, source_id, question, answer)
+
+    async def publish_remove(self, db: AsyncSession, workspace_id: UUID, source_id: UUID):
+        """Q&A-источник удален."""
+        await self._publish(db, "remove", workspace_id, source_id)
+        self._remove(source_id)
+
+    async def publish_drop_workspace(self, db: AsyncSession, workspace_id: UUID):
+        """Воркспейс удален."""
+        await self._publish(db, "drop_workspace", workspace_id)
+        self._drop_workspace(workspace_id)
+
+    async def _publish(self, db: AsyncSession, op: str, workspace_id: UUID, source_id: Optional[UUID] = None):
+        self._versions[workspace_id] = self._versions.get(workspace_id, 0) + 1
+        await notifications.publish(
+            db, TOPIC, {"op": op, "workspace_id": str(workspace_id), "source_id": str(source_id)},
+            dispatch_locally=False  # Данные еще не закоммичены: свой воркер применяет их напрямую
+        )
+
+    def _apply_event(self, data: dict):
+        workspace_id = UUID(data["workspace_id"])
+        self._versions[workspace_id] = self._versions.get(workspace_id, 0) + 1
+        if data["op"] == "drop_workspace":
+            self._drop_workspace(workspace_id)
+        elif data["op"] == "remove":
+            self._remove(UUID(data["source_id"]))
+        elif workspace_id in self._loaded:
+            asyncio.get_running_loop().create_task(self._refresh_source(workspace_id, UUID(data["source_id"])))
+
+    def _reset(self):
+        """Пока notifications были недоступны, события могли потеряться - загружаем все заново."""
+        self._generation += 1
+        self._entries.clear()
+        self._keys_by_source.clear()
+        self._loaded.clear()
+
+    # --- Изменение индекса ---
+
+    def _upsert(self, workspace_id: UUID, source_id: UUID, question: str, answer: str):
+        self._remove(source_id)
+        key = self._key(question)
+        self._entries.setdefault(workspace_id, {})[key] = FAQEntry(source_id, question, answer)
+        self._keys_by_source[source_id] = (workspace_id, key)
+
+    def _remove(self, source_id: UUID):
+        location = self._keys_by_source.pop(source_id, None)
+        if location is None:
+            return
+        workspace_id, key = location
+        entries = self._entries.get(workspace_id, {})
+        if key in entries and entries[key].source_id == source_id:
+            del entries[key]
+
+    def _drop_workspace(self, workspace_id: UUID):
+        for entry in self._entries.pop(workspace_id, {}).values():
+            self._keys_by_source.pop(entry.source_id, None)
+        self._loaded.discard(workspace_id)
+
+    # --- Чтение из БД ---
+
+    async def _refresh_source(self, workspace_id: UUID, source_id: UUID):
+        """Перечитывает один источник после события от другого воркера."""
+        try:
+            async with AsyncSessionFactory() as db:
+                result = await db.execute(
+                    select(models.KnowledgeSource.content)
+                    .where(
+                        models.KnowledgeSource.id == source_id,
+                        models.KnowledgeSource.workspace_id == workspace_id,
+                        models.KnowledgeSource.type == models.KnowledgeSourceTypeEnum.QNA
+                    )
+                )
+                content = result.scalar_one_or_none()
+        except Exception as e:
+            print(f"[FAQ Index] Failed to refresh source {source_id}, reloading workspace later: {e}")
+            self._drop_workspace(workspace_id)
+            return
+        if workspace_id not in self._loaded:
+            return
+        if content and content.get("question") and content.get("answer") is not None:
+            self._upsert(workspace_id, source_id, content["question"], content["answer"])
+        else:
+            self._remove(source_id)
+
+    async def _load_workspace(self, workspace_id: UUID):
+        """Загружает Q&A-источники воркспейса из БД."""
+        lock = self._locks.setdefault(workspace_id, asyncio.Lock())
+        async with lock:
+            while workspace_id not in self._loaded:
+                version = (self._generation, self._versions.get(workspace_id, 0))
+                async with AsyncSessionFactory() as db:
+                    result = await db.execute(
+                        select(models.KnowledgeSource.id, models.KnowledgeSource.content)
+                        .where(
+                            models.KnowledgeSource.workspace_id == workspace_id,
+                            models.KnowledgeSource.type == models.KnowledgeSourceTypeEnum.QNA
+                        )
+                    )
+                    rows = result.all()
+                if version != (self._generation, self._versions.get(workspace_id, 0)):
+                    continue  # Во время чтения пришло событие - читаем заново
+
+                self._drop_workspace(workspace_id)
+                self._entries[workspace_id] = {}
+                for source_id, content in rows:
+                    if content and content.get("question") and content.get("answer") is not None:
+                        self._upsert(workspace_id, source_id, content["question"], content["answer"])
+                self._loaded.add(workspace_id)
+                print(f"[FAQ Index] Loaded {len(self._entries[workspace_id])} Q&A for workspace {workspace_id}")
+
+
+# --- Единый экземпляр FAQIndex ---
+faq_index = FAQIndex()
@@ -0,0 +1,208 @@
+# Хранение загруженных файлов в томе file_storage.
+# Файлы хранятся по содержимому (content-addressed): blobs/<sha256[:2]>/<sha256>.
+# Один и тот же файл, загруженный в несколько воркспейсов, хранится один раз;
+# ссылки на blob - это KnowledgeSource.file_path, blob удаляется вместе с последней ссылкой.
+# Загрузка пишется потоково, прямо из тела запроса: sha256 и размер считаются на лету,
+# лимит размера проверяется по мере чтения, запись - во временный файл с последующим rename.
+import asyncio
+import hashlib
+import os
+import uuid
+from typing import NamedTuple, Optional, Tuple
+
+import aiofiles
+from fastapi import Request
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+    from python_multipart.exceptions import MultipartParseError
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+    from multipart.exceptions import MultipartParseError
+
+from app.core.config import settings
+from app.core.database import AsyncSessionFactory
+from app import models
+
+FILE_STORAGE_PATH = settings.FILE_STORAGE_PATH
+BLOBS_PATH = os.path.join(FILE_STORAGE_PATH, "blobs")
+TMP_PATH = os.path.join(FILE_STORAGE_PATH, "tmp")  # Тот же том, что и blobs: rename атомарен
+os.makedirs(BLOBS_PATH, exist_ok=True)
+os.makedirs(TMP_PATH, exist_ok=True)
+
+
+class UploadTooLargeError(Exception):
+    """Файл превышает MAX_UPLOAD_SIZE_BYTES."""
+
+
+class StoredFile(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(BLOBS_PATH, sha256[:2], sha256)
+
+
+class UploadFormError(Exception):
+    """Тело запроса - не multipart/form-data с файлом."""
+
+
+# Запас на заголовки частей и границы multipart сверх самого файла
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+async def stream_multipart_upload_to_temp(
+        request: Request, field_name: str = "file", max_size: int = settings.MAX_UPLOAD_SIZE_BYTES
+) -> Tuple[str, StoredFile]:
+    """
+    Потоково сохраняет файл из multipart/form-data тела запроса во временный файл.
+    Тело разбирается по мере получения (без промежуточного спула Starlette):
+    файл пишется на диск один раз, лимит размера проверяется по мере прихода байт,
+    а заведомо слишком большой Content-Length отклоняется до чтения тела.
+    Память на загрузку постоянна. Возвращает (имя файла, временный файл).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadFormError("Expected multipart/form-data")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD_BYTES:
+        raise UploadTooLargeError(f"File exceeds the maximum size of {max_size} bytes")
+
+    # Парсер вызывает callbacks синхронно - копим события и обрабатываем их после каждого куска
+    events = []
+    header = {"field": b"", "value": b""}
+    headers = {}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        headers[header["field"].lower()] = header["value"]
+        header["field"] = header["value"] = b""
+
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+        headers.clear()
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    tmp_path = os.path.join(TMP_PATH, f"{uuid.uuid4()}.part")
+    digest = hashlib.sha256()
+    size = 0
+    filename = None
+    out_file = None
+    stored = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "headers":
+                    _, disposition = parse_options_header(value.get(b"content-disposition", b""))
+                    if stored is None and disposition.get(b"name") == field_name.encode() \
+                            and b"filename" in disposition:
+                        filename = disposition[b"filename"].decode("utf-8", errors="replace")
+                        out_file = await aiofiles.open(tmp_path, 'wb')
+                elif kind == "data" and out_file is not None:
+                    size += len(value)
+                    if size > max_size:
+                        raise UploadTooLargeError(f"File exceeds the maximum size of {max_size} bytes")
+                    digest.update(value)
+                    await out_file.write(value)
+                elif kind == "end" and out_file is not None:
+                    await out_file.close()
+                    out_file = None
+                    stored = StoredFile(path=tmp_path, sha256=digest.hexdigest(), size=size)
+            events.clear()
+        parser.finalize()
+        if stored is None:
+            raise UploadFormError(f"Missing file field '{field_name}'")
+    except MultipartParseError as e:
+        if out_file is not None:
+            await out_file.close()
+        _remove_quietly(tmp_path)
+        raise UploadFormError(f"Malformed multipart body: {e}")
+    except BaseException:
+        if out_file is not None:
+            await out_file.close()
+        _remove_quietly(tmp_path)
+        raise
+    return filename, stored
+
+
+async def lock_blob(db: AsyncSession, sha256: str):
+    """
+    Advisory-блокировка blob'а до конца транзакции db.
+    Сериализует "добавить ссылку" и "удалить последнюю ссылку" для одного содержимого.
+    """
+    await db.execute(select(func.pg_advisory_xact_lock(int(sha256[:15], 16))))
+
+
+def _move_to_blob(tmp_path: str, path: str) -> bool:
+    """Переносит файл в blob path (или удаляет, если blob уже есть). True - blob уже был."""
+    if os.path.exists(path):
+        _remove_quietly(tmp_path)
+        return True
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+    return False
+
+
+async def commit_blob(tmp_file: StoredFile) -> Tuple[StoredFile, bool]:
+    """
+    Переносит временный файл в хранилище blob'ов.
+    Возвращает (blob, existed): existed=True, если такое содержимое уже хранилось
+    (тогда временный файл просто удаляется). Вызывать под lock_blob: файловые операции -
+    в пуле потоков, чтобы медленный общий том не останавливал воркер, пока блокировка взята.
+    """
+    path = blob_path(tmp_file.sha256)
+    existed = await asyncio.to_thread(_move_to_blob, tmp_file.path, path)
+    return tmp_file._replace(path=path), existed
+
+
+async def release_blob(path: str, sha256: Optional[str]):
+    """
+    (Фоном) Удаляет файл, если на него больше не ссылается ни один KnowledgeSource.
+    Вызывать после коммита удаления источника.
+    """
+    async with AsyncSessionFactory() as db:
+        try:
+            if sha256:
+                await lock_blob(db, sha256)
+            result = await db.execute(
+                select(func.count()).select_from(models.KnowledgeSource)
+                .where(models.KnowledgeSource.file_path == path)
+            )
+            references = result.scalar_one()
+            if references == 0:
+                await asyncio.to_thread(os.remove, path)
+                print(f"[Storage] Deleted file: {path}")
+            else:
+                print(f"[Storage] File {path} is still referenced by {references} source(s)")
+            await db.commit()
+        except OSError as e:
+            print(f"[Storage] Error deleting file {path}: {e}")
+        except Exception as e:
+            print(f"[Storage] Error releasing file {path}: {e}")
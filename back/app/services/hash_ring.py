@@ -0,0 +1,48 @@
+# Консистентное хеширование для маршрутизации запросов по workspace_id
+# между несколькими экземплярами 'back-ai'.
+import bisect
+import hashlib
+from typing import Dict, List, Tuple
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class ConsistentHashRing:
+    """
+    Кольцо с виртуальными узлами: у узла с весом W - round(W * vnodes_per_weight) точек на кольце.
+    При удалении узла (вес 0) его ключи переходят к следующему узлу на кольце,
+    остальные ключи остаются на своих узлах.
+    """
+
+    def __init__(self, vnodes_per_weight: int):
+        self.vnodes_per_weight = vnodes_per_weight
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.weights: Dict[str, float] = {}
+
+    def rebuild(self, weights: Dict[str, float]):
+        """Перестраивает кольцо под новые веса узлов (узлы с весом <= 0 исключаются)."""
+        ring: List[Tuple[int, str]] = []
+        for node, weight in weights.items():
+            vnodes = round(weight * self.vnodes_per_weight)
+            if weight > 0:
+                vnodes = max(vnodes, 1)
+            ring.extend((_hash(f"{node}#{i}"), node) for i in range(vnodes))
+        ring.sort()
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+        self.weights = dict(weights)
+
+    def nodes_for(self, key: str) -> List[str]:
+        """Все узлы кольца по часовой стрелке от позиции ключа (первый - владелец ключа)."""
+        if not self._points:
+            return []
+        start = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        nodes: List[str] = []
+        for i in range(len(self._points)):
+            node = self._owners[(start + i) % len(self._points)]
+            if node not in nodes:
+                nodes.append(node)
+        return nodes
@@ -0,0 +1,92 @@
+# Keyset-пагинация списков по (created_at, id).
+# Страница читается по индексу начиная с курсора (WHERE (created_at, id) < курсор ... LIMIT n),
+# поэтому время ответа не зависит от размера воркспейса и номера страницы (в отличие от OFFSET).
+# Курсор следующей страницы и оценка общего числа строк отдаются в заголовках ответа,
+# тело остается списком.
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_ESTIMATE_HEADER = "X-Total-Count-Estimate"
+
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(query: Select, model, cursor: Optional[str], limit: int, descending: bool = True) -> Select:
+    """Запрос страницы: query с условием курсора, сортировкой по (created_at, id) и LIMIT limit + 1."""
+    key = tuple_(model.created_at, model.id)
+    if cursor:
+        position = tuple_(*decode_cursor(cursor))
+        query = query.where(key < position if descending else key > position)
+    if descending:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at.asc(), model.id.asc())
+    return query.limit(limit + 1)  # +1: есть ли следующая страница
+
+
+async def keyset_page(
+        db: AsyncSession,
+        query: Select,
+        model,
+        cursor: Optional[str],
+        limit: int,
+        descending: bool = True
+) -> Tuple[List, Optional[str]]:
+    """
+    Одна страница query (select(model) с фильтрами) и курсор следующей (None - страница последняя).
+    descending=True - от новых к старым.
+    """
+    result = await db.execute(keyset_query(query, model, cursor, limit, descending))
+    rows = list(result.scalars().all())
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+async def estimate_count(db: AsyncSession, query: Select) -> Optional[int]:
+    """
+    Оценка числа строк query по плану Postgres (EXPLAIN, без выполнения и без COUNT(*)).
+    None - оценить не удалось. EXPLAIN выполняется в savepoint: его ошибка не обрывает транзакцию запроса.
+    """
+    try:
+        compiled = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+        async with db.begin_nested():
+            # exec_driver_sql: SQL с подставленными литералами уходит драйверу как есть
+            connection = await db.connection()
+            result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")
+            plan = result.scalar_one()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception as e:
+        print(f"[Pagination] Count estimate failed: {e}")
+        return None
+
+
+def set_page_headers(response: Response, next_cursor: Optional[str], total_estimate: Optional[int]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if total_estimate is not None:
+        response.headers[TOTAL_COUNT_ESTIMATE_HEADER] = str(total_estimate)
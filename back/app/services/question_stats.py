@@ -0,0 +1,202 @@
+# Частые вопросы для аналитики (top_questions / top_unanswered_questions) без GROUP BY по сообщениям.
+# Для каждого воркспейса и дня ведется Space-Saving sketch нормализованных вопросов
+# (фиксированное число счетчиков, разные формулировки одного вопроса считаются вместе).
+# Воркер копит прирост в памяти и периодически вливает его в общий sketch в Postgres.
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionFactory
+from app.core.text_utils import normalize_question
+from app import models
+
+KIND_ALL = "all"
+KIND_UNANSWERED = "unanswered"
+
+
+class SpaceSavingSketch:
+    """
+    Space-Saving (Metwally et al.): не больше capacity счетчиков; новый вопрос при заполненном
+    sketch вытесняет наименьший счетчик и наследует его значение (как погрешность error).
+    Вопрос с реальной частотой > N / capacity гарантированно остается в sketch.
+    """
+
+    def __init__(self, capacity: int, counters: Optional[Dict[str, list]] = None):
+        self.capacity = capacity
+        self.counters: Dict[str, list] = counters or {}  # key -> [count, error, формулировка, ticket_id]
+
+    def offer(self, key: str, display: str, ref: Optional[str] = None, count: int = 1, error: int = 0):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += count
+            counter[1] += error
+            if ref:
+                counter[3] = ref
+            return
+        if len(self.counters) >= self.capacity:
+            min_key = min(self.counters, key=lambda k: self.counters[k][0])
+            min_count = self.counters.pop(min_key)[0]
+            count += min_count
+            error += min_count
+        self.counters[key] = [count, error, display, ref]
+
+    def merge(self, other: "SpaceSavingSketch"):
+        """Вливает другой sketch: счетчики складываются, остаются capacity наибольших."""
+        for key, (count, error, display, ref) in other.counters.items():
+            counter = self.counters.get(key)
+            if counter is not None:
+                counter[0] += count
+                counter[1] += error
+                if ref:
+                    counter[3] = ref
+            else:
+                self.counters[key] = [count, error, display, ref]
+        if len(self.counters) > self.capacity:
+            top = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)[:self.capacity]
+            self.counters = dict(top)
+
+    def top(self, n: int) -> List[Tuple[str, int, Optional[str]]]:
+        """[(формулировка, count, ticket_id)] по убыванию count."""
+        top = sorted(self.counters.values(), key=lambda counter: counter[0], reverse=True)[:n]
+        return [(display, count, ref) for count, error, display, ref in top]
+
+
+class QuestionStats:
+    """Прирост sketch'ей в памяти воркера: (workspace_id, day, kind) -> SpaceSavingSketch."""
+
+    def __init__(self, capacity: int, flush_interval_seconds: float, retention_days: int):
+        self.capacity = capacity
+        self.flush_interval_seconds = flush_interval_seconds
+        self.retention_days = retention_days
+        self._deltas: Dict[Tuple[UUID, date, str], SpaceSavingSketch] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _delta(self, workspace_id: UUID, kind: str) -> SpaceSavingSketch:
+        key = (workspace_id, datetime.now(timezone.utc).date(), kind)
+        sketch = self._deltas.get(key)
+        if sketch is None:
+            sketch = self._deltas[key] = SpaceSavingSketch(self.capacity)
+        return sketch
+
+    def record(self, workspace_id: UUID, question: str, ticket_id: Optional[UUID] = None):
+        """Учитывает вопрос. ticket_id - вопрос остался без ответа (создан тикет)."""
+        key = normalize_question(question)
+        if not key:
+            return
+        self._delta(workspace_id, KIND_ALL).offer(key, question)
+        if ticket_id:
+            self._delta(workspace_id, KIND_UNANSWERED).offer(key, question, ref=str(ticket_id))
+
+    async def flush(self):
+        """Вливает накопленный прирост в sketch'и в БД (строка блокируется на время слияния)."""
+        deltas, self._deltas = self._deltas, {}
+        for index, ((workspace_id, day, kind), delta) in enumerate(deltas.items()):
+            try:
+                async with AsyncSessionFactory() as db:
+                    await db.execute(
+                        insert(models.QuestionSketch)
+                        .values(workspace_id=workspace_id, day=day, kind=kind, state={})
+                        .on_conflict_do_nothing(index_elements=["workspace_id", "day", "kind"])
+                    )
+                    result = await db.execute(
+                        select(models.QuestionSketch)
+                        .where(
+                            models.QuestionSketch.workspace_id == workspace_id,
+                            models.QuestionSketch.day == day,
+                            models.QuestionSketch.kind == kind
+                        )
+                        .with_for_update()
+                    )
+                    row = result.scalar_one()
+                    # Копия счетчиков: исходный row.state не меняем, иначе изменение JSON не заметится
+                    sketch = SpaceSavingSketch(self.capacity, {k: list(v) for k, v in row.state.items()})
+                    sketch.merge(delta)
+                    row.state = sketch.counters
+                    await db.commit()
+            except asyncio.CancelledError:
+                self._requeue(list(deltas.items())[index:])
+                raise
+            except Exception as e:
+                print(f"[Question Stats] Flush failed for workspace {workspace_id}: {e}")
+                self._requeue([((workspace_id, day, kind), delta)])
+
+    def _requeue(self, items):
+        for key, delta in items:
+            current = self._deltas.get(key)
+            if current is None:
+                self._deltas[key] = delta
+            else:
+                delta.merge(current)
+                self._deltas[key] = delta
+
+    async def _cleanup(self):
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=self.retention_days)
+        async with AsyncSessionFactory() as db:
+            await db.execute(delete(models.QuestionSketch).where(models.QuestionSketch.day < cutoff))
+            await db.commit()
+
+    async def _loop(self):
+        last_cleanup = None
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await self.flush()
+                today = datetime.now(timezone.utc).date()
+                if last_cleanup != today:
+                    await self._cleanup()
+                    last_cleanup = today
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Question Stats] Error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Останавливает фоновую запись и вливает остаток прироста."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def top(
+            self, db: AsyncSession, workspace_id: UUID, kind: str, since: datetime, n: int
+    ) -> List[Tuple[str, int, Optional[str]]]:
+        """
+        Top-n вопросов воркспейса с дня since: слияние не больше retention_days дневных sketch'ей.
+        Окно - целые календарные дни (UTC): с полуночи дня since, т.е. до суток шире
+        почасового окна счетчиков get_period_totals (для "24h" - вчера и сегодня).
+        """
+        result = await db.execute(
+            select(models.QuestionSketch.state)
+            .where(
+                models.QuestionSketch.workspace_id == workspace_id,
+                models.QuestionSketch.kind == kind,
+                models.QuestionSketch.day >= since.date()
+            )
+        )
+        sketch = SpaceSavingSketch(self.capacity)
+        for (state,) in result.all():
+            sketch.merge(SpaceSavingSketch(self.capacity, dict(state)))
+        return sketch.top(n)
+
+
+# --- Единый экземпляр QuestionStats ---
+question_stats = QuestionStats(
+    capacity=settings.QUESTION_SKETCH_CAPACITY,
+    flush_interval_seconds=settings.QUESTION_SKETCH_FLUSH_SECONDS,
+    retention_days=settings.QUESTION_SKETCH_RETENTION_DAYS
+)
@@ -0,0 +1,201 @@
+# Ограничение частоты запросов публичного виджета (token bucket).
+# Запрос проходит, только если есть токен во всех его бакетах: воркспейса, сессии чата и IP.
+# Один "шумный" виджет упирается в свой лимит и не забивает 'back-ai' для остальных воркспейсов.
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionFactory
+from app import schemas, models
+
+
+# Бакет полностью пополняется за минуту (capacity = лимит в минуту): простаивающий дольше
+# бакет равносилен отсутствующему, и его строку можно удалить
+BUCKET_REFILL_SECONDS = 60
+
+
+class BucketLimit(NamedTuple):
+    key: str
+    per_minute: int
+
+    @property
+    def rate(self) -> float:
+        """Пополнение, токенов в секунду."""
+        return self.per_minute / 60
+
+    @property
+    def capacity(self) -> float:
+        """Максимальный всплеск: лимит за минуту."""
+        return float(self.per_minute)
+
+
+class MemoryTokenBuckets:
+    """Бакеты в памяти воркера (LRU, не больше max_buckets)."""
+
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated_at)
+
+    def _tokens(self, limit: BucketLimit, now: float) -> float:
+        tokens, updated_at = self._buckets.get(limit.key, (limit.capacity, now))
+        return min(limit.capacity, tokens + (now - updated_at) * limit.rate)
+
+    async def acquire(self, limits: List[BucketLimit]) -> float:
+        """Списывает по токену из каждого бакета. Возвращает 0 или через сколько секунд повторить."""
+        now = time.monotonic()
+        available = [(limit, self._tokens(limit, now)) for limit in limits]
+        retry_after = max(((1 - tokens) / limit.rate for limit, tokens in available if tokens < 1), default=0.0)
+        if retry_after > 0:
+            return retry_after
+
+        for limit, tokens in available:
+            self._buckets[limit.key] = (tokens - 1, now)
+            self._buckets.move_to_end(limit.key)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return 0.0
+
+
+class PostgresTokenBuckets:
+    """
+    Общие для всех воркеров бакеты в таблице rate_limit_buckets.
+    Пополнение и списание - один атомарный INSERT ... ON CONFLICT DO UPDATE на бакет,
+    все бакеты запроса - в одной транзакции (при отказе ничего не списывается).
+    Ключи сессий и IP задают клиенты, поэтому простаивающие (уже полные) бакеты периодически удаляются.
+    """
+
+    @staticmethod
+    def _refilled(limit: BucketLimit):
+        bucket = models.RateLimitBucket.__table__
+        elapsed = func.extract("epoch", func.now() - bucket.c.updated_at)
+        return func.least(limit.capacity, bucket.c.tokens + elapsed * limit.rate)
+
+    async def acquire(self, limits: List[BucketLimit]) -> float:
+        bucket = models.RateLimitBucket.__table__
+        async with AsyncSessionFactory() as db:
+            for limit in limits:
+                refilled = self._refilled(limit)
+                result = await db.execute(
+                    insert(bucket)
+                    .values(key=limit.key, tokens=limit.capacity - 1, updated_at=func.now())
+                    .on_conflict_do_update(
+                        index_elements=["key"],
+                        set_={"tokens": refilled - 1, "updated_at": func.now()},
+                        where=refilled >= 1
+                    )
+                    .returning(bucket.c.tokens)
+                )
+                if result.first() is None:
+                    tokens = (await db.execute(select(refilled).where(bucket.c.key == limit.key))).scalar_one()
+                    await db.rollback()
+                    return max((1 - tokens) / limit.rate, 0.0)
+            await db.commit()
+        return 0.0
+
+    async def prune(self) -> int:
+        """Удаляет бакеты, простаивающие дольше полного пополнения. Возвращает кол-во удаленных."""
+        bucket = models.RateLimitBucket.__table__
+        async with AsyncSessionFactory() as db:
+            result = await db.execute(
+                delete(bucket).where(
+                    bucket.c.updated_at < func.now() - text(f"interval '{BUCKET_REFILL_SECONDS} seconds'")
+                )
+            )
+            await db.commit()
+            return result.rowcount
+
+
+class RateLimiter:
+    def __init__(self, backend: str, prune_interval_seconds: float):
+        if backend == "postgres":
+            self.buckets = PostgresTokenBuckets()
+        else:
+            self.buckets = MemoryTokenBuckets(max_buckets=settings.RATE_LIMIT_MAX_BUCKETS)
+        self.prune_interval_seconds = prune_interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(self.prune_interval_seconds)
+            try:
+                removed = await self.buckets.prune()
+                if removed:
+                    print(f"[Rate Limit] Pruned {removed} idle bucket(s)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Rate Limit] Prune failed: {e}")
+
+    def start(self):
+        """Фоновая очистка простаивающих бакетов (только для общих бакетов в Postgres)."""
+        if self._task is None and isinstance(self.buckets, PostgresTokenBuckets):
+            self._task = asyncio.create_task(self._prune_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @staticmethod
+    def _limits(
+            workspace_id: UUID, session_id: UUID, client_ip: Optional[str], widget_settings: schemas.WidgetSettings
+    ) -> List[BucketLimit]:
+        limits = [
+            BucketLimit(
+                f"ws:{workspace_id}",
+                widget_settings.rate_limit_per_minute or settings.RATE_LIMIT_WORKSPACE_PER_MINUTE
+            ),
+            BucketLimit(
+                f"session:{workspace_id}:{session_id}",
+                widget_settings.session_rate_limit_per_minute or settings.RATE_LIMIT_SESSION_PER_MINUTE
+            ),
+        ]
+        if client_ip:
+            limits.append(BucketLimit(
+                f"ip:{workspace_id}:{client_ip}",
+                widget_settings.ip_rate_limit_per_minute or settings.RATE_LIMIT_IP_PER_MINUTE
+            ))
+        return limits
+
+    async def check(
+            self,
+            workspace_id: UUID,
+            session_id: UUID,
+            client_ip: Optional[str],
+            widget_settings: schemas.WidgetSettings
+    ):
+        """Пропускает запрос или выбрасывает 429 с Retry-After."""
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        try:
+            retry_after = await self.buckets.acquire(self._limits(workspace_id, session_id, client_ip, widget_settings))
+        except Exception as e:
+            # Лимитер не должен ронять виджет (например, если БД недоступна в режиме postgres)
+            print(f"[Rate Limit] Check failed, allowing request: {e}")
+            return
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+
+# --- Единый экземпляр RateLimiter ---
+rate_limiter = RateLimiter(
+    backend=settings.RATE_LIMIT_BACKEND,
+    prune_interval_seconds=settings.RATE_LIMIT_PRUNE_INTERVAL_SECONDS
+)
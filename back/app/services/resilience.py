@@ -0,0 +1,94 @@
+# Примитивы отказоустойчивости для вызовов 'back-ai':
+# circuit breaker (быстрый отказ, пока сервис нездоров) и бюджет повторов.
+import time
+
+
+# Ответы, которые говорят о нездоровье экземпляра, а не об ошибке конкретного запроса
+UNHEALTHY_STATUS_CODES = {502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Вызов не выполнялся: circuit breaker открыт."""
+
+
+def is_unhealthy_response(status_code: int, retry_after: bool) -> bool:
+    """
+    Считается ли ответ отказом экземпляра (для circuit breaker и повторов).
+    500 - ошибка обработки конкретного запроса (плохой файл и т.п.), 503 с Retry-After -
+    перегрузка (backpressure): в обоих случаях экземпляр жив.
+    """
+    if status_code not in UNHEALTHY_STATUS_CODES:
+        return False
+    return not (status_code == 503 and retry_after)
+
+
+class CircuitBreaker:
+    """
+    CLOSED -> (failure_threshold ошибок подряд) -> OPEN -> (reset_timeout) -> HALF_OPEN.
+    В HALF_OPEN пропускается один пробный запрос: успех закрывает цепь, ошибка снова открывает.
+    Состояние хранится в памяти процесса: каждый воркер/реплика 'back' считает ошибки сам.
+    """
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            print(f"[Circuit {self.name}] Closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_cancelled(self):
+        """Запрос отменен до получения результата (например, проигравший hedged-запрос)."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                print(f"[Circuit {self.name}] Opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class RetryBudget:
+    """
+    Бюджет повторов (и hedged-запросов): каждый обычный запрос добавляет `ratio` токена,
+    каждый повтор тратит один. Не дает повторам умножить нагрузку на больной сервис.
+    """
+
+    def __init__(self, ratio: float, max_balance: float):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self.balance = max_balance
+
+    def record_request(self):
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.balance >= 1.0:
+            self.balance -= 1.0
+            return True
+        return False
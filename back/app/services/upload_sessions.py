@@ -0,0 +1,183 @@
+# Возобновляемая загрузка больших файлов.
+# Сессия хранится в томе file_storage: uploads/<upload_id>.part (полученные байты)
+# и uploads/<upload_id>.json (метаданные). Текущее смещение = размер .part файла,
+# поэтому после обрыва клиент продолжает с того же места, даже если запрос попал на другой воркер.
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, NamedTuple, Optional
+from uuid import UUID
+
+from app.core.config import settings
+from app.services.file_storage import FILE_STORAGE_PATH, StoredFile, UploadTooLargeError
+
+UPLOADS_PATH = os.path.join(FILE_STORAGE_PATH, "uploads")  # Тот же том, что и blobs: rename атомарен
+os.makedirs(UPLOADS_PATH, exist_ok=True)
+CLEANUP_INTERVAL_SECONDS = 600  # Просроченные сессии ищутся не чаще (скан всего каталога)
+_last_cleanup: Optional[float] = None  # time.monotonic() последней очистки
+
+
+class UploadSessionError(Exception):
+    """Некорректная операция с сессией загрузки (смещение, размер, контрольная сумма)."""
+
+
+class UploadBusyError(UploadSessionError):
+    """В сессию уже пишет другой запрос."""
+
+
+class UploadNotFoundError(UploadSessionError):
+    """Сессии нет: истекла, отменена или уже завершена."""
+
+
+class UploadSession(NamedTuple):
+    upload_id: UUID
+    workspace_id: UUID
+    filename: str
+    size: int
+    offset: int
+
+
+def _part_path(upload_id: UUID) -> str:
+    return os.path.join(UPLOADS_PATH, f"{upload_id}.part")
+
+
+def _meta_path(upload_id: UUID) -> str:
+    return os.path.join(UPLOADS_PATH, f"{upload_id}.json")
+
+
+def _cleanup_expired_sessions():
+    """
+    Удаляет сессии, к которым не обращались дольше UPLOAD_SESSION_TTL_HOURS
+    (append_part обновляет mtime обоих файлов сессии).
+    """
+    deadline = time.time() - settings.UPLOAD_SESSION_TTL_HOURS * 3600
+    for name in os.listdir(UPLOADS_PATH):
+        path = os.path.join(UPLOADS_PATH, name)
+        try:
+            if os.path.getmtime(path) < deadline:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _create_session_files(upload_id: UUID, workspace_id: UUID, filename: str, size: int):
+    open(_part_path(upload_id), "wb").close()
+    with open(_meta_path(upload_id), "w", encoding="utf-8") as f:
+        json.dump({"workspace_id": str(workspace_id), "filename": filename, "size": size}, f)
+
+
+async def create_session(workspace_id: UUID, filename: str, size: int) -> UploadSession:
+    """Создает сессию загрузки файла заданного размера. Файловые операции - в пуле потоков."""
+    global _last_cleanup
+    if size > settings.MAX_UPLOAD_SIZE_BYTES:
+        raise UploadTooLargeError(f"File exceeds the maximum size of {settings.MAX_UPLOAD_SIZE_BYTES} bytes")
+    if _last_cleanup is None or time.monotonic() - _last_cleanup >= CLEANUP_INTERVAL_SECONDS:
+        _last_cleanup = time.monotonic()
+        await asyncio.to_thread(_cleanup_expired_sessions)
+
+    upload_id = uuid.uuid4()
+    await asyncio.to_thread(_create_session_files, upload_id, workspace_id, filename, size)
+    return UploadSession(upload_id, workspace_id, filename, size, 0)
+
+
+def get_session(workspace_id: UUID, upload_id: UUID) -> Optional[UploadSession]:
+    """Сессия загрузки воркспейса (или None, если ее нет)."""
+    try:
+        with open(_meta_path(upload_id), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        offset = os.path.getsize(_part_path(upload_id))
+    except (OSError, ValueError):
+        return None
+    if meta["workspace_id"] != str(workspace_id):
+        return None
+    return UploadSession(upload_id, workspace_id, meta["filename"], meta["size"], offset)
+
+
+def _open_locked(upload_id: UUID, mode: str):
+    """
+    Открывает .part сессии (без создания) под эксклюзивным flock.
+    Пока блокировка у нас, сессию не допишет и не завершит другой запрос (в т.ч. на другом воркере).
+    """
+    try:
+        part_file = open(_part_path(upload_id), mode)
+    except FileNotFoundError:
+        raise UploadNotFoundError("Upload session not found or already completed")
+    try:
+        fcntl.flock(part_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Метаданные удаляются при завершении и отмене: проверяем уже под блокировкой
+        os.utime(_meta_path(upload_id))
+    except BlockingIOError:
+        part_file.close()
+        raise UploadBusyError("Another request is writing or completing this upload")
+    except FileNotFoundError:
+        part_file.close()
+        raise UploadNotFoundError("Upload session not found or already completed")
+    return part_file
+
+
+async def append_part(session: UploadSession, offset: int, body: AsyncIterator[bytes]) -> UploadSession:
+    """
+    Дописывает часть файла, начиная с offset (должен совпадать с текущим смещением сессии).
+    Данные пишутся на диск по мере получения; при обрыве сохраняется все, что успело прийти.
+    """
+    part_file = await asyncio.to_thread(_open_locked, session.upload_id, "r+b")
+    try:
+        current = part_file.seek(0, os.SEEK_END)
+        if offset != current:
+            raise UploadSessionError(f"Offset mismatch: expected {current}, got {offset}")
+
+        written = current
+        async for chunk in body:
+            if written + len(chunk) > session.size:
+                raise UploadSessionError(f"Part exceeds the declared file size of {session.size} bytes")
+            await asyncio.to_thread(part_file.write, chunk)
+            written += len(chunk)
+        await asyncio.to_thread(part_file.flush)
+    finally:
+        await asyncio.to_thread(part_file.close)  # Закрытие снимает flock
+    return session._replace(offset=written)
+
+
+def _sha256_of_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(settings.UPLOAD_CHUNK_SIZE_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def finalize_session(session: UploadSession, expected_sha256: str) -> StoredFile:
+    """
+    Проверяет полноту и контрольную сумму файла и закрывает сессию (под flock .part:
+    параллельный complete получит UploadBusyError или UploadNotFoundError).
+    Возвращает временный файл для передачи в обычный путь обработки (ingest_stored_file).
+    """
+    part_path = _part_path(session.upload_id)
+    part_file = await asyncio.to_thread(_open_locked, session.upload_id, "rb")
+    try:
+        size = os.fstat(part_file.fileno()).st_size
+        if size != session.size:
+            raise UploadSessionError(f"Upload is incomplete: {size} of {session.size} bytes received")
+        sha256 = await asyncio.to_thread(_sha256_of_file, part_path)
+        if sha256 != expected_sha256.lower():
+            raise UploadSessionError("Checksum mismatch")
+        os.remove(_meta_path(session.upload_id))
+    finally:
+        await asyncio.to_thread(part_file.close)
+    return StoredFile(path=part_path, sha256=sha256, size=session.size)
+
+
+def abort_session(session: UploadSession):
+    """Удаляет сессию и полученные данные."""
+    for path in (_part_path(session.upload_id), _meta_path(session.upload_id)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
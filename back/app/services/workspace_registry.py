@@ -0,0 +1,90 @@
+# Реестр воркспейсов для публичного виджета: существует ли воркспейс и его настройки виджета.
+# Загружается целиком при старте, обновляется при создании/изменении/удалении воркспейса
+# (в других воркерах - через notifications), поэтому /public/query не читает БД.
+import asyncio
+import time
+from typing import Dict, Optional
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionFactory
+from app.core.notifications import notifications
+from app import schemas, models
+
+TOPIC = "workspace_registry"
+
+
+class WorkspaceRegistry:
+    """
+    workspace_id -> WidgetSettings. Промах (воркспейс создан в другом воркере, а событие еще не дошло)
+    проверяется в БД; отсутствующие id запоминаются на WORKSPACE_REGISTRY_MISS_TTL_SECONDS,
+    чтобы запросы виджета с несуществующим id не нагружали БД.
+    """
+
+    def __init__(self, miss_ttl_seconds: float):
+        self.miss_ttl_seconds = miss_ttl_seconds
+        self._workspaces: Dict[UUID, schemas.WidgetSettings] = {}
+        self._misses: Dict[UUID, float] = {}
+        notifications.subscribe(TOPIC, self._apply_event, on_reset=self._schedule_reload)
+
+    @staticmethod
+    def _parse(widget_settings: Optional[dict]) -> schemas.WidgetSettings:
+        return schemas.WidgetSettings(**(widget_settings or {}))
+
+    async def load(self):
+        """Загружает все воркспейсы из БД (при старте и после переподключения notifications)."""
+        async with AsyncSessionFactory() as db:
+            result = await db.execute(select(models.Workspace.id, models.Workspace.widget_settings))
+            rows = result.all()
+        self._workspaces = {workspace_id: self._parse(widget_settings) for workspace_id, widget_settings in rows}
+        self._misses.clear()
+        print(f"[Workspace Registry] Loaded {len(self._workspaces)} workspace(s)")
+
+    def _schedule_reload(self):
+        asyncio.get_running_loop().create_task(self.load())
+
+    async def resolve(self, workspace_id: UUID) -> Optional[schemas.WidgetSettings]:
+        """Настройки виджета воркспейса или None, если воркспейса нет."""
+        widget_settings = self._workspaces.get(workspace_id)
+        if widget_settings is not None:
+            return widget_settings
+
+        missed_at = self._misses.get(workspace_id)
+        if missed_at is not None and time.monotonic() - missed_at <= self.miss_ttl_seconds:
+            return None
+
+        async with AsyncSessionFactory() as db:
+            result = await db.execute(
+                select(models.Workspace.widget_settings).where(models.Workspace.id == workspace_id)
+            )
+            row = result.first()
+        if row is None:
+            self._misses[workspace_id] = time.monotonic()
+            return None
+        widget_settings = self._workspaces[workspace_id] = self._parse(row[0])
+        return widget_settings
+
+    async def publish_upsert(self, db: AsyncSession, workspace: models.Workspace):
+        """Вызывать до db.commit(): событие уходит другим воркерам вместе с транзакцией."""
+        await notifications.publish(db, TOPIC, {
+            "op": "upsert", "workspace_id": str(workspace.id), "widget_settings": workspace.widget_settings
+        })
+
+    async def publish_delete(self, db: AsyncSession, workspace_id: UUID):
+        """Вызывать до db.commit()."""
+        await notifications.publish(db, TOPIC, {"op": "delete", "workspace_id": str(workspace_id)})
+
+    def _apply_event(self, data: dict):
+        workspace_id = UUID(data["workspace_id"])
+        if data["op"] == "delete":
+            self._workspaces.pop(workspace_id, None)
+        else:
+            self._workspaces[workspace_id] = self._parse(data.get("widget_settings"))
+            self._misses.pop(workspace_id, None)
+
+
+# --- Единый экземпляр WorkspaceRegistry ---
+workspace_registry = WorkspaceRegistry(miss_ttl_seconds=settings.WORKSPACE_REGISTRY_MISS_TTL_SECONDS)
@@ -0,0 +1,79 @@
+# Нагрузочный тест входа: пропускная способность /auth/login и отзывчивость
+# остальных запросов во время шторма логинов (если bcrypt блокирует event loop,
+# задержка GET / растет вместе с числом одновременных входов).
+#
+# Запуск (против запущенного back):
+#   python scripts/bench_login.py --url http://localhost:8000 --email admin@company.com --password admin \
+#       --requests 200 --concurrency 20
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def _login_worker(client, queue, args, latencies, errors):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        started = time.perf_counter()
+        response = await client.post(
+            "/api/v1/auth/login", json={"email": args.email, "password": args.password}
+        )
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+async def _probe(client, stop, latencies):
+    """Легкий запрос раз в 50 мс: его задержка показывает, блокируется ли event loop."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+
+
+async def main(args):
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(None)
+
+    login_latencies, probe_latencies, errors = [], [], []
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        probe_task = asyncio.create_task(_probe(client, stop, probe_latencies))
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            _login_worker(client, queue, args, login_latencies, errors) for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe_task
+
+    print(f"Logins:     {args.requests} in {elapsed:.2f}s -> {args.requests / elapsed:.1f} req/s, errors: {len(errors)}")
+    print(f"Login:      p50={_percentile(login_latencies, 0.5) * 1000:.0f}ms "
+          f"p95={_percentile(login_latencies, 0.95) * 1000:.0f}ms")
+    if probe_latencies:
+        print(f"GET / probe: p50={_percentile(probe_latencies, 0.5) * 1000:.0f}ms "
+              f"p95={_percentile(probe_latencies, 0.95) * 1000:.0f}ms "
+              f"max={max(probe_latencies) * 1000:.0f}ms mean={statistics.mean(probe_latencies) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Login throughput benchmark")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", default="admin@company.com")
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
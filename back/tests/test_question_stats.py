@@ -0,0 +1,67 @@
+# Space-Saving sketch частых вопросов: счетчики, вытеснение наименьшего и слияние sketch'ей.
+# Модулю нужны зависимости и настройки 'back' (.env или переменные окружения), иначе тесты пропускаются.
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("asyncpg")
+pytest.importorskip("pydantic_settings")
+
+try:
+    from app.services.question_stats import SpaceSavingSketch
+except Exception as e:  # Не заданы настройки (SECRET_KEY, DATABASE_URL, ...)
+    pytest.skip(f"app settings are not available: {e}", allow_module_level=True)
+
+
+def test_offer_counts_repeated_questions():
+    sketch = SpaceSavingSketch(capacity=3)
+    sketch.offer("a", "A?")
+    sketch.offer("b", "B?")
+    sketch.offer("a", "a?", ref="ticket-1")
+
+    assert sketch.counters["a"] == [2, 0, "A?", "ticket-1"]  # Формулировка - первая, ref - последний
+    assert sketch.top(10) == [("A?", 2, "ticket-1"), ("B?", 1, None)]
+
+
+def test_offer_evicts_smallest_counter_and_inherits_its_count():
+    sketch = SpaceSavingSketch(capacity=2)
+    for _ in range(3):
+        sketch.offer("a", "A?")
+    sketch.offer("b", "B?")
+    sketch.offer("c", "C?")
+
+    assert set(sketch.counters) == {"a", "c"}
+    assert sketch.counters["c"][:2] == [2, 1]  # count = 1 + вытесненный, error = вытесненный
+    assert sketch.counters["a"][:2] == [3, 0]
+
+
+def test_frequent_question_survives_eviction():
+    sketch = SpaceSavingSketch(capacity=5)
+    for i in range(200):
+        sketch.offer("hot", "Hot?")
+        sketch.offer(f"rare-{i}", f"Rare {i}?")
+
+    assert sketch.top(1)[0][0] == "Hot?"
+    assert len(sketch.counters) == 5
+    count, error = sketch.counters["hot"][:2]
+    assert count - error <= 200 <= count  # Реальная частота - в пределах [count - error, count]
+
+
+def test_merge_sums_counters_and_keeps_capacity_largest():
+    left = SpaceSavingSketch(capacity=2)
+    left.offer("a", "A?", count=5)
+    left.offer("b", "B?", count=1)
+    right = SpaceSavingSketch(capacity=2)
+    right.offer("a", "A!", count=2, error=1, ref="ticket-2")
+    right.offer("c", "C?", count=3)
+
+    left.merge(right)
+
+    assert left.counters == {"a": [7, 1, "A?", "ticket-2"], "c": [3, 0, "C?", None]}
+
+
+def test_top_limits_and_orders_by_count():
+    sketch = SpaceSavingSketch(capacity=10)
+    for key, count in [("a", 1), ("b", 3), ("c", 2)]:
+        sketch.offer(key, key.upper(), count=count)
+
+    assert sketch.top(2) == [("B", 3, None), ("C", 2, None)]
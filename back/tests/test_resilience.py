@@ -0,0 +1,62 @@
+# Circuit breaker вызовов 'back-ai': какие ответы считаются отказом экземпляра.
+# Ошибки конкретного запроса (плохой файл - 422/500) и перегрузка (503 + Retry-After) цепь не открывают.
+import asyncio
+
+import pytest
+
+from app.services.resilience import CircuitBreaker, is_unhealthy_response
+
+THRESHOLD = 3
+
+
+@pytest.mark.parametrize("status_code, retry_after, unhealthy", [
+    (200, False, False),
+    (422, False, False),
+    (500, False, False),
+    (502, False, True),
+    (503, False, True),
+    (503, True, False),
+    (504, False, True),
+])
+def test_is_unhealthy_response(status_code, retry_after, unhealthy):
+    assert is_unhealthy_response(status_code, retry_after) is unhealthy
+
+
+def test_breaker_opens_after_threshold_failures():
+    breaker = CircuitBreaker("test", failure_threshold=THRESHOLD, reset_timeout=60)
+    for _ in range(THRESHOLD):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_bad_file_responses_do_not_open_breaker():
+    """_send_raw с реальным httpx-клиентом: N ответов на плохие файлы - цепь остается закрытой."""
+    httpx = pytest.importorskip("httpx")
+    try:
+        from app.services.ai_client import AIClient, AIReplica
+    except Exception as e:  # Не установлены зависимости или не заданы настройки 'back'
+        pytest.skip(f"ai_client is not importable: {e}")
+
+    responses = iter([
+        httpx.Response(422, json={"detail": "Unsupported file type: a.exe"}),
+        httpx.Response(500, json={"detail": "Failed to parse a.pdf"}),
+        httpx.Response(503, json={"detail": "LLM is overloaded"}, headers={"Retry-After": "10"}),
+    ] * THRESHOLD * 2)
+
+    replica = AIReplica("http://back-ai.test")
+    replica.breaker = CircuitBreaker("test", failure_threshold=THRESHOLD, reset_timeout=60)
+    replica.client = httpx.AsyncClient(
+        base_url=replica.base_url, transport=httpx.MockTransport(lambda request: next(responses))
+    )
+
+    async def call_many():
+        for _ in range(THRESHOLD * 6):
+            with pytest.raises(httpx.HTTPStatusError):
+                await AIClient._send_raw(replica, "/process-file", timeout=5, json={})
+        await replica.client.aclose()
+
+    asyncio.run(call_many())
+    assert replica.breaker.state == CircuitBreaker.CLOSED
+    assert replica.breaker.allow_request()
@@ -54,6 +54,9 @@ export const WorkspaceKnowledge = () => {
   const [sources, setSources] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  // Курсор следующей страницы (заголовок X-Next-Cursor), null - страница последняя
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const [isUploadModalOpen, setIsUploadModalOpen] = useState(false);
   const [isQAModalOpen, setIsQAModalOpen] = useState(false);
@@ -69,18 +72,22 @@ export const WorkspaceKnowledge = () => {
     fetchKnowledgeSources();
   }, [workspaceId]);
 
-  // Загрузка источников
-  const fetchKnowledgeSources = async () => {
+  // Загрузка источников: cursor = null - первая страница (список заменяется), иначе следующая (дописывается)
+  const fetchKnowledgeSources = async (cursor = null) => {
     try {
-      setLoading(true);
+      cursor ? setLoadingMore(true) : setLoading(true);
       setError(null);
-      const response = await api.get(`/workspaces/${workspaceId}/knowledge`);
-      setSources(response.data);
+      const response = await api.get(`/workspaces/${workspaceId}/knowledge`, {
+        params: { cursor: cursor || undefined }
+      });
+      setSources(cursor ? (prev) => [...prev, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (err) {
       console.error("Failed to fetch sources:", err);
       setError("Не удалось загрузить источники знаний.");
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -217,6 +224,17 @@ export const WorkspaceKnowledge = () => {
               </li>
             ))}
           </ul>
+          {nextCursor && (
+            <div className="flex justify-center pt-4">
+              <button
+                onClick={() => fetchKnowledgeSources(nextCursor)}
+                disabled={loadingMore}
+                className="px-4 py-2 text-sm font-medium text-gray-700 bg-white border border-gray-300 rounded-md shadow-sm hover:bg-gray-50 disabled:opacity-50"
+              >
+                {loadingMore ? 'Загрузка...' : 'Показать еще'}
+              </button>
+            </div>
+          )}
            {sources.length === 0 && (
              <p className="text-center text-gray-500 py-10">
                База знаний пуста. Загрузите файлы или добавьте Q&A.
@@ -12,6 +12,9 @@ export const WorkspaceTickets = () => {
   const [tickets, setTickets] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  // Курсор следующей страницы (заголовок X-Next-Cursor), null - страница последняя
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const [selectedTicket, setSelectedTicket] = useState(null);
   const [resolveAnswer, setResolveAnswer] = useState('');
@@ -22,20 +25,23 @@ export const WorkspaceTickets = () => {
     fetchTickets();
   }, [workspaceId]);
 
-  const fetchTickets = async () => {
+  // cursor = null - первая страница (список заменяется), иначе следующая (дописывается)
+  const fetchTickets = async (cursor = null) => {
     try {
-      setLoading(true);
+      cursor ? setLoadingMore(true) : setLoading(true);
       setError(null);
       // Запрашиваем только ОТКРЫТЫЕ тикеты
       const response = await api.get(`/workspaces/${workspaceId}/tickets`, {
-        params: { status: 'OPEN' }
+        params: { status: 'OPEN', cursor: cursor || undefined }
       });
-      setTickets(response.data);
+      setTickets(cursor ? (prev) => [...prev, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (err) {
       console.error("Failed to fetch tickets:", err);
       setError("Не удалось загрузить тикеты.");
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -118,6 +124,18 @@ export const WorkspaceTickets = () => {
         </ul>
       )}
 
+      {!loading && !error && nextCursor && (
+        <div className="flex justify-center pt-4">
+          <button
+            onClick={() => fetchTickets(nextCursor)}
+            disabled={loadingMore}
+            className="px-4 py-2 text-sm font-medium text-gray-700 bg-white border border-gray-300 rounded-md shadow-sm hover:bg-gray-50 disabled:opacity-50"
+          >
+            {loadingMore ? 'Загрузка...' : 'Показать еще'}
+          </button>
+        </div>
+      )}
+
       {!loading && tickets.length === 0 && (
         <div className="text-center bg-gray-50 p-10 rounded-lg">
           <Archive className="w-12 h-12 mx-auto text-gray-400" />